@@ -0,0 +1,104 @@
+"""
+HTTP API benchmarks: the FastAPI app (web_demo/backend/app.py) driven
+in-process by concurrent clients over httpx's ASGI transport. No sockets
+are opened, but every request goes through routing, body validation,
+JSON encoding and the app's threadpool, as it would over the network.
+
+Each case splits its requests between CLIENTS clients that send theirs
+one after another, all clients at once. A run's time is the wall time of
+all requests; the latency percentiles come from the fastest run.
+"""
+import asyncio
+import random
+import time
+
+try:
+    import httpx
+    from web_demo.backend import app as web_app
+except ImportError:  # The API suite needs fastapi and httpx; the engine suite does not
+    httpx = web_app = None
+
+from benchmarks import dataset
+from benchmarks.engine_bench import POINT_OPS
+from benchmarks.results import result
+
+CLIENTS = 8
+PAGE_ROWS = 100
+
+
+async def _drive(requests, clients):
+    """Sends requests [(method, url, json body)] from clients concurrent clients: (wall time, latencies)."""
+    latencies = []
+    transport = httpx.ASGITransport(app=web_app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://pesadb.bench") as client:
+        async def worker(share):
+            for method, url, body in share:
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text[:200]}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(requests[i::clients]) for i in range(clients)))
+        return time.perf_counter() - start, latencies
+
+
+def _case(runs, clients):
+    """Runs each run's request list and turns the wall times and latencies into a result."""
+    times, best = [], None
+    for requests in runs:
+        elapsed, latencies = asyncio.run(_drive(requests, clients))
+        times.append(elapsed)
+        if best is None or elapsed <= min(times):
+            best = sorted(latencies)
+    return result(len(runs[0]), times, clients=clients,
+                  p50_ms=round(best[len(best) // 2] * 1000, 3),
+                  p99_ms=round(best[min(len(best) - 1, int(len(best) * 0.99))] * 1000, 3))
+
+
+def run(db_name, rows, repeat=3, clients=CLIENTS, durable=True, seed=0, report=None):
+    """
+    Runs every API case against db_name, which engine_bench.run has filled
+    with a dataset of rows orders. Returns {case: result}; report(case,
+    result) also gets each one as it is measured.
+    """
+    results = {}
+    sizes = dataset.table_sizes(rows)
+    requests = min(POINT_OPS, rows)
+    rng = random.Random(f"{seed}:api")
+    web_app.catalog.durable = durable
+    base = f"/{db_name}"
+    cases = []
+
+    cases.append(('page', [[('GET', f"{base}/orders/rows?limit={PAGE_ROWS}", None)] * requests
+                           for _ in range(repeat)]))
+    cases.append(('select_pk', [[('POST', f"{base}/execute", {"sql": "SELECT * FROM orders WHERE id = ?",
+                                                              "params": [rng.randrange(rows)]})
+                                 for _ in range(requests)] for _ in range(repeat)]))
+    # New ids above the engine suite's, removed again by the delete case
+    first = rows + POINT_OPS * (repeat + 1)
+    new_rows = [dataset.generate('orders', requests, sizes, seed, start=first + run * requests)
+                for run in range(repeat)]
+    cases.append(('insert', [[('POST', f"{base}/orders/rows", row) for row in new_rows[run]]
+                             for run in range(repeat)]))
+    cases.append(('update', [[('PUT', f"{base}/orders/rows/{rng.randrange(rows)}",
+                               {"amount": round(rng.uniform(1, 1000), 2)})
+                              for _ in range(requests)] for _ in range(repeat)]))
+    cases.append(('delete', [[('POST', f"{base}/execute", {"sql": "DELETE FROM orders WHERE id = ?",
+                                                           "params": [row['id']]}) for row in new_rows[run]]
+                             for run in range(repeat)]))
+    # A full scan per request: one request per client
+    cases.append(('aggregate', [[('POST', f"{base}/query", {
+        "table": "orders", "group_by": ["status"],
+        "aggregates": [{"func": "SUM", "column": "amount"}, {"func": "COUNT"}]})] * clients
+                                for _ in range(repeat)]))
+
+    try:
+        for case, runs in cases:
+            results[case] = _case(runs, clients)
+            if report is not None:
+                report(case, results[case])
+    finally:
+        web_app.catalog.close()
+    return results
@@ -0,0 +1,57 @@
+"""
+Synthetic databases for the benchmarks.
+
+A dataset of n rows is n orders, each referencing one of n / 10 customers
+and one of n / 100 products through foreign keys, so bulk loads and row
+writes pay for FK checks as they would in a real schema. Rows come from a
+seeded generator: the same size and seed always give the same database.
+"""
+import random
+
+STATUSES = ('paid', 'pending', 'refunded', 'shipped')
+CITIES = ('Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Malindi', 'Kitale')
+
+TABLES = [
+    # (name, columns, primary key, foreign keys), parents first
+    ('products', {'id': 'int', 'name': 'str', 'price': 'float'}, 'id', {}),
+    ('customers', {'id': 'int', 'name': 'str', 'city': 'str', 'email': 'str'}, 'id', {}),
+    ('orders', {'id': 'int', 'customer_id': 'int', 'product_id': 'int', 'amount': 'float',
+                'status': 'str', 'quantity': 'int', 'note': 'str'}, 'id',
+     {'customer_id': 'customers.id', 'product_id': 'products.id'}),
+]
+
+
+def parse_size(text):
+    """'1k' -> 1000, '100k' -> 100000, '1m' -> 1000000, '250' -> 250."""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000 * 1000}.get(text[-1:], 1)
+    try:
+        return int(float(text[:-1] if scale > 1 else text) * scale)
+    except ValueError:
+        raise ValueError(f"Invalid dataset size '{text}' (e.g. 1k, 100k, 1m).")
+
+
+def table_sizes(rows):
+    """{table: row count} of the dataset with the given number of orders."""
+    return {'products': max(rows // 100, 10), 'customers': max(rows // 10, 10), 'orders': rows}
+
+
+def create_tables(engine):
+    for name, columns, primary_key, foreign_keys in TABLES:
+        engine.create_table(name, dict(columns), primary_key=primary_key, foreign_keys=dict(foreign_keys))
+
+
+def generate(table, count, sizes, seed=0, start=0):
+    """count rows of table with ids start, start + 1, ...; sizes (table_sizes) bounds the FK values."""
+    rng = random.Random(f"{seed}:{table}:{start}")
+    if table == 'products':
+        return [{'id': i, 'name': f"product-{i}", 'price': round(rng.uniform(1, 500), 2)}
+                for i in range(start, start + count)]
+    if table == 'customers':
+        return [{'id': i, 'name': f"customer-{i}", 'city': rng.choice(CITIES), 'email': f"customer{i}@example.com"}
+                for i in range(start, start + count)]
+    customers, products = sizes['customers'], sizes['products']
+    return [{'id': i, 'customer_id': rng.randrange(customers), 'product_id': rng.randrange(products),
+             'amount': round(rng.uniform(1, 1000), 2), 'status': rng.choice(STATUSES),
+             'quantity': rng.randrange(1, 20), 'note': f"order {i}"}
+            for i in range(start, start + count)]
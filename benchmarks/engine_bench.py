@@ -0,0 +1,120 @@
+"""
+Engine benchmarks: DatabaseEngine calls on a synthetic dataset
+(benchmarks/dataset.py), timed in-process.
+
+Row-at-a-time cases (insert, select, update, delete) make POINT_OPS calls
+per run on keys drawn before the clock starts; whole-table cases (scan,
+join, cold open, remove_column) make one. The bulk load builds the
+dataset, so it is measured once whatever the repeat count.
+"""
+import random
+import time
+
+from core import storage
+from core.engine import DatabaseEngine
+from benchmarks import dataset
+from benchmarks.results import result
+
+POINT_OPS = 1000  # Row-at-a-time calls per run (capped at the dataset size)
+
+
+def _timed(repeat, work):
+    """Wall times of work(run) for each run."""
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        work(run)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _wait_for_compaction(engine):
+    """Joins the background compactors a schema change started (see DatabaseEngine._migrate_rows)."""
+    for thread in list(engine._migrations.values()):
+        thread.join()
+
+
+def run(db_name, rows, repeat=3, durable=True, seed=0, report=None):
+    """
+    Creates db_name with a dataset of rows orders and runs every case on it.
+    Returns {case: result}; report(case, result) also gets each one as
+    soon as it is measured. The engine is closed afterwards, the database kept.
+    """
+    results = {}
+    def record(case, entry):
+        results[case] = entry
+        if report is not None:
+            report(case, entry)
+
+    sizes = dataset.table_sizes(rows)
+    point_ops = min(POINT_OPS, rows)
+    rng = random.Random(seed)
+    engine = DatabaseEngine(durable=durable)
+    engine.set_active_db(db_name)
+    dataset.create_tables(engine)
+
+    # 1. Bulk load: parents untimed, then the orders with their FK checks
+    for table in ('products', 'customers'):
+        engine.insert_many(table, dataset.generate(table, sizes[table], sizes, seed))
+    orders = dataset.generate('orders', rows, sizes, seed)
+    start = time.perf_counter()
+    engine.insert_many('orders', orders)
+    record('bulk_load', result(rows, [time.perf_counter() - start]))
+    del orders
+    engine.create_index('orders', 'customer_id', 'orders_customer')
+    engine.checkpoint()
+
+    # 2. Row-at-a-time writes and reads; inserted rows are deleted again at the end
+    new_rows = [dataset.generate('orders', point_ops, sizes, seed, start=rows + run * point_ops)
+                for run in range(repeat)]
+    record('insert', result(point_ops, _timed(repeat, lambda run: [
+        engine.insert('orders', row) for row in new_rows[run]])))
+
+    keys = [[rng.randrange(rows) for _ in range(point_ops)] for _ in range(repeat)]
+    customers = [[rng.randrange(sizes['customers']) for _ in range(point_ops)] for _ in range(repeat)]
+    record('select_pk', result(point_ops, _timed(repeat, lambda run: [
+        engine.select('orders', {'id': key}) for key in keys[run]])))
+    record('sql_select_pk', result(point_ops, _timed(repeat, lambda run: [
+        engine.execute("SELECT * FROM orders WHERE id = ?", (key,)) for key in keys[run]])))
+    record('select_indexed', result(point_ops, _timed(repeat, lambda run: [
+        engine.select('orders', {'customer_id': customer}) for customer in customers[run]])))
+    record('select_scan', result(1, _timed(repeat, lambda run: engine.select(
+        'orders', {'status': 'refunded', 'quantity': 3}))))
+
+    amounts = [[round(rng.uniform(1, 1000), 2) for _ in range(point_ops)] for _ in range(repeat)]
+    record('update', result(point_ops, _timed(repeat, lambda run: [
+        engine.update('orders', key, {'amount': amount}) for key, amount in zip(keys[run], amounts[run])])))
+    record('delete', result(point_ops, _timed(repeat, lambda run: [
+        engine.delete('orders', {'id': row['id']}) for row in new_rows[run]])))
+
+    # 3. Whole-table operations
+    joined = []
+    times = _timed(repeat, lambda run: joined.append(len(engine.join('orders', 'customers', 'customer_id', 'id'))))
+    record('join', result(1, times, rows=joined[-1]))
+
+    opens = []
+    for _ in range(repeat):
+        engine.close()
+        storage.close_database(db_name)  # Drops the cached segments, maps and pooled rows
+        engine = DatabaseEngine(durable=durable)
+        start = time.perf_counter()
+        engine.set_active_db(db_name)
+        opens.append(time.perf_counter() - start)
+    record('cold_open', result(1, opens))
+
+    # 4. remove_column returns at once; the compactor then rewrites every row
+    removes, purges = [], []
+    for run in range(repeat):
+        column = f"bench_extra_{run}"
+        engine.add_column('orders', column, 'str', 'x')
+        _wait_for_compaction(engine)
+        start = time.perf_counter()
+        engine.remove_column('orders', column)
+        removes.append(time.perf_counter() - start)
+        _wait_for_compaction(engine)
+        purges.append(time.perf_counter() - start)
+    record('remove_column', result(1, removes))
+    record('remove_column_purge', result(rows, purges))
+
+    engine.close()
+    return results
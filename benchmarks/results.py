@@ -0,0 +1,101 @@
+"""
+Benchmark results: the JSON file a run writes and the regression check
+against a saved baseline.
+
+A results file is {"meta": {...}, "results": {name: result}} where name is
+suite/size/case (e.g. "engine/100k/select_pk") and a result holds the op
+count and every run's wall time. Comparisons use per_op_us, the best run's
+time per op: the fastest of several runs is the least disturbed by the
+rest of the machine.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_THRESHOLD = 0.2  # Slowdown (fraction of the baseline's per_op_us) reported as a regression
+
+
+def result(ops, runs, **extra):
+    """One case's entry: ops per run and the wall time (seconds) of each run, plus extra figures."""
+    best = min(runs)
+    entry = {
+        "ops": ops,
+        "best_s": round(best, 6),
+        "median_s": round(statistics.median(runs), 6),
+        "per_op_us": round(best / ops * 1e6, 3) if ops else None,
+        "ops_per_s": round(ops / best, 1) if best else None,
+        "runs_s": [round(t, 6) for t in runs],
+    }
+    entry.update(extra)
+    return entry
+
+
+def metadata(**settings):
+    """Where and how a run was made, so results from different machines are not compared unawares."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        **settings,
+    }
+
+
+def save(path, meta, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path):
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return data['meta'], data['results']
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Cannot read benchmark results '{path}': {e}")
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Rows (name, baseline per_op_us, current per_op_us, change, status) for
+    every case in either result set. change is the relative slowdown;
+    status is 'REGRESSION' beyond threshold, 'faster' beyond -threshold,
+    'ok' in between, and 'new' / 'missing' for cases only one side has.
+    """
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        before = baseline.get(name, {}).get('per_op_us')
+        after = current.get(name, {}).get('per_op_us')
+        if before is None or after is None:
+            rows.append((name, before, after, None, 'new' if before is None else 'missing'))
+            continue
+        change = after / before - 1 if before else 0.0
+        status = 'REGRESSION' if change > threshold else 'faster' if change < -threshold else 'ok'
+        rows.append((name, before, after, change, status))
+    return rows
+
+
+def format_comparison(rows):
+    lines = [f"{'case':<40} {'baseline us/op':>15} {'current us/op':>15} {'change':>9}  status"]
+    for name, before, after, change, status in rows:
+        lines.append(f"{name:<40} {_us(before):>15} {_us(after):>15} "
+                     f"{'' if change is None else f'{change:+.1%}':>9}  {status}")
+    regressions = sum(1 for row in rows if row[4] == 'REGRESSION')
+    lines.append(f"{regressions} regression(s) in {len(rows)} case(s).")
+    return '\n'.join(lines)
+
+
+def _us(value):
+    return '-' if value is None else f"{value:.1f}"
@@ -0,0 +1,116 @@
+"""
+Runs the PesaDB benchmark suite and compares results against a baseline.
+
+    python benchmarks/run.py [--sizes 1k,100k,1m] [--suites engine,api] [--repeat 3]
+                             [--clients 8] [--output FILE] [--baseline FILE] [--threshold 0.2]
+    python benchmarks/run.py --compare BASELINE CURRENT [--threshold 0.2]
+
+Every size gets a fresh synthetic database (benchmarks/dataset.py) in a
+temporary data directory, never data/. The engine suite times
+DatabaseEngine calls; the API suite drives the FastAPI app with
+concurrent in-process clients (it needs fastapi and httpx). Results go
+to a JSON file. With --baseline (or --compare), every case whose time per
+op grew by more than --threshold is reported as a regression and the exit
+status is 1.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+# 1. THE PATH FIX: Allows importing from the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import storage
+from benchmarks import api_bench, dataset, engine_bench, results
+
+DEFAULT_SIZES = '1k,100k,1m'
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'latest.json')
+SUITES = ('engine', 'api')
+
+
+def run_suites(sizes, suites, repeat, clients, durable, seed):
+    """Runs the suites at every size and returns {suite/size/case: result}."""
+    found = {}
+    def report(name):
+        def show(case, entry):
+            found[f"{name}/{case}"] = entry
+            extra = f"  p50 {entry['p50_ms']:.2f} ms  p99 {entry['p99_ms']:.2f} ms" if 'p50_ms' in entry else ''
+            print(f"{name + '/' + case:<40} {entry['ops']:>8} op(s)  best {entry['best_s']:.4f} s  "
+                  f"{entry['per_op_us']:>12.1f} us/op{extra}", flush=True)
+        return show
+
+    for label in sizes:
+        rows = dataset.parse_size(label)
+        db_name = f"bench_{label}"
+        # 2. The engine suite builds the database; the API suite reuses it
+        engine_results = engine_bench.run(db_name, rows, repeat, durable, seed, report(f"engine/{label}"))
+        if 'engine' not in suites:
+            for case in engine_results:
+                found.pop(f"engine/{label}/{case}")
+        if 'api' in suites:
+            api_bench.run(db_name, rows, repeat, clients, durable, seed, report(f"api/{label}"))
+        storage.close_database(db_name)
+        shutil.rmtree(os.path.join(storage.BASE_DATA_DIR, db_name), ignore_errors=True)
+    return found
+
+
+def compare_files(baseline_path, current, threshold):
+    _, baseline = results.load(baseline_path)
+    rows = results.compare(baseline, current, threshold)
+    print(results.format_comparison(rows))
+    return any(row[4] == 'REGRESSION' for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PesaDB and compare against a baseline.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"Dataset sizes in orders (default: {DEFAULT_SIZES})")
+    parser.add_argument('--suites', default=','.join(SUITES), help="engine, api or both (default: both)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case; the best one counts (default: 3)")
+    parser.add_argument('--clients', type=int, default=api_bench.CLIENTS, help="Concurrent API clients")
+    parser.add_argument('--no-fsync', action='store_true', help="Skip the WAL fsync of every commit")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Results JSON file")
+    parser.add_argument('--baseline', help="Results JSON file to check this run against")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="Only compare two results files")
+    parser.add_argument('--threshold', type=float, default=results.DEFAULT_THRESHOLD,
+                        help="Slowdown per op reported as a regression (default: 0.2, i.e. 20%%)")
+    args = parser.parse_args()
+
+    try:
+        if args.compare:
+            _, current = results.load(args.compare[1])
+            sys.exit(1 if compare_files(args.compare[0], current, args.threshold) else 0)
+
+        sizes = [size for size in args.sizes.split(',') if size.strip()]
+        for size in sizes:
+            dataset.parse_size(size)
+        suites = [suite.strip() for suite in args.suites.split(',') if suite.strip()]
+        unknown = [suite for suite in suites if suite not in SUITES]
+        if unknown:
+            raise ValueError(f"Unknown suite '{unknown[0]}' (choose from {', '.join(SUITES)}).")
+        if 'api' in suites and api_bench.web_app is None:
+            print("Skipping the API suite: it needs fastapi and httpx (pip install fastapi httpx).")
+            suites.remove('api')
+        if args.repeat < 1 or args.clients < 1:
+            raise ValueError("--repeat and --clients must be at least 1.")
+
+        # 3. Benchmark databases live in a temporary data directory, never in data/
+        storage.BASE_DATA_DIR = tempfile.mkdtemp(prefix='pesadb-bench-')
+        try:
+            found = run_suites(sizes, suites, args.repeat, args.clients, not args.no_fsync, args.seed)
+        finally:
+            shutil.rmtree(storage.BASE_DATA_DIR, ignore_errors=True)
+        meta = results.metadata(sizes=sizes, suites=suites, repeat=args.repeat, clients=args.clients,
+                                fsync=not args.no_fsync, seed=args.seed)
+        results.save(args.output, meta, found)
+        print(f"Results written to {args.output}")
+        if args.baseline:
+            sys.exit(1 if compare_files(args.baseline, found, args.threshold) else 0)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Aggregate functions (COUNT, SUM, AVG, MIN, MAX) shared by the planner's
+HashAggregate and the columnar scan path.
+
+Every aggregate keeps a [count, accumulator] state per group: count is the
+number of non-NULL inputs and the accumulator is their sum, min or max.
+States from separate partial aggregations (e.g. column chunks) merge.
+
+Aggregation streams its input through a hash table of group states. Memory
+is bounded by MAX_GROUPS: once the table is full, its states are spilled to
+SPILL_PARTITIONS temporary files by group hash, and each partition is
+aggregated on its own at the end (recursively, if one is still too large).
+"""
+import json
+import tempfile
+
+FUNCTIONS = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+MAX_GROUPS = 100000      # Group states held in memory before spilling
+SPILL_PARTITIONS = 16
+
+
+def new_state():
+    return [0, None]  # [count, accumulator]
+
+
+def fold(state, func, value):
+    """Adds one input value to a state."""
+    if value is None:
+        return  # NULLs are ignored by every aggregate
+    state[0] += 1
+    acc = state[1]
+    if func in ('SUM', 'AVG'):
+        state[1] = value if acc is None else acc + value
+    elif func == 'MIN':
+        state[1] = value if acc is None or value < acc else acc
+    elif func == 'MAX':
+        state[1] = value if acc is None or value > acc else acc
+
+
+def merge(state, func, count, acc):
+    """Adds a partial result (count, accumulator) to a state."""
+    state[0] += count
+    if acc is None or func == 'COUNT':
+        return
+    current = state[1]
+    if current is None:
+        state[1] = acc
+    elif func in ('SUM', 'AVG'):
+        state[1] = current + acc
+    elif func == 'MIN':
+        state[1] = min(current, acc)
+    elif func == 'MAX':
+        state[1] = max(current, acc)
+
+
+def finish(state, func):
+    count, acc = state
+    if func == 'COUNT':
+        return count
+    if func == 'AVG':
+        return acc / count if count else None
+    return acc
+
+
+def result_rows(groups, group_keys, aggregates):
+    """Turns {group tuple: [state, ...]} into output rows; no groups and no keys gives one row."""
+    if not groups and not group_keys:
+        # Aggregates over an empty input still produce one row (COUNT = 0)
+        groups = {(): [new_state() for _ in aggregates]}
+    for group, states in groups.items():
+        out = dict(zip(group_keys, group))
+        for state, (label, func, _) in zip(states, aggregates):
+            out[label] = finish(state, func)
+        yield out
+
+
+class HashAggregator:
+    """Hash table of per-group states with bounded memory (see the module docstring)."""
+
+    def __init__(self, group_keys, aggregates, max_groups=None, level=0):
+        self.group_keys = list(group_keys)
+        self.aggregates = aggregates    # [(label, func, column or None for COUNT(*)), ...]
+        self.max_groups = max_groups or MAX_GROUPS
+        self.level = level              # Salts the partition hash of recursive passes
+        self.groups = {}                # {group tuple: [state, ...]}
+        self.partitions = None          # Spill files, once the table has overflowed
+
+    def states(self, group):
+        """Returns the states of a group, creating them (and spilling first, if full)."""
+        states = self.groups.get(group)
+        if states is None:
+            if len(self.groups) >= self.max_groups:
+                self._spill()
+            states = self.groups[group] = [new_state() for _ in self.aggregates]
+        return states
+
+    def add(self, row):
+        """Folds one input row into its group."""
+        states = self.states(tuple(row.get(k) for k in self.group_keys))
+        for state, (_, func, key) in zip(states, self.aggregates):
+            fold(state, func, row.get(key) if key is not None else True)
+
+    def _spill(self):
+        if self.partitions is None:
+            self.partitions = [None] * SPILL_PARTITIONS
+        for group, states in self.groups.items():
+            n = hash((self.level, group)) % SPILL_PARTITIONS
+            if self.partitions[n] is None:
+                self.partitions[n] = tempfile.TemporaryFile('w+', encoding='utf-8')
+            self.partitions[n].write(json.dumps([list(group), states]) + '\n')
+        self.groups = {}
+
+    def results(self):
+        """Yields one output row per group; no input and no group keys gives one row."""
+        if self.partitions is None:
+            yield from result_rows(self.groups, self.group_keys, self.aggregates)
+            return
+        self._spill()
+        for spill in self.partitions:
+            if spill is None:
+                continue
+            # Every state of a group went to the same partition: merge them there
+            sub = HashAggregator(self.group_keys, self.aggregates, self.max_groups, self.level + 1)
+            spill.seek(0)
+            for line in spill:
+                group, states = json.loads(line)
+                for state, (_, func, _), (count, acc) in zip(sub.states(tuple(group)), self.aggregates, states):
+                    merge(state, func, count, acc)
+            spill.close()
+            yield from sub.results()
+
+
+def hash_aggregate(rows, group_keys, aggregates):
+    """
+    Groups rows by the group_keys columns and folds each aggregate
+    (label, func, column or None for COUNT(*)) per group, streaming the
+    input with at most MAX_GROUPS group states in memory.
+    """
+    aggregator = HashAggregator(group_keys, aggregates)
+    for row in rows:
+        aggregator.add(row)
+    return aggregator.results()
@@ -0,0 +1,151 @@
+"""
+Shared in-process cache of decoded table rows (the buffer pool).
+
+Entries are keyed by (db_name, table_name) and tagged with the table version
+([epoch, counter], see storage._TableLog) they were read at. A lookup only
+hits when the tag equals the table's current version. Writes made through
+the storage layer patch a current entry in place and move its tag forward;
+anything else (a rewrite, another process) leaves a stale tag that is
+dropped on the next lookup.
+
+Memory is bounded by a byte budget. Each row is charged its encoded record
+size plus an estimate of its in-memory footprint: PACKED_ROW_OVERHEAD_BYTES
+for a schema-ordered tuple (see core/rows.py), ROW_OVERHEAD_BYTES for a
+dict. Least recently used tables are evicted first. A table larger than the
+whole budget is never cached and is always read from its segments.
+
+A row dict handed out by get() is never modified afterwards: the next write
+to that table copies it first (copy-on-write), so a scan can keep iterating
+it without locks while writers move the entry forward.
+"""
+import threading
+from collections import OrderedDict
+
+ROW_OVERHEAD_BYTES = 200
+PACKED_ROW_OVERHEAD_BYTES = 100
+
+
+class _Entry:
+    def __init__(self, version, rows, sizes):
+        self.version = version
+        self.rows = rows      # {rid: row}, in the table's scan order
+        self.sizes = sizes    # {rid: charged bytes}
+        self.nbytes = sum(sizes.values())
+        self.lent = False     # rows was handed out by get(): copy before writing
+
+
+class BufferPool:
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.used = 0
+        self._entries = OrderedDict()  # {(db_name, table_name): _Entry}, least recently used first
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def charge(record_bytes, packed=False):
+        """Bytes charged for one cached row whose encoded record is record_bytes long."""
+        return record_bytes + (PACKED_ROW_OVERHEAD_BYTES if packed else ROW_OVERHEAD_BYTES)
+
+    def fits(self, nbytes):
+        return nbytes <= self.budget
+
+    def get(self, key, version, lend=True):
+        """
+        Returns the cached {rid: row} of a table at version, or None. Callers
+        must not mutate it; with lend=True it stays unchanged for as long as
+        they hold it, while lend=False is for reads finished under the table lock.
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version != version:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry.lent = entry.lent or lend
+            return entry.rows
+
+    def put(self, key, version, rows, sizes):
+        """Caches a fully read table, evicting older tables to stay within the budget."""
+        with self.lock:
+            if key in self._entries:
+                self._drop(key)
+            entry = _Entry(version, rows, sizes)
+            if not self.fits(entry.nbytes):
+                return
+            self._entries[key] = entry
+            self.used += entry.nbytes
+            self._evict()
+
+    def apply(self, key, old_version, new_version, puts=(), deletes=()):
+        """
+        Write-through: brings a cached table from old_version to new_version by
+        applying puts [(rid, row, record_bytes)] and deletes [rid]. An entry
+        not at old_version has missed a write and is dropped instead.
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry.version != old_version:
+                self._drop(key)
+                return
+            if entry.lent and (puts or deletes):
+                entry.rows = dict(entry.rows)
+                entry.lent = False
+            for rid, row, record_bytes in puts:
+                size = self.charge(record_bytes, type(row) is tuple)
+                entry.nbytes += size - entry.sizes.get(rid, 0)
+                self.used += size - entry.sizes.get(rid, 0)
+                entry.rows[rid] = row
+                entry.sizes[rid] = size
+            for rid in deletes:
+                size = entry.sizes.pop(rid, 0)
+                entry.rows.pop(rid, None)
+                entry.nbytes -= size
+                self.used -= size
+            entry.version = new_version
+            if not self.fits(entry.nbytes):
+                self._drop(key)
+            else:
+                self._evict()
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate_database(self, db_name):
+        with self.lock:
+            for key in [k for k in self._entries if k[0] == db_name]:
+                self._drop(key)
+
+    def resize(self, budget_bytes):
+        """Changes the memory budget, evicting tables until the pool fits it."""
+        with self.lock:
+            self.budget = budget_bytes
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "budget_bytes": self.budget,
+                "used_bytes": self.used,
+                "tables": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _drop(self, key):
+        self.used -= self._entries.pop(key).nbytes
+
+    def _evict(self):
+        # Least recently used tables go first
+        while self.used > self.budget and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
@@ -0,0 +1,149 @@
+"""
+The databases a process serves, and the client sessions using them.
+
+A Catalog keeps one DatabaseEngine per open database, each with its own
+schemas, indices and WAL, so requests that alternate between databases never
+reload one another's metadata. Engines are thread-safe (see core/locking.py)
+and shared by every client of their database.
+
+A Session is a client's context on a catalog: it carries the current
+database and handles the statements that would otherwise switch a shared
+engine (CREATE/DROP DATABASE, USE, SHOW DATABASES) itself, as well as
+BEGIN / COMMIT / ROLLBACK: its open transaction (core/transaction.py) runs
+the statements in between. A session for a remote client also gets a
+copy_root, the only directory its COPY statements may read from.
+"""
+import os
+import threading
+
+from core import planner, sql, storage
+from core.engine import DatabaseEngine
+
+
+class Catalog:
+    def __init__(self, durable=True):
+        self.durable = durable
+        self._engines = {}  # {db_name: DatabaseEngine with that database open}
+        self._lock = threading.Lock()
+
+    def list_databases(self):
+        return storage.list_databases()
+
+    def open_databases(self):
+        """Names of the databases with an engine in memory."""
+        with self._lock:
+            return list(self._engines)
+
+    def engine(self, db_name, create=False):
+        """Returns the engine of a database, opening it on first use (creating it with create=True)."""
+        with self._lock:
+            engine = self._engines.get(db_name)
+            if engine is None:
+                if not create and db_name not in storage.list_databases():
+                    raise ValueError(f"Database '{db_name}' not found.")
+                engine = DatabaseEngine(durable=self.durable)
+                engine.set_active_db(db_name)
+                self._engines[db_name] = engine
+            return engine
+
+    def create_database(self, db_name):
+        self.engine(db_name, create=True)
+        return f"Database '{db_name}' initialized."
+
+    def drop_database(self, db_name):
+        """Closes the database's engine, if open, and deletes the database."""
+        with self._lock:
+            engine = self._engines.pop(db_name, None)
+        return (engine or DatabaseEngine(durable=self.durable)).delete_database(db_name)
+
+    def close(self):
+        """Checkpoints and closes every open database."""
+        with self._lock:
+            engines, self._engines = list(self._engines.values()), {}
+        for engine in engines:
+            engine.close()
+
+
+class Session:
+    """A client's connection to a catalog: its current database plus SQL execution against it."""
+
+    # Statements allowed between BEGIN and COMMIT; DDL and database switches are not
+    TRANSACTIONAL = (sql.Select, sql.Explain, sql.Insert, sql.Update, sql.Delete, sql.Copy, sql.ShowTables)
+
+    def __init__(self, catalog, db_name=None, copy_root=None):
+        self.catalog = catalog
+        self.db_name = db_name
+        self.copy_root = copy_root  # Directory COPY may read from (None: any file the process can open)
+        self.transaction = None  # Open Transaction, if any
+
+    @property
+    def engine(self):
+        """Engine of the current database."""
+        if not self.db_name:
+            raise ValueError("No active database. Use 'USE <db>'.")
+        return self.catalog.engine(self.db_name)
+
+    def use(self, db_name):
+        self.catalog.engine(db_name)
+        self.db_name = db_name
+
+    def execute(self, sql_text, params=()):
+        """Runs one statement: database-level ones on the catalog, the rest on the current database."""
+        stmt = planner.parse(sql_text)
+        if isinstance(stmt, sql.Copy):
+            self._check_copy(stmt.path)
+        if isinstance(stmt, (sql.Begin, sql.Commit, sql.Rollback)) or self.transaction is not None:
+            return self._execute_in_transaction(stmt, sql_text, params)
+        if isinstance(stmt, sql.CreateDatabase):
+            message = self.catalog.create_database(stmt.name)
+            self.db_name = stmt.name
+            return planner.Result(message)
+        if isinstance(stmt, sql.UseDatabase):
+            self.use(stmt.name)
+            return planner.Result(f"Context switched to: {stmt.name}")
+        if isinstance(stmt, sql.DropDatabase):
+            message = self.catalog.drop_database(stmt.name)
+            if self.db_name == stmt.name:
+                self.db_name = None
+            return planner.Result(message)
+        if isinstance(stmt, sql.ShowDatabases):
+            return planner.Result("Available Databases", items=self.catalog.list_databases())
+        return self.engine.execute(sql_text, params)
+
+    def _execute_in_transaction(self, stmt, sql_text, params):
+        if isinstance(stmt, sql.Begin):
+            if self.transaction is not None:
+                raise ValueError("A transaction is already open; COMMIT or ROLLBACK it first.")
+            self.transaction = self.engine.begin()
+            return planner.Result("Transaction started.")
+        if isinstance(stmt, (sql.Commit, sql.Rollback)):
+            txn, self.transaction = self.transaction, None
+            if txn is None:
+                raise ValueError("No transaction is open.")
+            return planner.Result(txn.commit() if isinstance(stmt, sql.Commit) else txn.rollback())
+        if isinstance(stmt, sql.ShowDatabases):
+            return planner.Result("Available Databases", items=self.catalog.list_databases())
+        if not isinstance(stmt, self.TRANSACTIONAL):
+            raise ValueError("Only queries and row changes can run inside a transaction; COMMIT or ROLLBACK first.")
+        return self.transaction.execute(sql_text, params)
+
+    def _check_copy(self, path):
+        """Rejects a COPY source outside copy_root, once symlinks and '..' are resolved."""
+        if self.copy_root is None:
+            return
+        root = os.path.realpath(self.copy_root)
+        if os.path.commonpath([root, os.path.realpath(path)]) != root:
+            raise ValueError(f"COPY can only read files inside '{self.copy_root}'.")
+
+    def close(self):
+        """Rolls back the open transaction, if any."""
+        if self.transaction is not None:
+            self.transaction.rollback()
+            self.transaction = None
+
+    def prepare(self, sql_text):
+        """Prepares a statement on the current database (database-level statements cannot be prepared)."""
+        if isinstance(planner.parse(sql_text), (sql.CreateDatabase, sql.UseDatabase, sql.DropDatabase,
+                                                sql.Begin, sql.Commit, sql.Rollback)):
+            raise ValueError("Database-level and transaction statements cannot be prepared.")
+        return self.engine.prepare(sql_text)
@@ -0,0 +1,235 @@
+"""
+Row codecs: how a segment record stores one row (see storage._TableLog).
+
+Every record names the codec that wrote it (its kind), so tables can hold
+records of several codecs at once and storage.ROW_CODEC only picks the one
+new records are written with. Codecs decode a record in place, from
+buf[start:end] of a memory-mapped segment (or a decompressed block), so
+the record is never copied out first.
+
+JsonRowCodec stores the row as compact JSON. It handles any row, and other
+codecs fall back to it for rows they cannot encode.
+
+BinaryRowCodec is schema-aware. A table's columns and types form a
+RowFormat, saved once in the table's formats.json, and a record holds just
+the format id and the values: a NULL bitmap, fixed-width 64-bit ints and
+floats, the byte length of every str (UTF-8) and untyped (JSON) value,
+then those bytes. Column names are never repeated, and a record decodes
+with one struct.unpack_from plus a slice per string, straight into a value
+tuple in schema order (the RowLayout the buffer pool keeps).
+"""
+import json
+import os
+import struct
+from core import metrics
+from core.rows import RowLayout
+
+FORMATS_FILE = 'formats.json'
+
+_FIXED = {'int': 'q', 'float': 'd'}  # Everything else is stored as length-prefixed bytes
+_FORMAT_ID = struct.Struct('<H')
+
+
+class JsonRowCodec:
+    kind = 1
+    name = 'json'
+
+    def __init__(self, table_dir=None):
+        pass
+
+    def use(self, layout, types):
+        pass
+
+    def encode(self, row):
+        return json.dumps(row, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, buf, start, end):
+        return json.loads(buf[start:end])
+
+    def prefilter(self, equals):
+        """
+        Returns (buf, start, end) -> False for records that cannot hold
+        row[col] == value for every (col, value) in equals, or None if the
+        bytes cannot tell.
+        """
+        needles = [(json.dumps(col) + ':' + json.dumps(value)).encode('utf-8')
+                   for col, value in equals.items() if type(value) in (str, int)]
+        if not needles:
+            return None
+        return lambda buf, start, end: all(buf.find(needle, start, end) >= 0 for needle in needles)
+
+
+class RowFormat:
+    """One column list (with types) of a table, as BinaryRowCodec stores it."""
+
+    def __init__(self, fid, columns):
+        self.fid = fid
+        self.columns = dict(columns)  # {column: type}, in TableSchema.columns order
+        self.layout = RowLayout(self.columns)
+        self.saved = False
+        self.kinds = [_FIXED.get(col_type, 'str' if col_type == 'str' else 'json')
+                      for col_type in self.columns.values()]
+        self.null_bytes = (len(self.columns) + 7) // 8
+        self.struct = struct.Struct('<H%ds' % self.null_bytes +
+                                    ''.join(_FIXED.get(col_type, 'I') for col_type in self.columns.values()))
+        self.no_nulls = bytes(self.null_bytes)
+        self.decode = self._compile_decoder()
+
+    def _compile_decoder(self):
+        """
+        Compiles (buf, start) -> value tuple for the record at buf[start:]:
+        one unpack of the fixed part, then a slice per str/JSON value, as
+        straight-line code.
+        """
+        names = [f"v{i}" for i in range(len(self.kinds))]
+        lines = [f"def decode(buf, start):",
+                 f"    _, nulls, {''.join(name + ', ' for name in names)}= unpack(buf, start)",
+                 f"    p = start + {self.struct.size}"]
+        # A str/JSON value's variable holds its length until its bytes are sliced
+        # (a NULL has no bytes; a JSON value never has none)
+        for name, kind in zip(names, self.kinds):
+            if kind == 'str':
+                lines.append(f"    q = p + {name}; {name} = str(buf[p:q], 'utf-8'); p = q")
+            elif kind == 'json':
+                lines.append(f"    q = p + {name}; {name} = loads(buf[p:q]) if q > p else None; p = q")
+        lines.append(f"    values = ({''.join(name + ', ' for name in names)})")
+        lines.append(f"    if nulls != no_nulls:")
+        lines.append(f"        values = tuple(None if nulls[i >> 3] >> (i & 7) & 1 else value"
+                     f" for i, value in enumerate(values))")
+        lines.append(f"    return values")
+        scope = {'unpack': self.struct.unpack_from, 'loads': json.loads, 'no_nulls': self.no_nulls}
+        exec('\n'.join(lines), scope)
+        return scope['decode']
+
+    def encode(self, row):
+        """The record body for a row with exactly these columns, or None if a value does not fit its type."""
+        fixed, tails, nulls = [], [], 0
+        for i, (col, kind) in enumerate(zip(self.columns, self.kinds)):
+            value = row[col]
+            if value is None:
+                nulls |= 1 << i
+                fixed.append(0)
+            elif kind == 'q':
+                if type(value) is not int:
+                    return None
+                fixed.append(value)
+            elif kind == 'd':
+                if type(value) is not float:
+                    return None
+                fixed.append(value)
+            else:
+                if kind == 'str':
+                    if type(value) is not str:
+                        return None
+                    data = value.encode('utf-8')
+                else:
+                    data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+                fixed.append(len(data))
+                tails.append(data)
+        try:
+            head = self.struct.pack(self.fid, nulls.to_bytes(self.null_bytes, 'little'), *fixed)
+        except (struct.error, OverflowError):
+            return None  # e.g. an int beyond 64 bits
+        return head + b''.join(tails)
+
+    def needles(self, equals):
+        """Byte strings every record of this format with row[col] == value contains."""
+        needles = []
+        for col, value in equals.items():
+            kind = self.kinds[self.layout.positions[col]] if col in self.columns else None
+            if kind == 'q' and type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                needles.append(struct.pack('<q', value))
+            elif kind == 'd' and type(value) is float and value != 0.0:
+                needles.append(struct.pack('<d', value))  # 0.0 == -0.0 but their bytes differ
+            elif kind == 'str' and type(value) is str and value:
+                needles.append(value.encode('utf-8'))
+            elif kind == 'json' and type(value) in (str, int):
+                needles.append(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        return needles
+
+
+class BinaryRowCodec:
+    kind = 2
+    name = 'binary'
+
+    def __init__(self, table_dir):
+        self.path = os.path.join(table_dir, FORMATS_FILE)
+        self.formats = []    # RowFormat by id
+        self.current = None  # Format of the table's current schema
+        self._by_columns = {}  # {frozenset(columns): RowFormat} for rows of older schemas
+        try:
+            with open(self.path, 'r') as f:
+                for columns in json.load(f)['formats']:
+                    self._add(dict(columns)).saved = True
+        except FileNotFoundError:
+            pass
+
+    def _add(self, columns):
+        fmt = RowFormat(len(self.formats), columns)
+        self.formats.append(fmt)
+        self._by_columns.setdefault(frozenset(fmt.columns), fmt)
+        return fmt
+
+    def use(self, layout, types):
+        """Encodes rows with types ({column: type}) from now on; layout is the buffer pool's RowLayout."""
+        types = dict(types)
+        for fmt in self.formats:
+            if list(fmt.columns.items()) == list(types.items()):
+                break
+        else:
+            fmt = self._add(types)
+        if layout is not None and layout.columns == fmt.layout.columns:
+            fmt.layout = layout  # Decoded tuples can go to the pool as they are
+        self.current = fmt
+
+    def _save(self):
+        """Persists every format (before the first record using a new one is written)."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"formats": [list(fmt.columns.items()) for fmt in self.formats]}, f)
+            f.flush()
+            metrics.fsync(f.fileno(), 'metadata')
+        os.replace(tmp_path, self.path)
+        for fmt in self.formats:
+            fmt.saved = True
+
+    def encode(self, row):
+        """The record body for row, or None if no known format fits it."""
+        fmt = self.current
+        if fmt is None or row.keys() != fmt.columns.keys():
+            fmt = self._by_columns.get(frozenset(row))
+            if fmt is None:
+                return None
+        body = fmt.encode(row)
+        if body is not None and not fmt.saved:
+            self._save()
+        return body
+
+    def decode_values(self, buf, start):
+        """(RowFormat, value tuple in the format's column order) for the record body at buf[start:]."""
+        fmt = self.formats[_FORMAT_ID.unpack_from(buf, start)[0]]
+        return fmt, fmt.decode(buf, start)
+
+    def decode(self, buf, start, end):
+        fmt, values = self.decode_values(buf, start)
+        return fmt.layout.builder()(values)
+
+    def prefilter(self, equals):
+        """See JsonRowCodec.prefilter; needles are worked out once per format."""
+        if not equals:
+            return None
+        by_format = {}  # {format id bytes: needles}
+        def test(buf, start, end):
+            fid = buf[start:start + 2]
+            needles = by_format.get(fid)
+            if needles is None:
+                needles = by_format[fid] = self.formats[_FORMAT_ID.unpack(fid)[0]].needles(equals)
+            for needle in needles:
+                if buf.find(needle, start, end) < 0:
+                    return False
+            return True
+        return test
+
+
+ROW_CODECS = {codec.name: codec for codec in (JsonRowCodec, BinaryRowCodec)}
@@ -0,0 +1,457 @@
+"""
+Column-oriented copy of a table for analytic scans (ALTER TABLE t SET LAYOUT COLUMNAR).
+
+The row segments stay the source of truth. A ColumnStore mirrors a table's
+live rows as one typed array per declared column, so filters, projections
+and aggregates read only the columns they name instead of decoding a dict
+per row:
+
+    int    -> array('q') of 64-bit values
+    float  -> array('d')
+    str    -> array('q') of codes into a per-column dictionary of distinct values
+    other  -> plain list
+
+Every column also has a NULL map (one byte per row). Deleted rows are only
+flagged dead, and are squeezed out once they outnumber the live ones.
+
+Writes only append positions or clear live flags, so a scan reads a snapshot:
+it copies the live flags when it starts and never sees later changes, while
+compaction (which moves positions) waits until no scan is running.
+
+When NumPy is installed the arrays are viewed in place, and each chunk of
+CHUNK_ROWS rows is filtered and aggregated with vectorized kernels. Without
+NumPy the same operations run as plain loops over the arrays.
+"""
+import array
+import json
+import operator
+import struct
+import sys
+import threading
+
+from core import aggregate, metrics
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the pure-Python paths give the same results
+    np = None
+
+CHUNK_ROWS = 65536
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+_TYPECODES = {'int': 'q', 'float': 'd', 'str': 'q'}
+_PY_TYPES = {'int': int, 'float': float, 'str': str}
+_COMPARATORS = {
+    '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+
+
+class Unsupported(ValueError):
+    """Raised for a row the store cannot hold (wrong type, int64 overflow, column outside the schema)."""
+
+
+def column_kind(col_type):
+    return col_type if col_type in _TYPECODES else 'obj'
+
+
+def _compare(cmp, value, arg):
+    try:
+        return bool(cmp(value, arg))
+    except TypeError:
+        return False  # Incomparable values never match, as in the row path
+
+
+class ColumnStore:
+    def __init__(self, columns):
+        """:param columns: Dict of {column_name: type_string}, as in TableSchema.columns"""
+        self.kinds = {col: column_kind(col_type) for col, col_type in columns.items()}
+        self.rids = array.array('q')
+        self.live = bytearray()       # 1 per live position, 0 once deleted
+        self.positions = {}           # {rid: position in the arrays}
+        self.dead = 0
+        self.data = {col: array.array(_TYPECODES[kind]) if kind in _TYPECODES else []
+                     for col, kind in self.kinds.items()}
+        self.nulls = {col: bytearray() for col in self.kinds}
+        self.dictionaries = {col: [] for col, kind in self.kinds.items() if kind == 'str'}  # code -> value
+        self._codes = {col: {} for col in self.dictionaries}                                 # value -> code
+        self._readers = 0  # Running scans; compaction waits for them to finish
+        self.lock = threading.RLock()  # Held by writers and by each chunk a scan computes
+
+    def __len__(self):
+        return len(self.positions)
+
+    # --- MAINTENANCE ---
+
+    def add(self, rid, row):
+        """Appends a row, replacing any older version of rid. Raises Unsupported if it does not fit."""
+        for col in row:
+            if col not in self.kinds:
+                raise Unsupported(f"Column '{col}' is not part of the schema.")
+        values = []
+        for col, kind in self.kinds.items():
+            value = row.get(col)
+            if value is not None and kind in _PY_TYPES:
+                if type(value) is not _PY_TYPES[kind] or \
+                        (kind == 'int' and not _INT64_MIN <= value <= _INT64_MAX):
+                    raise Unsupported(f"Value {value!r} does not fit column '{col}' ({kind}).")
+            values.append(value)
+
+        with self.lock:
+            if rid in self.positions:
+                self.remove(rid)
+            for (col, kind), value in zip(self.kinds.items(), values):
+                self.nulls[col].append(value is None)
+                if kind == 'str' and value is not None:
+                    code = self._codes[col].get(value)
+                    if code is None:
+                        code = self._codes[col][value] = len(self.dictionaries[col])
+                        self.dictionaries[col].append(value)
+                    value = code
+                elif value is None and kind in _TYPECODES:
+                    value = 0
+                self.data[col].append(value)
+            self.positions[rid] = len(self.rids)
+            self.rids.append(rid)
+            self.live.append(1)
+
+    def remove(self, rid):
+        with self.lock:
+            pos = self.positions.pop(rid, None)
+            if pos is None:
+                return
+            self.live[pos] = 0
+            self.dead += 1
+            if self.dead > CHUNK_ROWS and self.dead > len(self.positions) and not self._readers:
+                self.compact()
+
+    def compact(self):
+        """Drops dead positions from every array (dictionary codes stay stable)."""
+        keep = [pos for pos in range(len(self.rids)) if self.live[pos]]
+        self.rids = array.array('q', (self.rids[pos] for pos in keep))
+        for col, kind in self.kinds.items():
+            data = self.data[col]
+            values = (data[pos] for pos in keep)
+            self.data[col] = array.array(_TYPECODES[kind], values) if kind in _TYPECODES else list(values)
+            nulls = self.nulls[col]
+            self.nulls[col] = bytearray(nulls[pos] for pos in keep)
+        self.live = bytearray(b'\x01') * len(keep)
+        self.positions = {rid: pos for pos, rid in enumerate(self.rids)}
+        self.dead = 0
+
+    # --- SCANS ---
+
+    def snapshot(self):
+        """The live rows as of now, for a scan or aggregate to read later (see ColumnSnapshot)."""
+        return ColumnSnapshot(self)
+
+    def _release(self):
+        with self.lock:
+            self._readers -= 1
+
+    @staticmethod
+    def _chunks(total):
+        """The (start, stop) position ranges a scan or aggregate works through, counted as rows scanned."""
+        for start in range(0, total, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, total)
+            metrics.ROWS_SCANNED.inc(('columnar',), stop - start)
+            yield start, stop
+
+    def _code_table(self, col, op, arg):
+        """Evaluates a predicate once per distinct string instead of once per row: code -> bool."""
+        cmp = _COMPARATORS[op]
+        return [_compare(cmp, value, arg) for value in self.dictionaries[col]]
+
+    def _np_view(self, col, start, stop):
+        dtype = np.float64 if self.kinds[col] == 'float' else np.int64
+        return np.frombuffer(self.data[col], dtype=dtype)[start:stop]
+
+    def _np_valid(self, col, start, stop):
+        return np.frombuffer(self.nulls[col], dtype=np.uint8)[start:stop] == 0
+
+    def _np_mask(self, preds, start, stop, live):
+        """Boolean array over [start, stop): rows live in the snapshot matching every (col, op, arg)."""
+        mask = np.frombuffer(live, dtype=np.uint8)[start:stop] != 0
+        for col, op, arg in preds:
+            mask &= self._np_valid(col, start, stop)  # NULL never matches
+            kind, cmp = self.kinds[col], _COMPARATORS[op]
+            if kind == 'str':
+                # The sentinel keeps NULL rows (code 0) indexable in an empty dictionary
+                table = np.array(self._code_table(col, op, arg) + [False], dtype=bool)
+                mask &= table[self._np_view(col, start, stop)]
+            elif kind == 'obj':
+                mask &= np.array([_compare(cmp, v, arg) for v in self.data[col][start:stop]], dtype=bool)
+            elif kind == 'int' and not (isinstance(arg, int) and _INT64_MIN <= arg <= _INT64_MAX):
+                # Beyond the int64 range every stored value compares alike
+                mask &= _compare(cmp, 0, arg)
+            else:
+                mask &= cmp(self._np_view(col, start, stop), arg)
+        return mask
+
+    def _py_positions(self, preds, start, stop, live):
+        positions = [pos for pos in range(start, stop) if live[pos]]
+        for col, op, arg in preds:
+            nulls, data, kind, cmp = self.nulls[col], self.data[col], self.kinds[col], _COMPARATORS[op]
+            if kind == 'str':
+                table = self._code_table(col, op, arg)
+                positions = [pos for pos in positions if not nulls[pos] and table[data[pos]]]
+            else:
+                positions = [pos for pos in positions if not nulls[pos] and _compare(cmp, data[pos], arg)]
+        return positions
+
+    def _positions(self, preds, start, stop, live):
+        if np is not None:
+            return (np.flatnonzero(self._np_mask(preds, start, stop, live)) + start).tolist()
+        return self._py_positions(preds, start, stop, live)
+
+    def _column_values(self, col, positions):
+        """Python values of one column at the given positions (None for NULL or unknown columns)."""
+        if col not in self.kinds:
+            return [None] * len(positions)
+        data, nulls = self.data[col], self.nulls[col]
+        if self.kinds[col] == 'str':
+            dictionary = self.dictionaries[col]
+            return [None if nulls[pos] else dictionary[data[pos]] for pos in positions]
+        return [None if nulls[pos] else data[pos] for pos in positions]
+
+    def scan(self, preds=(), columns=None, snapshot=None):
+        """
+        Returns an iterator of (rid, row) for the live rows matching preds
+        [(col, op, arg)], args already cast to the column types. Rows are
+        built column by column, one chunk at a time, with only the requested
+        columns. It reads the rows of snapshot, or of this call's moment.
+        """
+        columns = list(self.kinds) if columns is None else list(columns)
+        return self._scan(preds, columns, snapshot or self.snapshot())
+
+    def _scan(self, preds, columns, snapshot):
+        live, total = snapshot.live, snapshot.total
+        try:
+            for start, stop in self._chunks(total):
+                with self.lock:
+                    positions = self._positions(preds, start, stop, live)
+                    if not positions:
+                        continue
+                    rids = [self.rids[pos] for pos in positions]
+                    if columns:
+                        values = zip(*(self._column_values(col, positions) for col in columns))
+                        rows = [dict(zip(columns, row)) for row in values]
+                    else:
+                        rows = [{} for _ in positions]
+                yield from zip(rids, rows)
+        finally:
+            snapshot.close()
+
+    # --- AGGREGATES ---
+
+    def aggregate(self, preds, group_by, aggregates, snapshot=None):
+        """
+        Returns an iterator over the rows of aggregates [(label, func, column or None for COUNT(*))]
+        over the rows matching preds, one per group_by group, with the semantics
+        of aggregate.hash_aggregate (NULL inputs ignored, one row for an empty
+        ungrouped input). Vectorized per chunk when NumPy is available.
+        Reads the rows of snapshot, or of this call's moment.
+        """
+        snapshot = snapshot or self.snapshot()
+        if np is None or not self._vectorizable(group_by, aggregates):
+            needed = list(dict.fromkeys(list(group_by) + [col for _, _, col in aggregates if col is not None]))
+            rows = (row for _, row in self.scan(preds, needed, snapshot))
+            return aggregate.hash_aggregate(rows, group_by, aggregates)
+
+        aggregator = aggregate.HashAggregator(group_by, aggregates)
+        live, total = snapshot.live, snapshot.total
+        try:
+            for start, stop in self._chunks(total):
+                with self.lock:
+                    self._np_aggregate_chunk(aggregator, preds, group_by, aggregates, start, stop, live)
+        finally:
+            snapshot.close()
+        return aggregator.results()
+
+    def _vectorizable(self, group_by, aggregates):
+        if any(self.kinds.get(col) not in _TYPECODES for col in group_by):
+            return False
+        for _, func, col in aggregates:
+            if col is None:
+                continue
+            kind = self.kinds.get(col)
+            if kind not in _TYPECODES or (func in ('SUM', 'AVG') and kind == 'str'):
+                return False  # SUM over strings concatenates, as the row path does
+        return True
+
+    def _np_aggregate_chunk(self, aggregator, preds, group_by, aggregates, start, stop, live):
+        """Merges the partial states of one chunk into an aggregate.HashAggregator."""
+        mask = self._np_mask(preds, start, stop, live)
+        selected = int(mask.sum())
+        if not selected:
+            return
+        if group_by:
+            # Factorize one key column at a time (NULL is its own key) into group ids
+            inverse = np.zeros(selected, dtype=np.int64)
+            keys = []
+            for col in group_by:
+                nulls = ~self._np_valid(col, start, stop)[mask]
+                values = self._np_view(col, start, stop)[mask]
+                if self.kinds[col] == 'float':
+                    values = (values + 0.0).view(np.int64)  # -0.0 and 0.0 form one group
+                values = np.where(nulls, 0, values)
+                _, codes = np.unique(values, return_inverse=True)
+                inverse = inverse * (2 * int(codes.max()) + 2) + codes.reshape(-1) * 2 + nulls
+                _, inverse = np.unique(inverse, return_inverse=True)
+                inverse = inverse.reshape(-1)
+                keys.append((nulls, values))
+            _, first = np.unique(inverse, return_index=True)
+            labels = [self._group_label(group_by, [(nulls[pos], values[pos]) for nulls, values in keys])
+                      for pos in first.tolist()]
+        else:
+            inverse = np.zeros(selected, dtype=np.intp)
+            labels = [()]
+
+        partials = [self._np_reduce(func, col, mask, inverse, len(labels), start, stop)
+                    for _, func, col in aggregates]
+        for n, label in enumerate(labels):
+            states = aggregator.states(label)
+            for state, (_, func, _), (counts, accs) in zip(states, aggregates, partials):
+                aggregate.merge(state, func, counts[n], accs[n])
+
+    def _group_label(self, group_by, key):
+        """Python group tuple from per-column (is_null, int64 value) pairs."""
+        label = []
+        for col, (is_null, value) in zip(group_by, key):
+            kind, value = self.kinds[col], int(value)
+            if is_null:
+                label.append(None)
+            elif kind == 'float':
+                label.append(struct.unpack('=d', struct.pack('=q', value))[0])
+            elif kind == 'str':
+                label.append(self.dictionaries[col][value])
+            else:
+                label.append(value)
+        return tuple(label)
+
+    def _np_reduce(self, func, col, mask, inverse, n_groups, start, stop):
+        """Per-group (counts, accumulators) of one aggregate over the masked chunk."""
+        if col is None:  # COUNT(*)
+            return np.bincount(inverse, minlength=n_groups).tolist(), [None] * n_groups
+        valid = self._np_valid(col, start, stop)[mask]
+        owners = inverse[valid]
+        counts = np.bincount(owners, minlength=n_groups).tolist()
+        if func == 'COUNT' or not len(owners):
+            return counts, [None] * n_groups
+
+        kind = self.kinds[col]
+        values = self._np_view(col, start, stop)[mask][valid]
+        if func in ('SUM', 'AVG'):
+            if kind == 'float':
+                accs = np.bincount(owners, weights=values, minlength=n_groups).tolist()
+            elif max(-int(values.min()), int(values.max())) * len(values) <= _INT64_MAX:
+                sums = np.zeros(n_groups, dtype=np.int64)
+                np.add.at(sums, owners, values)
+                accs = sums.tolist()
+            else:
+                # int64 sums could overflow: add as Python ints
+                accs = [0] * n_groups
+                for owner, value in zip(owners.tolist(), values.tolist()):
+                    accs[owner] += value
+        else:
+            order = None
+            if kind == 'str':
+                # Compare strings through their rank in the sorted dictionary
+                dictionary = self.dictionaries[col]
+                order = sorted(range(len(dictionary)), key=dictionary.__getitem__)
+                ranks = np.empty(len(dictionary), dtype=np.int64)
+                ranks[order] = np.arange(len(order))
+                values = ranks[values]
+            reduce = np.minimum if func == 'MIN' else np.maximum
+            if values.dtype == np.float64:
+                initial = np.inf if func == 'MIN' else -np.inf
+            else:
+                initial = _INT64_MAX if func == 'MIN' else _INT64_MIN
+            accs = np.full(n_groups, initial, dtype=values.dtype)
+            reduce.at(accs, owners, values)
+            accs = accs.tolist()
+            if order is not None:
+                accs = [dictionary[order[rank]] if 0 <= rank < len(order) else None for rank in accs]
+        return counts, [acc if count else None for acc, count in zip(accs, counts)]
+
+    # --- SNAPSHOTS ---
+
+    def to_bytes(self):
+        """Serializes the store: a JSON header line followed by the raw array buffers."""
+        with self.lock:
+            buffers = [bytes(self.rids), bytes(self.live)]
+            for col, kind in self.kinds.items():
+                buffers.append(bytes(self.nulls[col]))
+                if kind in _TYPECODES:
+                    buffers.append(bytes(self.data[col]))
+            header = {
+                "byteorder": sys.byteorder,
+                "columns": list(self.kinds.items()),
+                "dictionaries": self.dictionaries,
+                "objects": {col: self.data[col] for col, kind in self.kinds.items() if kind not in _TYPECODES},
+                "dead": self.dead,
+                "lengths": [len(b) for b in buffers],
+            }
+            head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        return head + b'\n' + b''.join(buffers)
+
+    @classmethod
+    def from_bytes(cls, blob, columns):
+        """Rebuilds a store saved by to_bytes; None if it was saved for other columns or is damaged."""
+        store = cls(columns)
+        try:
+            head, _, body = blob.partition(b'\n')
+            header = json.loads(head)
+            if header['byteorder'] != sys.byteorder or \
+                    [tuple(c) for c in header['columns']] != list(store.kinds.items()):
+                return None
+            buffers, offset = [], 0
+            for length in header['lengths']:
+                buffers.append(body[offset:offset + length])
+                offset += length
+            buffers = iter(buffers)
+            store.rids.frombytes(next(buffers))
+            store.live = bytearray(next(buffers))
+            for col, kind in store.kinds.items():
+                store.nulls[col] = bytearray(next(buffers))
+                if kind in _TYPECODES:
+                    store.data[col].frombytes(next(buffers))
+                else:
+                    store.data[col] = list(header['objects'][col])
+            for col in store.dictionaries:
+                store.dictionaries[col] = list(header['dictionaries'][col])
+                store._codes[col] = {value: code for code, value in enumerate(store.dictionaries[col])}
+            store.dead = header['dead']
+        except (ValueError, KeyError, TypeError, StopIteration):
+            return None
+        total = len(store.rids)
+        if len(store.live) != total or any(len(store.nulls[c]) != total or len(store.data[c]) != total
+                                           for c in store.kinds):
+            return None
+        store.positions = {rid: pos for pos, rid in enumerate(store.rids) if store.live[pos]}
+        return store
+
+
+class ColumnSnapshot:
+    """
+    A store's live-row flags and row count as of one moment. Arrays only
+    grow between compactions, and compaction waits until every snapshot is
+    closed, so the positions it names keep their values. Take it under the
+    table latch for a state no writer is halfway through.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        with store.lock:
+            store._readers += 1
+            self.live, self.total = bytes(store.live), len(store.rids)
+        self._open = True
+
+    def close(self):
+        """Lets compaction run again (idempotent)."""
+        if self._open:
+            self._open = False
+            self.store._release()
+
+    def __del__(self):
+        self.close()
@@ -1,86 +1,445 @@
-import os
+import base64
+import functools
+import heapq
+import itertools
 import json
+import math
+import operator
+import os
 import shutil  # Required for deleting database directories
-from core import storage
-from core.schema import TableSchema
-from core.indexer import Index
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from core import storage, planner, loader, aggregate, metrics
+from core.columnar import ColumnStore, Unsupported
+from core.schema import TableSchema, LAYOUTS
+from core.indexer import new_index, load_index
+from core.join import hash_join, index_nested_loop_join, sort_merge_join
+from core.locking import RWLock
+from core.transaction import Transaction
+from core.wal import WriteAheadLog
+
+_COMPARATORS = {
+    '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+_RANGE_OPS = ('<', '<=', '>', '>=')
+PLAN_CACHE_SIZE = 256  # Prepared statements kept per engine (LRU)
+INSERT_BATCH_ROWS = 1000  # Rows validated and committed together by insert_many
+EAGER_FETCH_ROWS = 256  # Index matches up to this many are read under the table latch, not from a snapshot
+MIGRATE_BATCH_ROWS = 500  # Rows the background compactor rewrites per table latch hold
+
+def _int_comparisons(col, op, value):
+    """
+    Normalized conditions comparing an int column with a non-integral number
+    as SQL compares them: range bounds round inwards (ceil for < and >=,
+    floor for <= and >), equality becomes an empty open interval and
+    inequality keeps the float, which no int equals.
+    """
+    low, high = math.floor(value), math.ceil(value)
+    if op == '=':
+        return [(col, '>', low), (col, '<', high)]
+    if op == '!=':
+        return [(col, op, value)]
+    return [(col, op, high if op in ('<', '>=') else low)]
+
+
+def _compile_predicate(preds, extra=None):
+    """
+    Compiles normalized [(col, op, arg)] once into a single row -> bool test,
+    with comparison functions resolved and arguments already cast to the
+    column types. NULLs and incomparable values never match. extra is an
+    additional test ANDed in. Returns None when nothing needs checking.
+    """
+    tests = [(col, _COMPARATORS[op], arg) for col, op, arg in preds]
+    if not tests:
+        return extra
+    def test(row):
+        for col, cmp, arg in tests:
+            value = row.get(col)
+            if value is None:
+                return False
+            try:
+                if not cmp(value, arg):
+                    return False
+            except TypeError:
+                return False
+        return extra is None or extra(row)
+    return test
+
+
+class _ProfileSlot(threading.local):
+    profile = None  # QueryProfile collecting this thread's query (EXPLAIN ANALYZE), if any
+
+
+def _ddl(method):
+    """Runs an engine method with the catalog held exclusively: no query or row write is in flight."""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._catalog.write_locked():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+def _row_write(method):
+    """
+    Runs a row write on its first argument's table under that table's latch
+    (and its FK parents'), then checkpoints if the WAL has grown. The
+    checkpoint takes every table latch in turn, so it runs after release.
+    Counted and timed in core.metrics under the method's name.
+    """
+    operation = (method.__name__,)
+    @functools.wraps(method)
+    def locked(self, table_name, *args, **kwargs):
+        start = time.perf_counter()
+        with self._locked(table_name, parents=True):
+            result = method(self, table_name, *args, **kwargs)
+        metrics.WRITE_SECONDS.observe(operation, time.perf_counter() - start)
+        metrics.TABLE_OPERATIONS.inc((self.active_db, table_name) + operation)
+        self._maybe_checkpoint()
+        return result
+    return locked
+
+
+def _encode_cursor(kind, value):
+    """Opaque page cursor: the keyset position after the last row returned."""
+    raw = json.dumps([kind, value], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor, kind):
+    try:
+        cursor_kind, value = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page cursor.")
+    if cursor_kind != kind:
+        raise ValueError("Page cursor no longer matches this table's ordering; restart from the first page.")
+    return value
+
+
+def _range_bounds(preds):
+    """Folds the range predicates on one column into (low, include_low, high, include_high)."""
+    low = high = None
+    include_low = include_high = True
+    for _, op, arg in preds:
+        if op in ('>', '>=') and (low is None or arg > low or (arg == low and op == '>')):
+            low, include_low = arg, op == '>='
+        elif op in ('<', '<=') and (high is None or arg < high or (arg == high and op == '<')):
+            high, include_high = arg, op == '<='
+    return low, include_low, high, include_high
 
 class DatabaseEngine:
-    def __init__(self):
+    def __init__(self, durable=True):
         self.active_db = None
         self.indices = {} # Stores {table_name: {column_name: Index()}}
         self.schemas = {} # Stores {table_name: TableSchema}
+        self.durable = durable # fsync the WAL on every (group) commit
+        self.wal = None
+        self._index_versions = {} # {table_name: table version of the persisted index snapshot}
+        self.columnar = {} # {table_name: ColumnStore, or None if its rows do not fit one}
+        self._columnar_versions = {} # {table_name: table version of the persisted column snapshot}
+        self.schema_version = 0 # Bumped on every schema change; stale plans re-plan
+        self._plans = OrderedDict() # {(db_name, sql_text): PreparedStatement}
+        self._plans_lock = threading.Lock()
+        # Concurrency (see core/locking.py): the catalog lock is shared by
+        # queries and row writes and exclusive for DDL; per-table latches
+        # serialize the writers of a table.
+        self._catalog = RWLock('catalog')
+        self._latches = {} # {table_name: threading.RLock}
+        self._latches_lock = threading.Lock()
+        self._migrations = {} # {table_name: background compactor thread (see _migrate_rows)}
+        self._profiles = _ProfileSlot()
 
     # --- DATABASE OPERATIONS ---
 
     def list_databases(self):
         """Lists all existing database folders in the data directory."""
-        if not os.path.exists(storage.BASE_DATA_DIR):
-            return []
-        return [d for d in os.listdir(storage.BASE_DATA_DIR) 
-                if os.path.isdir(os.path.join(storage.BASE_DATA_DIR, d))]
+        return storage.list_databases()
 
+    @_ddl
     def set_active_db(self, db_name):
-        """Switches context and hydrates memory with DB metadata."""
+        """Switches context and reads DB metadata. Table data and indices load lazily on first use."""
+        self._close_wal()
         self.active_db = db_name
         self.schemas = {}
         self.indices = {}
+        self._index_versions = {}
+        self.columnar = {}
+        self._columnar_versions = {}
         
         db_path = storage.ensure_db_dir(db_name)
-        metadata_file = os.path.join(db_path, 'metadata.json')
-        
+        metadata = storage.load_metadata(db_name)
+
+        for table_name, schema_dict in metadata.items():
+            schema = TableSchema(
+                name=schema_dict['name'],
+                columns=schema_dict['columns'],
+                primary_key=schema_dict.get('primary_key'),
+                unique_keys=schema_dict.get('unique_keys', []),
+                foreign_keys=schema_dict.get('foreign_keys', {}), # Ensure FKs load
+                indexes=schema_dict.get('indexes', {}),
+                layout=schema_dict.get('layout', 'row'),
+                defaults=schema_dict.get('defaults', {}),
+                version=schema_dict.get('version', 0),
+                rows_version=schema_dict.get('rows_version'),
+                dropped=schema_dict.get('dropped', [])
+            )
+            self.schemas[table_name] = schema
+            storage.set_row_layout(db_name, table_name, schema.columns)
+
+            # Tables written before the segment layout are converted once
+            storage.migrate_legacy_table(db_name, table_name)
+
+        # Crash recovery: redo every commit still in the WAL, then checkpoint
+        self.wal = WriteAheadLog(db_path, sync=self.durable)
+        replayed = False
+        for ops in self.wal.replay():
+            storage.apply_ops(db_name, [op for op in ops if op[0] in self.schemas])
+            replayed = True
+        if replayed:
+            self.checkpoint()
+
+        # Resume compacting tables whose rows an ADD/DROP COLUMN left behind
+        for table_name in self.schemas:
+            self._start_migration(table_name)
+
+    def checkpoint(self):
+        """Flushes applied table writes to disk, truncates the WAL and snapshots changed indices and column stores."""
+        with self._catalog.read_locked():
+            if self.wal:
+                self.wal.checkpoint(lambda: storage.sync_database(self.active_db))
+                self._save_indices()
+                self._save_column_stores()
+
+    def _maybe_checkpoint(self):
+        # Only called once a mutation has also updated the indices, so a
+        # snapshot never pairs a table version with a stale index.
+        wal = self.wal
+        if wal and wal.needs_checkpoint():
+            self.checkpoint()
+
+    @_ddl
+    def close(self):
+        """Checkpoints and closes the active database; the engine is left without one."""
+        self._close_wal()
+        self.active_db = None
+        self.schemas = {}
+        self.indices = {}
+        self.columnar = {}
+        self._schema_changed()
+
+    def _close_wal(self):
+        if self.wal:
+            self.checkpoint()
+            self.wal.close()
+            self.wal = None
+
+    def _commit(self, ops):
+        """Logs row ops [table, rid, row|None] to the WAL, then applies them to the segments."""
+        self.wal.commit(ops)
         try:
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-            for table_name, schema_dict in metadata.items():
-                schema = TableSchema(
-                    name=schema_dict['name'],
-                    columns=schema_dict['columns'],
-                    primary_key=schema_dict.get('primary_key'),
-                    unique_keys=schema_dict.get('unique_keys', []),
-                    foreign_keys=schema_dict.get('foreign_keys', {}) # Ensure FKs load
-                )
-                self.schemas[table_name] = schema
-                self.indices[table_name] = {}
-                
-                if schema.primary_key:
-                    self.indices[table_name][schema.primary_key] = Index()
-                    rows = storage.load_table_data(db_name, table_name)
-                    for idx, r in enumerate(rows):
-                        pk_value = r[schema.primary_key]
-                        self.indices[table_name][schema.primary_key].add(pk_value, idx)
-        except (FileNotFoundError, json.JSONDecodeError):
-            pass
+            storage.apply_ops(self.active_db, ops)
+        finally:
+            self.wal.applied()
 
+    @_ddl
     def delete_database(self, db_name):
         """Physically removes the database directory."""
         db_path = os.path.join(storage.BASE_DATA_DIR, db_name)
         if os.path.exists(db_path):
+            if self.active_db == db_name:
+                self.wal.close()
+                self.wal = None
             shutil.rmtree(db_path)
+            storage.close_database(db_name)
             if self.active_db == db_name:
                 self.active_db = None
                 self.schemas = {}
                 self.indices = {}
+                self.columnar = {}
+            self._schema_changed()
             return f"Database '{db_name}' dropped."
         raise ValueError(f"Database '{db_name}' not found.")
 
+    # --- PREPARED STATEMENTS ---
+
+    def prepare(self, sql_text):
+        """
+        Returns a PreparedStatement for sql_text, where '?' marks a parameter.
+        Plans are cached per database and statement text until the schema changes.
+        """
+        key = (self.active_db, sql_text.strip())
+        with self._plans_lock:
+            prepared = self._plans.get(key)
+            if prepared is not None:
+                self._plans.move_to_end(key)
+                metrics.PLAN_CACHE.inc(('hit',))
+                return prepared
+        metrics.PLAN_CACHE.inc(('miss',))
+
+        with self._catalog.read_locked():
+            prepared = planner.prepare(self, key[1])
+        with self._plans_lock:
+            if prepared.version == self.schema_version:
+                self._plans[key] = prepared
+                if len(self._plans) > PLAN_CACHE_SIZE:
+                    self._plans.popitem(last=False)
+        return prepared
+
+    def execute(self, sql_text, params=()):
+        """Runs one SQL statement, binding params to its '?' placeholders in order."""
+        return self.prepare(sql_text).execute(self, params)
+
+    # --- PROFILING (EXPLAIN ANALYZE) ---
+
+    @property
+    def profile(self):
+        """The QueryProfile collecting the calling thread's query, or None."""
+        return self._profiles.profile
+
+    @contextmanager
+    def profiling(self, profile):
+        """Collects what the engine does for the queries this thread runs into profile (see core/profile.py)."""
+        previous, self._profiles.profile = self._profiles.profile, profile
+        try:
+            yield profile
+        finally:
+            self._profiles.profile = previous
+
+    def _note(self, **details):
+        """Tells the profile of the calling thread's query, if any, what the engine did."""
+        profile = self._profiles.profile
+        if profile is not None:
+            profile.note(**details)
+
+    def explain_access(self, table_name, where=None, order_by=None, descending=False, aggregating=False):
+        """How select (or aggregate) would read the table for where, as a label such as 'index probe on id'."""
+        with self._locked(table_name):
+            schema = self.schemas.get(table_name)
+            if schema is None:
+                raise ValueError(f"Table '{table_name}' not found.")
+            preds = self._normalize_where(schema, where or {})
+            if not preds and order_by is None:
+                rids, strategy = None, 'full scan'
+            else:
+                rids, _, _, strategy = self._access_path(table_name, preds, order_by, descending)
+            # As in _matching_rows and aggregate
+            if (rids is None or aggregating) and self._column_store(table_name) is not None:
+                return 'columnar scan'
+            return strategy
+
+    def explain_join(self, table_a_name, table_b_name, join_col_a, join_col_b):
+        """The strategy join would pick for these tables (see _join_strategy)."""
+        with self._locked(table_a_name, table_b_name):
+            return self._join_strategy(table_a_name, table_b_name, join_col_a, join_col_b)[0]
+
+    # --- TRANSACTIONS ---
+
+    def begin(self):
+        """Starts a transaction on the active database (see core/transaction.py)."""
+        if not self.active_db:
+            raise ValueError("No active database selected.")
+        return Transaction(self)
+
+    def commit_transaction(self, txn):
+        """
+        Applies a transaction's pending writes as a single WAL commit. Holding
+        the latches of every table it wrote (and their FK parents), it first
+        rejects the commit if a row it changed was changed by someone else
+        since, then re-checks its rows against the constraints.
+        """
+        with self._locked(*txn.writes, parents=True):
+            if self.active_db != txn.db_name or self.schema_version != txn.started_version:
+                raise ValueError("The schema changed during the transaction; it was rolled back.")
+            # 1. First committer wins
+            for (table_name, rid), original in txn.originals.items():
+                if storage.read_row(self.active_db, table_name, rid) != original:
+                    raise ValueError(f"Write conflict on '{table_name}': a row this transaction changed "
+                                     "was changed by another session. Transaction rolled back.")
+            # 2. Constraints against what other sessions committed meanwhile
+            for table_name, pending in txn.writes.items():
+                schema = self.schemas[table_name]
+                for rid, row in pending.items():
+                    if row is not None:
+                        self._check_unique(table_name, row, rid, txn)
+                        self._check_foreign_keys(schema, row, txn)
+
+            # 3. One log record and fsync for the whole transaction
+            ops = [[table_name, rid, row] for table_name, pending in txn.writes.items()
+                   for rid, row in pending.items()
+                   if row is not None or txn.originals[(table_name, rid)] is not None]
+            if ops:
+                self._commit(ops)
+            for table_name, rid, row in ops:
+                original = txn.originals[(table_name, rid)]
+                if original is not None:
+                    self._unindex_row(table_name, rid, original)
+                if row is not None:
+                    self._index_row(table_name, rid, row)
+        self._maybe_checkpoint()
+        return f"Transaction committed ({len(ops)} row write(s))."
+
+    def _schema_changed(self):
+        with self._plans_lock:
+            self.schema_version += 1
+            self._plans.clear()
+
+    # --- LOCKING ---
+
+    def _latch(self, table_name):
+        with self._latches_lock:
+            latch = self._latches.get(table_name)
+            if latch is None:
+                latch = self._latches[table_name] = threading.RLock()
+            return latch
+
+    @contextmanager
+    def _locked(self, *tables, parents=False):
+        """
+        Holds the catalog shared and the latches of the given tables (plus
+        their FK parent tables with parents=True), taken in name order so
+        two threads never wait on each other's latches.
+        """
+        with self._catalog.read_locked():
+            names = {t for t in tables if t is not None}
+            if parents:
+                for table_name in list(names):
+                    schema = self.schemas.get(table_name)
+                    if schema is not None:
+                        names.update(ref.split('.')[0] for ref in schema.foreign_keys.values())
+            latches = [self._latch(name) for name in sorted(names)]
+            for latch in latches:
+                if not latch.acquire(blocking=False):
+                    # Only waits are timed: an uncontended latch costs no clock reads
+                    start = time.perf_counter()
+                    latch.acquire()
+                    metrics.LOCK_WAIT_SECONDS.observe(('table',), time.perf_counter() - start)
+            try:
+                yield
+            finally:
+                for latch in reversed(latches):
+                    latch.release()
+
     # --- TABLE OPERATIONS ---
 
+    @_ddl
     def create_table(self, name, columns, primary_key=None, unique_keys=None, foreign_keys=None):
         if not self.active_db:
             raise ValueError("Please select or create a database first.")
             
         schema = TableSchema(name, columns, primary_key, unique_keys, foreign_keys)
         self.schemas[name] = schema
-        self.indices[name] = {}
-        
-        if primary_key:
-            self.indices[name][primary_key] = Index()
+        self.indices[name] = {col: new_index(**spec) for col, spec in schema.indexed_columns().items()}
             
         storage.save_schema(self.active_db, schema.to_dict())
-        storage.save_table_data(self.active_db, name, []) 
+        storage.set_row_layout(self.active_db, name, schema.columns)
+        storage.save_table_data(self.active_db, name, [])
+        self._schema_changed()
         return f"Table '{name}' created successfully in '{self.active_db}'."
 
+    @_ddl
     def drop_table(self, table_name):
         """Deletes table data and metadata entry."""
         if not self.active_db:
@@ -89,180 +448,989 @@ class DatabaseEngine:
         # Remove from memory
         self.schemas.pop(table_name, None)
         self.indices.pop(table_name, None)
+        self._index_versions.pop(table_name, None)
+        self._drop_column_store(table_name)
+
+        # Settle logged writes so none can be replayed into a recreated table
+        self.checkpoint()
 
         # Update metadata.json on disk
-        db_path = storage.ensure_db_dir(self.active_db)
-        metadata_file = os.path.join(db_path, 'metadata.json')
-        with open(metadata_file, 'r') as f:
-            metadata = json.load(f)
-        
+        metadata = storage.load_metadata(self.active_db)
         if table_name in metadata:
             del metadata[table_name]
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=4)
+            storage.save_metadata(self.active_db, metadata)
 
-        # Delete JSON file
-        file_path = os.path.join(db_path, f"{table_name}.json")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Delete the table's segment files
+        storage.drop_table_data(self.active_db, table_name)
+        self._schema_changed()
         return f"Table '{table_name}' dropped."
 
     # --- ROW OPERATIONS ---
 
-    def insert(self, table_name, row_data):
+    @_row_write
+    def insert(self, table_name, row_data, validate=True, txn=None):
+        """
+        Inserts one row. validate=False skips type coercion for rows already
+        cast (prepared statements). With txn the row is buffered in that
+        transaction until it commits.
+        """
         if not self.active_db:
             raise ValueError("No active database selected.")
         
         schema = self.schemas[table_name]
-        data = schema.validate(row_data)
-        
-        rows = storage.load_table_data(self.active_db, table_name)
+        data = schema.validate(row_data) if validate else row_data
         
-        # Primary Key Check
-        if schema.primary_key:
-            pk_val = data.get(schema.primary_key)
-            if any(r.get(schema.primary_key) == pk_val for r in rows):
-                raise ValueError(f"PK Integrity Error: {pk_val} already exists.")
+        # Primary Key / Unique Checks (O(1) index probes)
+        self._check_unique(table_name, data, txn=txn)
 
         # Foreign Key Check
-        if hasattr(schema, 'foreign_keys') and schema.foreign_keys:
-            for local_col, reference in schema.foreign_keys.items():
-                parent_table, parent_col = reference.split('.')
-                parent_rows = storage.load_table_data(self.active_db, parent_table)
-                fk_val = data.get(local_col)
-                if not any(pr.get(parent_col) == fk_val for pr in parent_rows):
-                    raise ValueError(f"FK Integrity Error: Value '{fk_val}' not found in {parent_table}.")
-
-        rows.append(data)
-        storage.save_table_data(self.active_db, table_name, rows)
+        self._check_foreign_keys(schema, data, txn)
+
+        rid = storage.allocate_rid(self.active_db, table_name)
+        if txn is not None:
+            txn.write(table_name, rid, data, None)
+            return "Row inserted."
+        self._commit([[table_name, rid, data]])
+        self._index_row(table_name, rid, data)
         return "Row inserted."
 
-    def update(self, table_name, pk_value, updated_fields):
+    def insert_many(self, table_name, rows, batch_size=INSERT_BATCH_ROWS, txn=None):
+        """
+        Inserts an iterable of rows, consuming it in batches. Each batch is
+        validated against the indices in bulk (PK/unique, FK) and written as a
+        single WAL commit; a failing batch is rejected whole, earlier ones stay.
+        With txn the rows are checked and buffered one at a time.
+        """
+        if not self.active_db:
+            raise ValueError("No active database selected.")
+        if table_name not in self.schemas:
+            raise ValueError(f"Table '{table_name}' not found.")
+        metrics.TABLE_OPERATIONS.inc((self.active_db, table_name, 'insert_many'))
+        start = time.perf_counter()
+        if txn is not None:
+            inserted = 0
+            for row in rows:
+                self.insert(table_name, dict(row), txn=txn)
+                inserted += 1
+            metrics.WRITE_SECONDS.observe(('insert_many',), time.perf_counter() - start)
+            return f"{inserted} rows inserted."
+
+        rows = iter(rows)
+        inserted = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            # Latched per batch, so other writers interleave with a long load
+            with self._locked(table_name, parents=True):
+                schema = self.schemas[table_name]
+                try:
+                    # 1. Types, then constraints for the whole batch
+                    for n, row in enumerate(batch):
+                        batch[n] = schema.validate(dict(row))
+                    self._check_unique_many(table_name, batch)
+                    self._check_foreign_keys_many(schema, batch)
+                except (ValueError, TypeError) as e:
+                    raise type(e)(f"{e} ({inserted} rows inserted before the failing batch)")
+
+                # 2. One commit (one log record, one fsync, one append) per batch
+                ops = [[table_name, storage.allocate_rid(self.active_db, table_name), row] for row in batch]
+                self._commit(ops)
+                for _, rid, row in ops:
+                    self._index_row(table_name, rid, row)
+            inserted += len(batch)
+            self._maybe_checkpoint()
+        metrics.WRITE_SECONDS.observe(('insert_many',), time.perf_counter() - start)
+        return f"{inserted} rows inserted."
+
+    def copy_from(self, table_name, path, file_format=None, txn=None):
+        """Streams a CSV (header row) or NDJSON file into a table through insert_many."""
+        return self.insert_many(table_name, loader.read_rows(path, file_format), txn=txn)
+
+    @_row_write
+    def update(self, table_name, pk_value, updated_fields, txn=None):
         """Finds row by PK and merges new fields."""
         if not self.active_db:
             raise ValueError("No active database.")
         
         schema = self.schemas[table_name]
-        rows = storage.load_table_data(self.active_db, table_name)
         pk_col = schema.primary_key
-        
-        updated = False
-        for i, row in enumerate(rows):
-            if str(row.get(pk_col)) == str(pk_value):
-                new_row = {**row, **updated_fields}
-                rows[i] = schema.validate(new_row)
-                updated = True
-                break
+        if not pk_col:
+            raise ValueError(f"Table '{table_name}' has no primary key.")
+
+        rids = self._lookup(table_name, pk_col, pk_value, txn)
+        row = self._read_row(table_name, rids[0], txn) if rids else None
+        if row is None:
+            raise ValueError(f"Record {pk_value} not found.")
+        rid = rids[0]
 
-        if updated:
-            storage.save_table_data(self.active_db, table_name, rows)
-            self.set_active_db(self.active_db) # Refresh memory/indices
+        new_row = schema.validate({**row, **updated_fields})
+        self._check_unique(table_name, new_row, rid, txn)
+        self._check_foreign_keys(schema, new_row, txn)
+        if txn is not None:
+            txn.write(table_name, rid, new_row, row)
             return f"Record {pk_value} updated."
-        raise ValueError(f"Record {pk_value} not found.")
 
-    def delete(self, table_name, where):
-        """Deletes rows matching 'where' criteria."""
+        self._commit([[table_name, rid, new_row]])
+        self._unindex_row(table_name, rid, row)
+        self._index_row(table_name, rid, new_row)
+        return f"Record {pk_value} updated."
+
+    @_row_write
+    def update_where(self, table_name, where, updated_fields, predicate=None, txn=None):
+        """
+        Merges new fields into every row matching 'where' (same forms as select)
+        and the predicate row -> bool test. All new rows are checked (types,
+        PK/unique across the batch, FK) before any is written, then written
+        as a single WAL commit, so a failing row leaves the table unchanged.
+        """
         if not self.active_db:
             raise ValueError("No active database.")
-        
-        rows = storage.load_table_data(self.active_db, table_name)
-        new_rows = [
-            r for r in rows 
-            if not all(str(r.get(k)) == str(v) for k, v in where.items())
-        ]
-        
-        storage.save_table_data(self.active_db, table_name, new_rows)
-        self.set_active_db(self.active_db) # Refresh indices
-        return f"Deleted {len(rows) - len(new_rows)} row(s)."
+        schema = self.schemas.get(table_name)
+        if schema is None:
+            raise ValueError(f"Table '{table_name}' not found.")
+
+        preds = self._normalize_where(schema, where)
+        matches, _ = self._matching_rows(table_name, preds, extra=predicate, txn=txn)
+        changes = [(rid, row, schema.validate({**row, **updated_fields})) for rid, row in matches]
+        new_rows = [new_row for _, _, new_row in changes]
+        self._check_unique_many(table_name, new_rows, rids=[rid for rid, _, _ in changes], txn=txn)
+        for new_row in new_rows:
+            self._check_foreign_keys(schema, new_row, txn)
+
+        if txn is not None:
+            for rid, row, new_row in changes:
+                txn.write(table_name, rid, new_row, row)
+        elif changes:
+            self._commit([[table_name, rid, new_row] for rid, _, new_row in changes])
+            for rid, row, new_row in changes:
+                self._unindex_row(table_name, rid, row)
+                self._index_row(table_name, rid, new_row)
+        return f"Updated {len(changes)} row(s)."
+
+    @_row_write
+    def delete(self, table_name, where, predicate=None, txn=None):
+        """Deletes rows matching 'where' criteria (same forms as select) and the predicate test."""
+        if not self.active_db:
+            raise ValueError("No active database.")
+        schema = self.schemas.get(table_name)
+        if schema is None:
+            raise ValueError(f"Table '{table_name}' not found.")
+
+        preds = self._normalize_where(schema, where)
+        matches, _ = self._matching_rows(table_name, preds, extra=predicate, txn=txn)
+        doomed = list(matches)
+
+        if txn is not None:
+            for rid, row in doomed:
+                txn.write(table_name, rid, None, row)
+        elif doomed:
+            self._commit([[table_name, rid, None] for rid, _ in doomed])
+            for rid, row in doomed:
+                self._unindex_row(table_name, rid, row)
+        return f"Deleted {len(doomed)} row(s)."
+
+    def select(self, table_name, where=None, order_by=None, descending=False, limit=None, offset=0,
+               columns=None, predicate=None, txn=None):
+        """
+        Returns matching rows. 'where' maps a column to a value (equality) or to an
+        (op, value) tuple with op in =, !=, <, <=, >, >=, or ('between', low, high).
+        Equality uses any index on the column; range predicates, order_by and limit
+        walk an ordered index when one exists, reading only the rows they return.
+        """
+        rows = list(self.iter_select(table_name, where, order_by, descending, limit, offset, columns, predicate,
+                                     txn))
+        metrics.ROWS_RETURNED.inc(amount=len(rows))
+        return rows
+
+    def iter_select(self, table_name, where=None, order_by=None, descending=False, limit=None, offset=0,
+                    columns=None, predicate=None, txn=None):
+        """
+        Iterator form of select: rows are decoded from storage only as the caller
+        consumes them, so stopping early never reads the rest of the table.
+        'columns' projects each row and 'predicate' is an extra row -> bool test;
+        both are applied inside the storage scan, so rejected rows and unneeded
+        columns are never materialized.
+
+        The rows form a snapshot of the table as of the call: writes made while
+        the caller is still iterating are not seen, and do not wait for it.
+        With txn the transaction's pending writes are overlaid on it.
+        """
+        with self._locked(table_name):
+            if not self.active_db:
+                raise ValueError("No active database selected.")
+            schema = self.schemas.get(table_name)
+            if schema is None:
+                raise ValueError(f"Table '{table_name}' not found.")
+            metrics.TABLE_OPERATIONS.inc((self.active_db, table_name, 'select'))
+            stop = None if limit is None else offset + limit
+
+            preds = self._normalize_where(schema, where or {})
+            # Sorting needs the ORDER BY column even when the caller did not ask for it
+            trim = columns is not None and order_by is not None and order_by not in columns
+            scan_columns = list(columns) + [order_by] if trim else columns
+            matches, presorted = self._matching_rows(table_name, preds, predicate, order_by, descending,
+                                                     scan_columns, stop, txn)
+        rows = (row for _, row in matches)
+
+        if presorted or order_by is None:
+            # Rows already arrive in the requested order: stop after 'limit'
+            return itertools.islice(rows, offset, stop)
+        key = lambda row: (row.get(order_by) is None, row.get(order_by))  # NULLs last
+        if stop is not None:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            rows = pick(stop, rows, key=key)[offset:]
+        else:
+            rows = sorted(rows, key=key, reverse=descending)[offset:]
+        if trim:
+            rows = [{col: row.get(col) for col in columns} for row in rows]
+        return iter(rows)
+
+    def _matching_rows(self, table_name, preds, extra=None, order_by=None, descending=False, columns=None,
+                       limit=None, txn=None):
+        """
+        Yields (rid, row) for rows matching preds and the extra row -> bool test,
+        fetched by the cheapest access path for preds. Returns (iterator,
+        presorted) as _access_path does. Full scans of a columnar table filter
+        and project its column arrays instead of decoding the segments.
+
+        Call it under the table latch: the rows come from a snapshot taken
+        now, so the caller may iterate after releasing it. limit is how many
+        matches the caller will take at most, if it needs no sorting.
+        """
+        pending = txn.pending(table_name) if txn is not None else None
+        if pending:
+            matches = self._overlay_rows(table_name, preds, extra, columns, pending)
+            self._note(strategy='scan with pending rows')
+            return matches, False
+        if not preds and order_by is None:
+            # Plain scan: no need to load the indices
+            rids, presorted, covered, strategy = None, False, (), 'full scan'
+        else:
+            rids, presorted, covered, strategy = self._access_path(table_name, preds, order_by, descending)
+        profile = self._profiles.profile
+
+        store = self._column_store(table_name) if rids is None else None
+        if store is not None:
+            if profile is not None:
+                profile.note(strategy='columnar scan')
+                extra = profile.timed(extra)
+            if extra is None:
+                return store.scan(preds, columns), presorted
+            # The residual test sees whole rows, so project after it
+            matches = ((rid, row) for rid, row in store.scan(preds) if extra(row))
+            if columns is not None:
+                matches = ((rid, {col: row.get(col) for col in columns}) for rid, row in matches)
+            return matches, presorted
+
+        if rids is None:
+            test = _compile_predicate(preds, extra)
+            if profile is not None:
+                profile.note(strategy=strategy)
+                test = profile.timed(test)
+            equals = {col: arg for col, op, arg in preds if op == '='}
+            return storage.scan_table(self.active_db, table_name, columns=columns,
+                                      predicate=test, equals=equals), presorted
+
+        # Index entries change under writers: capture the row ids now
+        test = _compile_predicate([p for p in preds if p not in covered], extra)
+        if limit is not None and test is None and (presorted or order_by is None):
+            rids = list(itertools.islice(rids, limit))  # Every id matches: take only what is needed
+        else:
+            rids = list(rids)
+        if profile is not None:
+            profile.note(strategy=strategy, index_rows=len(rids))
+            test = profile.timed(test)
+        if len(rids) <= EAGER_FETCH_ROWS:
+            snapshot = None
+            read = functools.partial(storage.read_row, self.active_db, table_name)
+            rows = [(rid, read(rid)) for rid in rids]
+        else:
+            snapshot = storage.snapshot_table(self.active_db, table_name)
+            rows = ((rid, snapshot.read(rid)) for rid in rids)
 
-    def select(self, table_name, where=None):
+        def fetch(snapshot):
+            try:
+                for rid, row in rows:
+                    if row is None or (test is not None and not test(row)):
+                        continue
+                    yield rid, (row if columns is None else {col: row.get(col) for col in columns})
+            finally:
+                if snapshot is not None:
+                    snapshot.close()
+        return fetch(snapshot), presorted
+
+    def _overlay_rows(self, table_name, preds, extra, columns, pending):
+        """
+        _matching_rows for a table a transaction has written to: the committed
+        matches it has not touched, then its own pending rows that match.
+        """
+        pending = dict(pending)
+        committed, _ = self._matching_rows(table_name, preds, extra)
+        test = _compile_predicate(preds, extra)
+        own = [(rid, dict(row)) for rid, row in pending.items() if row is not None and (test is None or test(row))]
+
+        def merged():
+            for rid, row in itertools.chain(((rid, row) for rid, row in committed if rid not in pending), own):
+                yield rid, (row if columns is None else {col: row.get(col) for col in columns})
+        return merged()
+
+    def select_page(self, table_name, limit, cursor=None):
+        """
+        Returns (rows, next_cursor) for one page of a keyset scan. Pages follow the
+        primary key when it has an ordered index and row ids otherwise; either way
+        the cursor seeks straight past the previous page, so only the requested
+        rows are decoded. next_cursor is None once the table is exhausted.
+        """
         if not self.active_db:
             raise ValueError("No active database selected.")
-        rows = storage.load_table_data(self.active_db, table_name)
-        if not where:
-            return rows
-        
+        schema = self.schemas.get(table_name)
+        if schema is None:
+            raise ValueError(f"Table '{table_name}' not found.")
+        if limit < 1:
+            raise ValueError("Page limit must be at least 1.")
+
+        pk = schema.primary_key
+        with self._locked(table_name):
+            pk_index = self._table_indices(table_name).get(pk) if pk else None
+        kind = 'pk' if pk_index is not None and pk_index.ordered else 'rid'
+        after = _decode_cursor(cursor, kind) if cursor else None
+
+        if kind == 'pk':
+            where = {pk: ('>', after)} if after is not None else None
+            rows = self.select(table_name, where, order_by=pk, limit=limit)
+            last = rows[-1][pk] if rows else None
+        else:
+            entries = list(itertools.islice(
+                storage.scan_table(self.active_db, table_name, after if after is not None else -1), limit))
+            rows = [row for _, row in entries]
+            last = entries[-1][0] if entries else None
+            metrics.TABLE_OPERATIONS.inc((self.active_db, table_name, 'select'))
+            metrics.ROWS_RETURNED.inc(amount=len(rows))
+        next_cursor = _encode_cursor(kind, last) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def aggregate(self, table_name, aggregates, group_by=(), where=None, txn=None):
+        """
+        Computes aggregates [(label, func, column or None for COUNT(*))] over the
+        rows matching 'where' (same forms as select) and returns an iterator
+        with one output row per group_by group. Rows stream through a hash
+        table whose memory is capped by aggregate.MAX_GROUPS (larger groupings
+        spill to temporary files). Columnar tables run it over their column
+        arrays (vectorized with NumPy when installed); row tables fold the
+        matching rows, projected to the columns involved.
+        """
+        with self._locked(table_name):
+            if not self.active_db:
+                raise ValueError("No active database selected.")
+            schema = self.schemas.get(table_name)
+            if schema is None:
+                raise ValueError(f"Table '{table_name}' not found.")
+            for _, func, col in aggregates:
+                if func not in aggregate.FUNCTIONS:
+                    raise ValueError(f"Unsupported aggregate '{func}'.")
+                if col is not None and col not in schema.columns:
+                    raise ValueError(f"Column '{col}' not found in {table_name}.")
+            metrics.TABLE_OPERATIONS.inc((self.active_db, table_name, 'aggregate'))
+            group_by = list(group_by)
+
+            preds = self._normalize_where(schema, where or {})
+            # A transaction's pending rows are not in the column arrays
+            dirty = txn is not None and txn.pending(table_name)
+            store = self._column_store(table_name) if not dirty else None
+            if store is None:
+                needed = list(dict.fromkeys(group_by + [col for _, _, col in aggregates if col is not None]))
+                matches, _ = self._matching_rows(table_name, preds, columns=needed, txn=txn)
+            else:
+                snapshot = store.snapshot()
+                self._note(strategy='columnar scan')
+        # Both paths read a snapshot, so the folding runs without the latch
+        if store is not None:
+            return store.aggregate(preds, group_by, aggregates, snapshot)
+        return aggregate.hash_aggregate((row for _, row in matches), group_by, aggregates)
+
+    def _normalize_where(self, schema, where):
+        """
+        Turns a where-dict into [(col, op, coerced_arg)]; BETWEEN becomes a >= / <= pair.
+        A column may carry a list of conditions, e.g. {'amount': [('>', 5), ('<', 10)]}.
+        """
+        preds = []
+        def add(col, op, value):
+            # A fractional value must not be truncated onto an int column
+            if (schema.columns.get(col) == 'int' and isinstance(value, float) and math.isfinite(value)
+                    and not value.is_integer()):
+                preds.extend(_int_comparisons(col, op, value))
+            else:
+                preds.append((col, op, schema.coerce(col, value)))
+
+        for col, cond in where.items():
+            if isinstance(cond, list) and cond and isinstance(cond[0], (tuple, list)):
+                conds = cond
+            else:
+                conds = [cond]
+            for cond in conds:
+                if isinstance(cond, (tuple, list)):
+                    op = cond[0].lower()
+                    if op == 'between':
+                        add(col, '>=', cond[1])
+                        add(col, '<=', cond[2])
+                        continue
+                    if op not in _COMPARATORS:
+                        raise ValueError(f"Unsupported operator '{cond[0]}'.")
+                    add(col, op, cond[1])
+                else:
+                    add(col, '=', cond)
+        return preds
+
+    def _access_path(self, table_name, preds, order_by, descending):
+        """
+        Picks how to fetch candidate rows. Returns (rids, presorted, covered,
+        strategy) where rids is None for a full scan, presorted means rids
+        already follow order_by, covered lists the preds every returned rid
+        satisfies and strategy names the choice (for EXPLAIN).
+        """
+        indexes = self._table_indices(table_name)
+
+        # 1. Equality probe, unique indices first
+        equalities = [(col, arg) for col, op, arg in preds if op == '=' and col in indexes]
+        if equalities:
+            col, arg = min(equalities, key=lambda e: not indexes[e[0]].unique)
+            covered = [(col, '=', arg)] if arg is not None else ()  # NULL never matches: keep the test
+            rids = indexes[col].lookup(arg)
+            metrics.INDEX_LOOKUPS.inc(('hit' if rids else 'miss',))
+            self._note(index_probes=1, index_hits=1 if rids else 0)
+            if col == self.schemas[table_name].primary_key:
+                strategy = f"index probe on {col} (primary key)"
+            else:
+                strategy = f"index probe on {col}" + (" (unique)" if indexes[col].unique else "")
+            return rids, False, covered, strategy
+
+        # 2. Range scan on an ordered index (prefer the ORDER BY column)
+        ranged = {col for col, op, _ in preds
+                  if op in _RANGE_OPS and getattr(indexes.get(col), 'ordered', False)}
+        if ranged:
+            col = order_by if order_by in ranged else sorted(ranged)[0]
+            low, include_low, high, include_high = _range_bounds([p for p in preds if p[0] == col])
+            in_order = col == order_by
+            rids = indexes[col].range(low, high, include_low, include_high, reverse=in_order and descending)
+            metrics.INDEX_SCANS.inc(('range',))
+            return rids, in_order, [p for p in preds if p[0] == col and p[1] in _RANGE_OPS], \
+                f"index range scan on {col}"
+
+        # 3. Ordered index walk for ORDER BY (lets LIMIT stop early)
+        if order_by is not None and getattr(indexes.get(order_by), 'ordered', False):
+            metrics.INDEX_SCANS.inc(('ordered_walk',))
+            return indexes[order_by].walk(reverse=descending), True, (), f"ordered index walk on {order_by}"
+
+        return None, False, (), 'full scan'
+
+    # --- INDEX MANAGEMENT ---
+
+    @_ddl
+    def create_index(self, table_name, column, index_name=None, unique=False, ordered=False):
+        """
+        Builds a secondary index and records it in metadata. Hash indices serve
+        equality probes; ordered=True builds a sorted index that also serves
+        range predicates, ORDER BY and LIMIT.
+        """
+        if not self.active_db:
+            raise ValueError("No active database selected.")
+        schema = self.schemas.get(table_name)
+        if not schema:
+            raise ValueError(f"Table '{table_name}' not found.")
+        if column not in schema.columns:
+            raise ValueError(f"Column '{column}' not found in {table_name}.")
+        index_name = index_name or f"{table_name}_{column}_idx"
+        if self._find_index(index_name):
+            raise ValueError(f"Index '{index_name}' already exists.")
+
+        schema.indexes[index_name] = {"column": column, "unique": unique, "ordered": ordered}
+        try:
+            self._reconcile_indices(table_name)
+        except ValueError:
+            del schema.indexes[index_name]
+            raise
+        self.save_metadata()
+        return f"Index '{index_name}' created on {table_name}({column})."
+
+    @_ddl
+    def drop_index(self, index_name):
+        """Removes a secondary index; PK and unique_keys indices remain enforced."""
+        if not self.active_db:
+            raise ValueError("No active database selected.")
+        table_name = self._find_index(index_name)
+        if not table_name:
+            raise ValueError(f"Index '{index_name}' not found.")
+        del self.schemas[table_name].indexes[index_name]
+        self.save_metadata()
+        self._reconcile_indices(table_name)
+        return f"Index '{index_name}' dropped."
+
+    def _find_index(self, index_name):
+        return next((t for t, s in self.schemas.items() if index_name in s.indexes), None)
+
+    def _reconcile_indices(self, table_name):
+        """Brings a table's in-memory indices in line with its schema, rebuilding changed ones."""
+        indexes = self._table_indices(table_name)
+        wanted = self.schemas[table_name].indexed_columns()
+        for col in [c for c in indexes if c not in wanted]:
+            del indexes[col]
+        for col, spec in wanted.items():
+            current = indexes.get(col)
+            if current is not None and (current.unique, current.ordered) == (spec['unique'], spec['ordered']):
+                continue
+            index = new_index(**spec)
+            for rid, row in storage.scan_table(self.active_db, table_name):
+                if not index.add(row.get(col), rid):
+                    raise ValueError(f"Unique Integrity Error: duplicate value '{row.get(col)}' in {table_name}.{col}.")
+            indexes[col] = index
+        self._index_versions.pop(table_name, None) # Force a fresh snapshot
+
+    # --- INDEX MAINTENANCE ---
+
+    def _table_indices(self, table_name):
+        """Returns {column: index} for a table, loading its snapshot (or rebuilding) on first use."""
+        indexes = self.indices.get(table_name)
+        if indexes is not None:
+            return indexes
+
+        columns = self.schemas[table_name].indexed_columns()
+        snapshot = storage.load_index_snapshot(self.active_db, table_name)
+        if snapshot is not None and \
+                {c: {"unique": s['unique'], "ordered": s['ordered']} for c, s in snapshot.items()} == columns:
+            indexes = {col: load_index(snapshot[col]['entries'], **spec) for col, spec in columns.items()}
+            self._index_versions[table_name] = storage.table_version(self.active_db, table_name)
+        else:
+            # Missing or stale snapshot (e.g. after crash recovery): rebuild from the rows
+            indexes = {col: new_index(**spec) for col, spec in columns.items()}
+            for rid, row in storage.scan_table(self.active_db, table_name):
+                for col, index in indexes.items():
+                    index.add(row.get(col), rid)
+        self.indices[table_name] = indexes
+        return indexes
+
+    def _save_indices(self):
+        """Persists the indices of loaded tables whose contents changed since their last snapshot."""
+        for table_name, indexes in list(self.indices.items()):
+            with self._locked(table_name):  # Version and entries must match
+                version = storage.table_version(self.active_db, table_name)
+                if self._index_versions.get(table_name) != version:
+                    entries = {
+                        col: {"unique": index.unique, "ordered": index.ordered, "entries": index.to_entries()}
+                        for col, index in indexes.items()
+                    }
+                    storage.save_index_snapshot(self.active_db, table_name, version, entries)
+                    self._index_versions[table_name] = version
+
+    def _lookup(self, table_name, col, value, txn=None):
+        """
+        Probes the index on table.col for value (coerced to the column type);
+        returns row ids. With txn, rows the transaction rewrote are matched by
+        their pending values instead.
+        """
+        try:
+            value = self.schemas[table_name].coerce(col, value)
+        except (ValueError, TypeError):
+            return []
+        rids = self._table_indices(table_name)[col].lookup(value)
+        metrics.INDEX_LOOKUPS.inc(('hit' if rids else 'miss',))
+        if txn is None:
+            return rids
+        pending = txn.pending(table_name)
+        return [rid for rid in rids if rid not in pending] + txn.pending_rids(table_name, col, value)
+
+    def _read_row(self, table_name, rid, txn=None):
+        """The row at rid as the transaction sees it (committed when txn is None)."""
+        if txn is not None and rid in txn.pending(table_name):
+            row = txn.pending(table_name)[rid]
+            return dict(row) if row is not None else None
+        return storage.read_row(self.active_db, table_name, rid)
+
+    def _pick_index(self, table_name, where):
+        """Chooses the indexed column of a where-clause to probe, preferring unique indices."""
+        indexes = self._table_indices(table_name)
+        candidates = [col for col in where if col in indexes]
+        candidates.sort(key=lambda col: not indexes[col].unique)
+        return candidates[0] if candidates else None
+
+    def _check_unique(self, table_name, row, rid=None, txn=None):
+        """Rejects a row whose PK or unique-indexed values belong to another row."""
+        pk_col = self.schemas[table_name].primary_key
+        pending = txn.pending(table_name) if txn is not None else {}
+        for col, index in self._table_indices(table_name).items():
+            if not index.unique:
+                continue
+            if row.get(col) is None:
+                continue  # NULLs never collide
+            owner = index.get(row.get(col))
+            taken = owner is not None and owner != rid and owner not in pending
+            if txn is not None and not taken:
+                taken = any(other != rid for other in txn.pending_rids(table_name, col, row.get(col)))
+            if taken:
+                if col == pk_col:
+                    raise ValueError(f"PK Integrity Error: {row.get(col)} already exists.")
+                raise ValueError(f"Unique Integrity Error: {col} '{row.get(col)}' already exists.")
+
+    def _check_unique_many(self, table_name, rows, rids=(), txn=None):
+        """
+        Batch form of _check_unique: also rejects duplicates within the batch
+        itself. rids are the stored rows the batch replaces (an update), whose
+        old values no longer count.
+        """
+        pk_col = self.schemas[table_name].primary_key
+        replaced = set(rids)
+        pending = txn.pending(table_name) if txn is not None else {}
+        for col, index in self._table_indices(table_name).items():
+            if not index.unique:
+                continue
+            seen = set()
+            for row in rows:
+                value = row.get(col)
+                if value is None:
+                    continue
+                owner = index.get(value)
+                taken = value in seen or (owner is not None and owner not in replaced and owner not in pending)
+                if txn is not None and not taken:
+                    taken = any(other not in replaced for other in txn.pending_rids(table_name, col, value))
+                if taken:
+                    if col == pk_col:
+                        raise ValueError(f"PK Integrity Error: {value} already exists.")
+                    raise ValueError(f"Unique Integrity Error: {col} '{value}' already exists.")
+                seen.add(value)
+
+    def _index_row(self, table_name, rid, row):
+        for col, index in self._table_indices(table_name).items():
+            index.add(row.get(col), rid)
+        store = self.columnar.get(table_name)
+        if store is not None:
+            try:
+                store.add(rid, row)
+            except Unsupported:
+                self.columnar[table_name] = None  # Back to the row path for this session
+
+    def _unindex_row(self, table_name, rid, row):
+        for col, index in self._table_indices(table_name).items():
+            index.discard(row.get(col), rid)
+        store = self.columnar.get(table_name)
+        if store is not None:
+            store.remove(rid)
+
+    # --- COLUMNAR LAYOUT ---
+
+    @_ddl
+    def set_layout(self, table_name, layout):
+        """Switches a table between the 'row' layout and 'columnar' (row segments plus column arrays)."""
+        if not self.active_db:
+            raise ValueError("No active database selected.")
+        schema = self.schemas.get(table_name)
+        if schema is None:
+            raise ValueError(f"Table '{table_name}' not found.")
+        layout = layout.lower()
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout '{layout}'. Use ROW or COLUMNAR.")
+        schema.layout = layout
+        self._drop_column_store(table_name)
+        self.save_metadata()
+        if layout == 'columnar' and self._column_store(table_name) is None:
+            return f"Table '{table_name}' set to columnar, but its rows do not fit typed columns; scans use the row path."
+        return f"Table '{table_name}' now uses the {layout} layout."
+
+    def _column_store(self, table_name):
+        """
+        Returns the ColumnStore of a columnar table, loading its snapshot (or
+        building it from the segments) on first use. None for row tables and
+        for tables holding values the store cannot type.
+        """
         schema = self.schemas[table_name]
-        col, val = list(where.items())[0]
-        
-        target_type = schema.columns.get(col)
-        if target_type == 'int': 
-            val = int(val)
-        elif target_type == 'float': 
-            val = float(val)
-
-        if table_name in self.indices and col in self.indices[table_name]:
-            idx = self.indices[table_name][col].get(val)
-            return [rows[idx]] if idx is not None else []
-        
-        return [r for r in rows if r.get(col) == val]
+        if schema.layout != 'columnar':
+            return None
+        if table_name in self.columnar:
+            return self.columnar[table_name]
+
+        blob = storage.load_column_snapshot(self.active_db, table_name)
+        store = ColumnStore.from_bytes(blob, schema.columns) if blob is not None else None
+        if store is not None:
+            self._columnar_versions[table_name] = storage.table_version(self.active_db, table_name)
+        else:
+            # Missing or stale snapshot: rebuild from the rows
+            store = ColumnStore(schema.columns)
+            try:
+                for rid, row in storage.scan_table(self.active_db, table_name):
+                    store.add(rid, row)
+            except Unsupported:
+                store = None
+        self.columnar[table_name] = store
+        return store
+
+    def _drop_column_store(self, table_name):
+        self.columnar.pop(table_name, None)
+        self._columnar_versions.pop(table_name, None)
+
+    def _save_column_stores(self):
+        """Persists the column stores of loaded tables whose contents changed since their last snapshot."""
+        for table_name, store in list(self.columnar.items()):
+            if store is None:
+                continue
+            with self._locked(table_name):
+                version = storage.table_version(self.active_db, table_name)
+                if self._columnar_versions.get(table_name) != version:
+                    storage.save_column_snapshot(self.active_db, table_name, version, store.to_bytes())
+                    self._columnar_versions[table_name] = version
+
+    def _check_foreign_keys(self, schema, data, txn=None):
+        """
+        Verifies every FK value exists in its parent table, via the parent's
+        index when it has one. With txn the parent rows are the ones the
+        transaction sees, its uncommitted inserts included.
+        """
+        for local_col, reference in schema.foreign_keys.items():
+            parent_table, parent_col = reference.split('.')
+            fk_val = data.get(local_col)
+            if fk_val is None:
+                continue  # A NULL reference points at no parent
+            if txn is not None and txn.pending_rids(parent_table, parent_col, fk_val):
+                continue
+            pending = txn.pending(parent_table) if txn is not None else {}
+            parent_index = self._table_indices(parent_table).get(parent_col) if parent_table in self.schemas else None
+            if parent_index is not None:
+                found = any(rid not in pending for rid in parent_index.lookup(fk_val))
+            else:
+                found = any(pr.get(parent_col) == fk_val
+                            for rid, pr in storage.scan_table(self.active_db, parent_table) if rid not in pending)
+            if not found:
+                raise ValueError(f"FK Integrity Error: Value '{fk_val}' not found in {parent_table}.")
+
+    def _check_foreign_keys_many(self, schema, rows):
+        """
+        Batch form of _check_foreign_keys: each distinct FK value is probed
+        once, and an unindexed parent is scanned once per batch. Rows of a
+        self-referencing table may point at parents in the same batch.
+        """
+        for local_col, reference in schema.foreign_keys.items():
+            parent_table, parent_col = reference.split('.')
+            values = {row.get(local_col) for row in rows} - {None}
+            if parent_table == schema.name:
+                values -= {row.get(parent_col) for row in rows}
+            parent_index = self._table_indices(parent_table).get(parent_col) if parent_table in self.schemas else None
+            if parent_index is not None:
+                missing = [v for v in values if not parent_index.lookup(v)]
+            else:
+                present = {pr.get(parent_col) for _, pr in storage.scan_table(self.active_db, parent_table)}
+                missing = [v for v in values if v not in present]
+            if missing:
+                raise ValueError(f"FK Integrity Error: Value '{missing[0]}' not found in {parent_table}.")
 
-    def join(self, table_a_name, table_b_name, join_col_a, join_col_b):
+    def join(self, table_a_name, table_b_name, join_col_a, join_col_b, txn=None):
+        """
+        Equi-joins two tables, picking a strategy from the available indices:
+        sort-merge when both join columns have ordered indices of the same type,
+        index nested loop when the right column is indexed and the left side is
+        the smaller one, and a build/probe hash join otherwise. Both tables
+        stay latched while it runs, so it joins one consistent state. A table
+        a transaction has written to is hash joined with its pending rows.
+        """
+        with self._locked(table_a_name, table_b_name):
+            for table_name in (table_a_name, table_b_name):
+                metrics.TABLE_OPERATIONS.inc((self.active_db, table_name, 'join'))
+            return self._join(table_a_name, table_b_name, join_col_a, join_col_b, txn)
+
+    def _join_strategy(self, table_a_name, table_b_name, join_col_a, join_col_b, txn=None):
+        """Picks the join algorithm: (strategy, index on the left column, index on the right column)."""
         if not self.active_db:
             raise ValueError("No active database selected.")
-        rows_a = storage.load_table_data(self.active_db, table_a_name)
-        rows_b = storage.load_table_data(self.active_db, table_b_name)
-        
-        joined_results = []
-        for row_a in rows_a:
-            for row_b in rows_b:
-                if row_a.get(join_col_a) == row_b.get(join_col_b):
-                    combined = row_a.copy()
-                    for key, value in row_b.items():
-                        new_key = key if key not in combined else f"{table_b_name}_{key}"
-                        combined[new_key] = value
-                    joined_results.append(combined)        
-        return joined_results
+        if txn is not None and (txn.pending(table_a_name) or txn.pending(table_b_name)):
+            return 'hash join over pending rows', None, None
+        index_a = self._table_indices(table_a_name).get(join_col_a)
+        index_b = self._table_indices(table_b_name).get(join_col_b)
+        same_type = self.schemas[table_a_name].columns.get(join_col_a) == \
+            self.schemas[table_b_name].columns.get(join_col_b)
+        if index_a is not None and index_b is not None and index_a.ordered and index_b.ordered and same_type:
+            return 'sort-merge join', index_a, index_b
+        if index_b is not None and \
+                storage.count_rows(self.active_db, table_a_name) <= storage.count_rows(self.active_db, table_b_name):
+            return 'index nested loop join', index_a, index_b
+        return 'hash join', index_a, index_b
+
+    def _join(self, table_a_name, table_b_name, join_col_a, join_col_b, txn=None):
+        strategy, index_a, index_b = self._join_strategy(table_a_name, table_b_name, join_col_a, join_col_b, txn)
+        self._note(strategy=strategy)
+        if strategy == 'hash join over pending rows':
+            rows_a = [row for _, row in self._matching_rows(table_a_name, [], txn=txn)[0]]
+            rows_b = [row for _, row in self._matching_rows(table_b_name, [], txn=txn)[0]]
+            # (the scans above noted their own strategy)
+            self._note(strategy=strategy, left_rows=len(rows_a), right_rows=len(rows_b))
+            return hash_join(rows_a, rows_b, join_col_a, join_col_b, table_b_name)
+        db_name = self.active_db
+        fetch_a = lambda rid: storage.read_row(db_name, table_a_name, rid)
+        fetch_b = lambda rid: storage.read_row(db_name, table_b_name, rid)
+
+        if strategy == 'sort-merge join':
+            self._note(left_keys=len(index_a.keys), right_keys=len(index_b.keys))
+            return sort_merge_join(index_a, index_b, fetch_a, fetch_b, table_b_name)
+
+        rows_a = storage.load_table_data(db_name, table_a_name)
+        if strategy == 'index nested loop join':
+            hits = [0]  # One probe per left row; counted here, recorded once at the end
+            def probe(value, lookup=index_b.lookup):
+                rids = lookup(value)
+                if rids:
+                    hits[0] += 1
+                return rids
+            self._note(left_rows=len(rows_a), right_rows=storage.count_rows(db_name, table_b_name))
+            joined = index_nested_loop_join(rows_a, join_col_a, probe, fetch_b, table_b_name)
+            metrics.INDEX_LOOKUPS.inc(('hit',), hits[0])
+            metrics.INDEX_LOOKUPS.inc(('miss',), len(rows_a) - hits[0])
+            self._note(index_probes=len(rows_a), index_hits=hits[0])
+            return joined
+
+        rows_b = storage.load_table_data(db_name, table_b_name)
+        self._note(left_rows=len(rows_a), right_rows=len(rows_b))
+        return hash_join(rows_a, rows_b, join_col_a, join_col_b, table_b_name)
+
     def save_metadata(self, table_name=None):
             """Persists the current memory schemas to metadata.json on disk."""
             if not self.active_db:
                 return
                 
-            db_path = storage.ensure_db_dir(self.active_db)
-            metadata_file = os.path.join(db_path, 'metadata.json')
-            
             # 1. Load existing metadata
-            metadata = {}
-            if os.path.exists(metadata_file):
-                with open(metadata_file, 'r') as f:
-                    try:
-                        metadata = json.load(f)
-                    except json.JSONDecodeError:
-                        metadata = {}
+            metadata = storage.load_metadata(self.active_db)
 
             # 2. Update metadata with current memory state for the tables
             for name, schema in self.schemas.items():
                 metadata[name] = schema.to_dict()
 
-            # 3. Save back to disk
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=4) 
+            # 3. Save back to disk (atomic replace)
+            storage.save_metadata(self.active_db, metadata)
+
+            # 4. Cached plans were built against the old schema
+            self._schema_changed()
                   
+    # --- ONLINE SCHEMA CHANGES ---
+
+    @_ddl
+    def add_column(self, table_name, col_name, col_type="str", default=None):
+        """
+        Adds an attribute in O(1): only the schema changes. Stored rows read it
+        as 'default' (NULL if none) at once and are rewritten in the background.
+        """
+        if not self.active_db:
+            raise ValueError("No active database session.")
+        schema = self.schemas.get(table_name)
+        if not schema:
+            raise ValueError(f"Table '{table_name}' not found.")
+        if col_name in schema.columns:
+            raise ValueError(f"Column '{col_name}' already exists in {table_name}.")
+        if col_name in schema.dropped:
+            # Older rows still hold the dropped column's values: purge them first
+            self._migrate_rows(self.active_db, table_name, schema.version)
+        schema.columns[col_name] = col_type
+        schema.defaults[col_name] = None
+        try:
+            schema.defaults[col_name] = schema.converter(col_name)(default)
+        except TypeError:
+            del schema.columns[col_name], schema.defaults[col_name]
+            raise
+        schema.version += 1
+        self._drop_column_store(table_name)  # Rebuilt with the new column on next use
+        self._rows_changed(table_name)
+        return f"Attribute '{col_name}' added to {table_name}."
+
+    @_ddl
     def remove_column(self, table_name, col_name):
-        """Removes an attribute from schema and physically purges it from disk."""
+        """
+        Hides an attribute at once (metadata only); the background compactor
+        then rewrites the stored rows without it.
+        """
         if not self.active_db:
             raise ValueError("No active database session.")
-        
+
         schema = self.schemas.get(table_name)
         if not schema:
             raise ValueError(f"Entity '{table_name}' not found.")
-            
+        if col_name not in schema.columns:
+            raise ValueError(f"Column '{col_name}' not found in {table_name}.")
+
         # SAFETY GATE: Protecting the Primary Key
         if col_name == schema.primary_key:
             raise ValueError("Integrity Violation: Cannot drop the Primary Key.")
 
-        # 1. Update Memory Schema
-        if col_name in schema.columns:
-            del schema.columns[col_name]
-        
-        # 2. Persist Metadata change
+        # 1. Update Memory Schema (indices on the column go with it)
+        del schema.columns[col_name]
+        schema.defaults.pop(col_name, None)
+        schema.dropped.append(col_name)
+        schema.unique_keys = [c for c in schema.unique_keys if c != col_name]
+        schema.indexes = {n: s for n, s in schema.indexes.items() if s['column'] != col_name}
+        schema.version += 1
+        self._reconcile_indices(table_name)
+        self._drop_column_store(table_name)
+
+        # 2. Persist it; stored rows are purged by the compactor
+        self._rows_changed(table_name)
+        return f"Attribute '{col_name}' dropped from {table_name}; stored rows are purged in the background."
+
+    def _rows_changed(self, table_name):
+        """Saves a schema change that stored rows lag behind and starts compacting them."""
+        schema = self.schemas[table_name]
+        if not storage.count_rows(self.active_db, table_name):
+            schema.rows_version, schema.dropped = schema.version, []  # Nothing to rewrite
         self.save_metadata()
+        storage.set_row_layout(self.active_db, table_name, schema.columns)
+        self._start_migration(table_name)
 
-        # 3. Physical Data Purge (Data Surgery)
-        rows = storage.load_table_data(self.active_db, table_name)
-        for row in rows:
-            row.pop(col_name, None) # Remove key if it exists
-        
-        # 4. Write cleaned data back to disk
-        storage.save_table_data(self.active_db, table_name, rows)
-        return f"Attribute '{col_name}' successfully purged from {table_name}." 
\ No newline at end of file
+    def _start_migration(self, table_name):
+        """Makes reads upgrade a table's older rows and starts the background compactor for them."""
+        schema = self.schemas[table_name]
+        if not schema.needs_upgrade():
+            storage.set_row_upgrade(self.active_db, table_name, None)
+            return
+        storage.set_row_upgrade(self.active_db, table_name, schema.upgrade)
+        thread = threading.Thread(target=self._migrate_rows, args=(self.active_db, table_name, schema.version),
+                                  name=f"pesadb-compact-{table_name}", daemon=True)
+        self._migrations[table_name] = thread
+        thread.start()
+
+    def _migrate_rows(self, db_name, table_name, version):
+        """
+        Background compactor: rewrites the rows stored under an older schema
+        version, MIGRATE_BATCH_ROWS at a time, each batch one WAL commit under
+        the table latch. Queries never wait for it and writers of the table
+        wait for one batch at most. It stops if the database or the table's
+        schema changes (that change starts a new run) and marks the table
+        current once every row is.
+        """
+        def current():
+            schema = self.schemas.get(table_name)
+            if self.active_db != db_name or schema is None or schema.version != version:
+                return None
+            return schema
+
+        # 1. WAL records from before the change must never be replayed over rewritten rows
+        self.checkpoint()
+        with self._catalog.read_locked():
+            if current() is None:
+                return
+            rids = storage.table_rids(db_name, table_name)
+
+        # 2. Rewrite the rows that do not match the schema yet
+        for start in range(0, len(rids), MIGRATE_BATCH_ROWS):
+            with self._locked(table_name):
+                schema = current()
+                if schema is None:
+                    return
+                ops = []
+                for rid in rids[start:start + MIGRATE_BATCH_ROWS]:
+                    row = storage.read_row(db_name, table_name, rid, raw=True)
+                    if row is not None and not schema.is_current(row):
+                        ops.append([table_name, rid, schema.upgrade(row)])
+                if ops:
+                    self._commit(ops)
+            self._maybe_checkpoint()
+
+        # 3. Every row is current: reads stop upgrading
+        with self._catalog.write_locked():
+            schema = current()
+            if schema is None:
+                return
+            schema.rows_version, schema.dropped = version, []
+            storage.set_row_upgrade(db_name, table_name, None)
+            storage.save_schema(db_name, schema.to_dict())
@@ -1,17 +1,216 @@
+import bisect
+
+
 class Index:
+    """
+    Unique hash index (primary keys and unique columns). NULL is not a
+    value: it is never indexed, so any number of rows may hold it.
+    """
+    unique = True
+    ordered = False
+
     def __init__(self):
-        # Maps {value: row_index} e.g., {1: 0, 2: 1}
+        # Maps {value: row_id} e.g., {1: 0, 2: 1}
         self.map = {}
 
-    def add(self, value, row_index):
+    def add(self, value, row_id):
+        if value is None:
+            return True
         if value in self.map:
             return False # Duplicate found
-        self.map[value] = row_index
+        self.map[value] = row_id
         return True
 
     def get(self, value):
         return self.map.get(value)
 
+    def lookup(self, value):
+        """Returns the row ids stored under value as a list."""
+        row_id = self.map.get(value)
+        return [] if row_id is None else [row_id]
+
     def remove(self, value):
         if value in self.map:
-            del self.map[value]
\ No newline at end of file
+            del self.map[value]
+
+    def discard(self, value, row_id):
+        """Removes the entry for value only if it still points at row_id."""
+        if self.map.get(value) == row_id:
+            del self.map[value]
+
+    def to_entries(self):
+        """Serializable [[value, row_id], ...] form (JSON object keys would stringify values)."""
+        return [[value, row_id] for value, row_id in self.map.items()]
+
+    @classmethod
+    def from_entries(cls, entries):
+        index = cls()
+        index.map = {value: row_id for value, row_id in entries if value is not None}
+        return index
+
+
+class MultiIndex:
+    """Non-unique hash index: maps each value (NULL excepted) to a posting list of row ids."""
+    unique = False
+    ordered = False
+
+    def __init__(self):
+        # Maps {value: [row_id, ...]} e.g., {'nairobi': [0, 4, 9]}
+        self.map = {}
+
+    def add(self, value, row_id):
+        if value is None:
+            return True
+        postings = self.map.get(value)
+        if postings is None:
+            self.map[value] = [row_id]
+        else:
+            postings.append(row_id)
+        return True
+
+    def get(self, value):
+        return self.map.get(value, [])
+
+    def lookup(self, value):
+        return list(self.map.get(value, ()))
+
+    def remove(self, value):
+        self.map.pop(value, None)
+
+    def discard(self, value, row_id):
+        postings = self.map.get(value)
+        if postings and row_id in postings:
+            postings.remove(row_id)
+            if not postings:
+                del self.map[value]
+
+    def to_entries(self):
+        return [[value, row_ids] for value, row_ids in self.map.items()]
+
+    @classmethod
+    def from_entries(cls, entries):
+        index = cls()
+        index.map = {value: list(row_ids) for value, row_ids in entries if value is not None}
+        return index
+
+
+class OrderedIndex:
+    """
+    Sorted index for range predicates, min/max and ordered iteration.
+    Distinct keys are kept in a sorted list (binary search via bisect) and
+    each key maps to a posting list of row ids, so a range scan costs
+    O(log n + k). Set unique=True to enforce one row per key.
+
+    Rows whose value is NULL are kept apart in nulls: no range or lookup
+    matches them, but a full walk returns them after every key (before,
+    in reverse), where ORDER BY puts NULLs.
+    """
+    ordered = True
+
+    def __init__(self, unique=False):
+        self.unique = unique
+        self.keys = []  # Sorted distinct values
+        self.map = {}   # Maps {value: [row_id, ...]}
+        self.nulls = [] # Row ids whose value is NULL
+
+    def add(self, value, row_id):
+        if value is None:
+            self.nulls.append(row_id)
+            return True
+        postings = self.map.get(value)
+        if postings is None:
+            bisect.insort(self.keys, value)
+            self.map[value] = [row_id]
+            return True
+        if self.unique:
+            return False # Duplicate found
+        postings.append(row_id)
+        return True
+
+    def get(self, value):
+        """Unique: the row id or None. Non-unique: the posting list."""
+        postings = self.map.get(value)
+        if self.unique:
+            return postings[0] if postings else None
+        return postings or []
+
+    def lookup(self, value):
+        return list(self.map.get(value, ()))
+
+    def remove(self, value):
+        if self.map.pop(value, None) is not None:
+            del self.keys[bisect.bisect_left(self.keys, value)]
+
+    def discard(self, value, row_id):
+        if value is None:
+            if row_id in self.nulls:
+                self.nulls.remove(row_id)
+            return
+        postings = self.map.get(value)
+        if postings and row_id in postings:
+            postings.remove(row_id)
+            if not postings:
+                self.remove(value)
+
+    def walk(self, reverse=False):
+        """Yields every row id in key order, NULLs last (first when reverse)."""
+        if reverse:
+            yield from reversed(self.nulls)
+        yield from self.range(reverse=reverse)
+        if not reverse:
+            yield from self.nulls
+
+    def range(self, low=None, high=None, include_low=True, include_high=True, reverse=False):
+        """Yields row ids whose key lies between low and high (None = unbounded), in key order."""
+        if low is None:
+            start = 0
+        elif include_low:
+            start = bisect.bisect_left(self.keys, low)
+        else:
+            start = bisect.bisect_right(self.keys, low)
+        if high is None:
+            stop = len(self.keys)
+        elif include_high:
+            stop = bisect.bisect_right(self.keys, high)
+        else:
+            stop = bisect.bisect_left(self.keys, high)
+
+        positions = range(stop - 1, start - 1, -1) if reverse else range(start, stop)
+        for pos in positions:
+            yield from self.map[self.keys[pos]]
+
+    def min(self):
+        return self.keys[0] if self.keys else None
+
+    def max(self):
+        return self.keys[-1] if self.keys else None
+
+    def to_entries(self):
+        entries = [[value, self.map[value]] for value in self.keys]
+        return entries + [[None, self.nulls]] if self.nulls else entries
+
+    @classmethod
+    def from_entries(cls, entries, unique=False):
+        index = cls(unique)
+        for value, row_ids in entries:
+            if value is None:
+                index.nulls = list(row_ids)
+                continue
+            index.keys.append(value)
+            index.map[value] = list(row_ids)
+        index.keys.sort()
+        return index
+
+
+def new_index(unique=False, ordered=False):
+    """Creates an empty index of the right kind for an index spec."""
+    if ordered:
+        return OrderedIndex(unique)
+    return Index() if unique else MultiIndex()
+
+
+def load_index(entries, unique=False, ordered=False):
+    """Rebuilds an index of the right kind from its to_entries() form."""
+    if ordered:
+        return OrderedIndex.from_entries(entries, unique)
+    return (Index if unique else MultiIndex).from_entries(entries)
@@ -0,0 +1,93 @@
+"""
+Equi-join operators used by DatabaseEngine.join.
+
+Every operator returns the same merged rows as the original nested loop:
+the left row's columns, then the right row's columns, with right-side
+names that collide prefixed by '{right_table}_'.
+"""
+
+
+def merge_rows(row_a, row_b, table_b_name):
+    combined = row_a.copy()
+    for key, value in row_b.items():
+        new_key = key if key not in combined else f"{table_b_name}_{key}"
+        combined[new_key] = value
+    return combined
+
+
+def hash_join(rows_a, rows_b, col_a, col_b, table_b_name):
+    """
+    Build/probe hash join. The hash table is built on the smaller input and
+    probed with the other; output keeps left-major order either way.
+    """
+    rows_a = list(rows_a)
+    rows_b = list(rows_b)
+    results = []
+
+    if len(rows_b) <= len(rows_a):
+        # Build on the right, stream the left
+        table = {}
+        for row_b in rows_b:
+            table.setdefault(row_b.get(col_b), []).append(row_b)
+        for row_a in rows_a:
+            for row_b in table.get(row_a.get(col_a), ()):
+                results.append(merge_rows(row_a, row_b, table_b_name))
+        return results
+
+    # Build on the left (positions only), stream the right, then emit in left order
+    table = {}
+    for pos, row_a in enumerate(rows_a):
+        table.setdefault(row_a.get(col_a), []).append(pos)
+    buckets = {}
+    for row_b in rows_b:
+        for pos in table.get(row_b.get(col_b), ()):
+            buckets.setdefault(pos, []).append(row_b)
+    for pos in sorted(buckets):
+        row_a = rows_a[pos]
+        for row_b in buckets[pos]:
+            results.append(merge_rows(row_a, row_b, table_b_name))
+    return results
+
+
+def index_nested_loop_join(rows_a, col_a, probe_b, fetch_b, table_b_name):
+    """
+    Streams the left rows and probes the right table's index on the join
+    column. probe_b(value) returns right row ids; fetch_b(rid) loads a row.
+    Right rows are fetched once each, however many left rows hit them.
+    """
+    fetched = {}
+    results = []
+    for row_a in rows_a:
+        for rid in probe_b(row_a.get(col_a)):
+            row_b = fetched.get(rid)
+            if row_b is None:
+                row_b = fetched[rid] = fetch_b(rid)
+            if row_b is not None:
+                results.append(merge_rows(row_a, row_b, table_b_name))
+    return results
+
+
+def sort_merge_join(index_a, index_b, fetch_a, fetch_b, table_b_name):
+    """
+    Merges two ordered indices (core.indexer.OrderedIndex) on the join
+    columns: both key lists are already sorted, so matching keys are found
+    with one linear pass and no sort. Output is in join-key order.
+    """
+    keys_a, keys_b = index_a.keys, index_b.keys
+    results = []
+    i = j = 0
+    while i < len(keys_a) and j < len(keys_b):
+        key_a, key_b = keys_a[i], keys_b[j]
+        if key_a < key_b:
+            i += 1
+        elif key_b < key_a:
+            j += 1
+        else:
+            rows_b = [row for row in map(fetch_b, index_b.map[key_b]) if row is not None]
+            for rid_a in index_a.map[key_a]:
+                row_a = fetch_a(rid_a)
+                if row_a is not None:
+                    results.extend(merge_rows(row_a, row_b, table_b_name) for row_b in rows_b)
+            i += 1
+            j += 1
+    return results
@@ -0,0 +1,43 @@
+"""
+Row readers for bulk loading (COPY ... FROM and DatabaseEngine.copy_from).
+Files are read lazily, one row at a time, so a load never holds more than
+the engine's current insert batch in memory.
+"""
+import csv
+import json
+import os
+
+FORMATS = ('csv', 'ndjson')
+_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson'}
+
+
+def detect_format(path):
+    """Infers the file format from its extension."""
+    file_format = _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Cannot infer the format of '{path}'; use FORMAT CSV or FORMAT NDJSON.")
+    return file_format
+
+
+def read_rows(path, file_format=None):
+    """Yields the rows of a CSV file (first line is the header) or an NDJSON file as dicts."""
+    file_format = (file_format or detect_format(path)).lower()
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported format '{file_format}'.")
+    if not os.path.exists(path):
+        raise ValueError(f"File '{path}' not found.")
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Line {line_no} of '{path}' is not valid JSON.")
+            if not isinstance(row, dict):
+                raise ValueError(f"Line {line_no} of '{path}' is not a JSON object.")
+            yield row
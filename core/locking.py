@@ -0,0 +1,100 @@
+"""
+Locks that let one DatabaseEngine serve many threads (e.g. the FastAPI pool).
+
+The engine's catalog (schemas, index definitions, the open database) is
+guarded by an RWLock: queries and row writes hold it shared, DDL holds it
+exclusively. Row writes are serialized per table by re-entrant latches, and
+readers hold those only while they capture a snapshot (see
+storage.TableSnapshot), so a long scan never blocks writers.
+
+Time spent waiting for either is recorded in core.metrics; a lock taken
+without waiting reads no clock.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from core import metrics
+
+
+class RWLock:
+    """
+    Many readers or one writer. Writers are preferred: once one is waiting,
+    new readers queue behind it. Both sides are re-entrant per thread and the
+    writer may also take read locks, but a reader cannot upgrade to writing.
+    """
+
+    def __init__(self, name='rwlock'):
+        self._labels = (name,)      # LOCK_WAIT_SECONDS labels
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0           # Read holds across all threads
+        self._writer = None         # Thread ident of the write holder
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()  # Per-thread read depth
+
+    def _read_depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    def acquire_read(self):
+        depth = self._read_depth()
+        with self._cond:
+            if not depth and self._writer != threading.get_ident():
+                # A thread already holding the lock must not queue behind a
+                # waiting writer: that writer is waiting for it
+                if self._writer is not None or self._waiting_writers:
+                    start = time.perf_counter()
+                    while self._writer is not None or self._waiting_writers:
+                        self._cond.wait()
+                    metrics.LOCK_WAIT_SECONDS.observe(self._labels, time.perf_counter() - start)
+            self._readers += 1
+        self._local.depth = depth + 1
+
+    def release_read(self):
+        self._local.depth = self._read_depth() - 1
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if self._read_depth():
+                raise RuntimeError("Cannot upgrade a read lock to a write lock.")
+            self._waiting_writers += 1
+            try:
+                if self._writer is not None or self._readers:
+                    start = time.perf_counter()
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                    metrics.LOCK_WAIT_SECONDS.observe(self._labels, time.perf_counter() - start)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
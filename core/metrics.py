@@ -0,0 +1,226 @@
+"""
+Process-wide counters and latency histograms, exposed in the Prometheus
+text format (render) on the web API's /metrics and summed up by the
+REPL's \\stats.
+
+Recording sits on the engine's hot paths, so it is kept to a dict update:
+every thread records into its own shard, without a lock, and only a scrape
+(snapshot, render) walks the shards of all threads and adds them up.
+Nothing is aggregated while nobody scrapes. When a thread ends, its shard
+is folded into one total of finished threads, so worker threads that come
+and go do not pile up shards. Totals other modules keep
+anyway (storage reads, buffer pool hits) are not recorded twice: those
+modules register a collector that reports them at scrape time.
+"""
+import bisect
+import os
+import threading
+import time
+import weakref
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []    # Every metric, in declaration order (the order render prints them in)
+_collectors = []  # collect() -> [(metric, label values, value)], called on every scrape
+_shards = {}      # {id: (counters, histograms)} of every running thread that has recorded something
+_retired = {}     # What threads that have ended recorded, added up as snapshot() does
+_shards_lock = threading.Lock()
+
+
+class _ThreadToken:
+    """Held only by a thread's locals, so it is freed when the thread ends."""
+    __slots__ = ('__weakref__',)
+
+
+class _ThreadExit(threading.local):
+    def __init__(self):
+        self.token = _ThreadToken()
+
+_thread_exit = _ThreadExit()
+
+
+def on_thread_exit(callback, *args):
+    """Calls callback(*args) once the calling thread has ended."""
+    weakref.finalize(_thread_exit.token, callback, *args)
+
+
+class _Shard(threading.local):
+    """What the calling thread has recorded; registered for scrapes on the thread's first record."""
+
+    def __init__(self):
+        self.counters = {}    # {(metric, label values): total}
+        self.histograms = {}  # {(metric, label values): [count per bucket, ..., count above the last, sum]}
+        key = id(self.counters)
+        with _shards_lock:
+            _shards[key] = (self.counters, self.histograms)
+        on_thread_exit(_retire, key)
+
+
+def _retire(key):
+    """Folds the shard of a thread that has ended into _retired."""
+    with _shards_lock:
+        _add(_retired, *_shards.pop(key))
+
+
+def _add(totals, counters, histograms):
+    """Adds a shard's counters and histograms into totals, replacing (never changing) its values."""
+    # copy() is atomic, so the owning thread may keep recording meanwhile
+    for key, value in counters.copy().items():
+        totals[key] = totals.get(key, 0) + value
+    for key, counts in histograms.copy().items():
+        total = totals.get(key)
+        totals[key] = list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+
+_shard = _Shard()
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels  # Label names; samples carry their values in this order
+        _registry.append(self)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        counters = _shard.counters
+        key = (self, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value reported by a collector at scrape time."""
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def observe(self, labels, seconds):
+        histograms = _shard.histograms
+        key = (self, labels)
+        counts = histograms.get(key)
+        if counts is None:
+            counts = histograms[key] = [0] * (len(BUCKETS) + 2)
+        counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        counts[-1] += seconds
+
+
+TABLE_OPERATIONS = Counter('pesadb_table_operations_total', "Engine operations per table.",
+                           ('database', 'table', 'operation'))
+STATEMENT_SECONDS = Histogram('pesadb_statement_duration_seconds', "SQL statement latency.", ('statement',))
+STATEMENT_ERRORS = Counter('pesadb_statement_errors_total', "Prepared SQL statements whose execution raised.",
+                           ('statement',))
+WRITE_SECONDS = Histogram('pesadb_write_duration_seconds',
+                          "Row write latency, waiting for the table latches included.", ('operation',))
+ROWS_SCANNED = Counter('pesadb_rows_scanned_total',
+                       "Rows read to answer queries: segment records, buffer pool rows and column store positions.",
+                       ('source',))
+ROWS_RETURNED = Counter('pesadb_rows_returned_total', "Rows returned by SELECT statements, select and row pages.")
+INDEX_LOOKUPS = Counter('pesadb_index_lookups_total', "Index equality probes made to find rows.", ('result',))
+INDEX_SCANS = Counter('pesadb_index_scans_total', "Ordered index range scans and ORDER BY walks.", ('kind',))
+BYTES_READ = Counter('pesadb_bytes_read_total', "Segment bytes read (a compressed block counts once).")
+BYTES_WRITTEN = Counter('pesadb_bytes_written_total', "Bytes written to table segments and the WAL.", ('file',))
+FSYNC_SECONDS = Histogram('pesadb_fsync_duration_seconds', "fsync latency; the count is the number of fsyncs.",
+                          ('file',))
+PLAN_CACHE = Counter('pesadb_plan_cache_lookups_total', "Prepared statement cache lookups.", ('result',))
+BUFFER_POOL_LOOKUPS = Counter('pesadb_buffer_pool_lookups_total', "Buffer pool table lookups.", ('result',))
+BUFFER_POOL_HIT_RATIO = Gauge('pesadb_buffer_pool_hit_ratio', "Share of buffer pool lookups that hit.")
+BUFFER_POOL_EVICTIONS = Counter('pesadb_buffer_pool_evictions_total', "Tables evicted from the buffer pool.")
+BUFFER_POOL_BYTES = Gauge('pesadb_buffer_pool_bytes', "Buffer pool memory.", ('kind',))
+LOCK_WAIT_SECONDS = Histogram('pesadb_lock_wait_seconds',
+                              "Time spent waiting for a lock another thread held (uncontended takes are not observed).",
+                              ('lock',))
+
+
+def fsync(fd, file):
+    """os.fsync(fd), timed into FSYNC_SECONDS under file ('wal', 'segment' or 'metadata')."""
+    start = time.perf_counter()
+    os.fsync(fd)
+    FSYNC_SECONDS.observe((file,), time.perf_counter() - start)
+
+
+def register_collector(collect):
+    """Adds collect() -> [(metric, label values, value)] to every scrape."""
+    _collectors.append(collect)
+
+
+def snapshot():
+    """
+    Current totals of every thread as {metric: {label values: value}}. A
+    histogram's value is (cumulative counts per bucket of BUCKETS then +Inf, count, sum).
+    """
+    with _shards_lock:  # A shard is either running or retired, never counted twice
+        totals = dict(_retired)
+        for counters, histograms in _shards.values():
+            _add(totals, counters, histograms)
+    for collect in list(_collectors):
+        for metric, labels, value in collect():
+            totals[(metric, labels)] = value
+
+    samples = {}
+    for (metric, labels), value in totals.items():
+        if metric.kind == 'histogram':
+            cumulative, running = [], 0
+            for count in value[:-1]:
+                running += count
+                cumulative.append(running)
+            value = (cumulative, running, value[-1])
+        samples.setdefault(metric, {})[labels] = value
+    return samples
+
+
+def quantile(histogram, q):
+    """Estimates the q-quantile (0..1) of a snapshot histogram value, interpolating inside its bucket."""
+    cumulative, count, _ = histogram
+    if not count:
+        return None
+    rank = q * count
+    i = bisect.bisect_left(cumulative, rank)
+    if i >= len(BUCKETS):
+        return BUCKETS[-1]  # Beyond the last bound: the bound is all we know
+    low = BUCKETS[i - 1] if i else 0.0
+    below = cumulative[i - 1] if i else 0
+    in_bucket = cumulative[i] - below
+    return low + (BUCKETS[i] - low) * ((rank - below) / in_bucket if in_bucket else 1.0)
+
+
+def render():
+    """Every metric with samples, in the Prometheus text exposition format (version 0.0.4)."""
+    samples = snapshot()
+    lines = []
+    for metric in _registry:
+        series = samples.get(metric)
+        if not series:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.doc}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels in sorted(series, key=lambda values: tuple(map(str, values))):
+            value = series[labels]
+            pairs = list(zip(metric.labels, labels))
+            if metric.kind != 'histogram':
+                lines.append(f"{metric.name}{_labels(pairs)} {_number(value)}")
+                continue
+            cumulative, count, total = value
+            for bound, running in zip(BUCKETS + ('+Inf',), cumulative):
+                lines.append(f"{metric.name}_bucket{_labels(pairs + [('le', bound)])} {running}")
+            lines.append(f"{metric.name}_sum{_labels(pairs)} {_number(total)}")
+            lines.append(f"{metric.name}_count{_labels(pairs)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if type(value) is float else str(value)
@@ -0,0 +1,1004 @@
+"""
+Planning and execution of statements parsed by core/sql.py.
+
+SELECT statements become a tree of iterator operators (Scan, EquiJoin,
+HashJoin, Filter, HashAggregate, Sort, Limit, Project) that pull rows from
+DatabaseEngine; every other statement maps onto engine calls. EXPLAIN
+renders a SELECT's tree, and EXPLAIN ANALYZE runs it under a QueryProfile
+(core/profile.py) and adds what each operator did. prepare()
+compiles a statement once into a PreparedStatement whose '?' placeholders
+are bound on each execution; DatabaseEngine caches these by statement text.
+Every execution is timed into core.metrics under its statement kind.
+"""
+import heapq
+import itertools
+import operator
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from core import aggregate, metrics, sql
+from core.join import hash_join
+from core.profile import QueryProfile
+
+PARSE_CACHE_SIZE = 512
+
+_COMPARE = {
+    '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+_FLIPPED = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+_parse_cache = OrderedDict()
+_parse_lock = threading.Lock()
+
+
+def parse(text):
+    """Parses a statement, reusing the cached AST for text seen before."""
+    key = text.strip()
+    with _parse_lock:
+        stmt = _parse_cache.get(key)
+        if stmt is not None:
+            _parse_cache.move_to_end(key)
+            return stmt
+    stmt = sql.parse(key)
+    with _parse_lock:
+        _parse_cache[key] = stmt
+        if len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return stmt
+
+
+class Result:
+    """Outcome of one statement: a message plus rows (queries) or items (SHOW)."""
+
+    def __init__(self, message, rows=None, columns=None, items=None):
+        self.message = message
+        self.rows = rows
+        self.columns = columns
+        self.items = items
+
+
+def execute(engine, text, params=()):
+    """Runs one SQL statement through the engine's plan cache."""
+    return engine.prepare(text).execute(engine, params)
+
+
+class PreparedStatement:
+    """
+    A statement parsed and planned once. Each '?' placeholder gets the cast of
+    the column it is compared with or assigned to, resolved at prepare time,
+    so an execution only binds values and runs the plan.
+    """
+
+    def __init__(self, text, db_name, version, run, converters, kind='statement'):
+        self.text = text
+        self.db_name = db_name
+        self.version = version        # Engine schema version the plan was built against
+        self.run = run                # run(engine, bound_params) -> Result
+        self.converters = converters  # One cast per placeholder
+        self.labels = (kind,)         # core.metrics labels: the statement kind, e.g. 'select'
+
+    @property
+    def param_count(self):
+        return len(self.converters)
+
+    def execute(self, engine, params=()):
+        if self.version != engine.schema_version or self.db_name != engine.active_db:
+            # The schema (or database) changed since prepare: re-plan transparently
+            return engine.prepare(self.text).execute(engine, params)
+        if len(params) != len(self.converters):
+            raise ValueError(f"Expected {len(self.converters)} parameter(s), got {len(params)}.")
+        bound = tuple(convert(value) for convert, value in zip(self.converters, params))
+        start = time.perf_counter()
+        try:
+            result = self.run(engine, bound)
+        except Exception:
+            metrics.STATEMENT_ERRORS.inc(self.labels)
+            raise
+        metrics.STATEMENT_SECONDS.observe(self.labels, time.perf_counter() - start)
+        if self.labels == ('select',):
+            metrics.ROWS_RETURNED.inc(amount=len(result.rows))
+        return result
+
+
+def prepare(engine, text):
+    """Parses and plans a statement into a PreparedStatement (uncached; see DatabaseEngine.prepare)."""
+    stmt = parse(text)
+    params = {}  # {placeholder index: cast}
+    run = _COMPILERS[type(stmt)](engine, stmt, params)
+    converters = [params.get(i, _identity) for i in range(stmt.param_count)]
+    kind = re.sub(r'(?<=[a-z])(?=[A-Z])', '_', type(stmt).__name__).lower()  # CreateTable -> create_table
+    return PreparedStatement(text, engine.active_db, engine.schema_version, run, converters, kind)
+
+
+def _identity(value):
+    return value
+
+
+def _nullable(convert):
+    """Wraps a column cast so NULL parameters pass through (they simply never match)."""
+    return lambda value: None if value is None else convert(value)
+
+
+# --- OPERATORS ---
+
+class Operator:
+    """A node of a query plan; rows(engine, params) yields result rows as dicts."""
+
+    def __init__(self, *children):
+        self.children = children
+
+    def rows(self, engine, params=()):
+        raise NotImplementedError
+
+    def run(self, engine, params=()):
+        """rows(), counted and timed for this operator while the engine is profiling (EXPLAIN ANALYZE)."""
+        profile = engine.profile
+        if profile is None:
+            return self.rows(engine, params)
+        return profile.iterate(self, lambda: self.rows(engine, params))
+
+    def describe(self):
+        return type(self).__name__
+
+    def strategy(self, engine, params=()):
+        """How the engine will fetch this operator's rows (e.g. 'index probe on id'), if it decides."""
+        return None
+
+    def explain(self, engine=None, params=(), profile=None, depth=0):
+        """
+        Indented one-line-per-operator rendering of the plan tree. Given the
+        engine, lines name the strategy it will pick; given the QueryProfile
+        of a run, the strategy it picked and what each operator did.
+        """
+        line = "  " * depth + ("-> " if depth else "") + self.describe()
+        details = []
+        if profile is not None:
+            label = profile.stats(self).details.get('strategy')
+            summary, details = profile.report(self)
+        else:
+            label = self.strategy(engine, params) if engine is not None else None
+            summary = None
+        if label:
+            line += f" [{label}]"
+        if summary:
+            line += f"  {summary}"
+        lines = [line] + ["  " * depth + ("     " if depth else "  ") + detail for detail in details]
+        for child in self.children:
+            lines.extend(child.explain(engine, params, profile, depth + 1))
+        return lines
+
+
+class Scan(Operator):
+    """
+    Reads one table lazily through DatabaseEngine.iter_select, which picks the
+    index access path. Residual predicates and the projection are pushed into
+    the storage scan, so rejected rows and unused columns are never built.
+    """
+
+    def __init__(self, table, where=None, order_by=None, descending=False, limit=None,
+                 columns=None, predicate=None, predicate_text=None):
+        super().__init__()
+        self.table = table
+        self.where = where or {}  # {col: [(op, value or sql.Param), ...]}
+        self.order_by = order_by
+        self.descending = descending
+        self.limit = limit
+        self.columns = columns          # Projection (None = every column)
+        self.predicate = predicate      # Compiled predicate(row, params) or None
+        self.predicate_text = predicate_text
+
+    def rows(self, engine, params=()):
+        where = _bind_where(self.where, params)
+        if where is None:
+            return iter(())  # Comparing with NULL never matches
+        test = None
+        if self.predicate is not None:
+            predicate = self.predicate
+            test = lambda row: predicate(row, params)
+        return engine.iter_select(self.table, where, self.order_by, self.descending, self.limit,
+                                  columns=self.columns, predicate=test)
+
+    def strategy(self, engine, params=()):
+        where = _bind_where(self.where, params)
+        if where is None:
+            return 'no rows (compared with NULL)'
+        return engine.explain_access(self.table, where, self.order_by, self.descending)
+
+    def describe(self):
+        parts = [f"Scan {self.table}"]
+        if self.columns is not None:
+            parts.append(f"columns=[{', '.join(self.columns)}]")
+        if self.where:
+            parts.append(f"where={self.where}")
+        if self.predicate_text:
+            parts.append(f"filter={self.predicate_text}")
+        if self.order_by:
+            parts.append(f"order_by={self.order_by}{' DESC' if self.descending else ''}")
+        if self.limit is not None:
+            parts.append(f"limit={self.limit}")
+        return ' '.join(parts)
+
+
+def _bind_where(where, params):
+    """Substitutes bound parameters into a pushed-down where; None if one is NULL."""
+    if not any(isinstance(v, sql.Param) for conds in where.values() for _, v in conds):
+        return where
+    bound = {}
+    for col, conds in where.items():
+        bound[col] = [(op, params[v.index] if isinstance(v, sql.Param) else v) for op, v in conds]
+        if any(v is None for _, v in bound[col]):
+            return None
+    return bound
+
+
+class EquiJoin(Operator):
+    """Joins two base tables through DatabaseEngine.join (index-aware strategy choice)."""
+
+    def __init__(self, left_table, right_table, left_col, right_col):
+        super().__init__()
+        self.left_table, self.right_table = left_table, right_table
+        self.left_col, self.right_col = left_col, right_col
+
+    def rows(self, engine, params=()):
+        return iter(engine.join(self.left_table, self.right_table, self.left_col, self.right_col))
+
+    def strategy(self, engine, params=()):
+        return engine.explain_join(self.left_table, self.right_table, self.left_col, self.right_col)
+
+    def describe(self):
+        return f"Join {self.left_table}.{self.left_col} = {self.right_table}.{self.right_col}"
+
+
+class HashJoin(Operator):
+    """Joins the rows of a sub-plan with a further base table (chained JOINs)."""
+
+    def __init__(self, child, right_table, left_key, right_col):
+        super().__init__(child)
+        self.right_table, self.left_key, self.right_col = right_table, left_key, right_col
+
+    def rows(self, engine, params=()):
+        right_rows = list(engine.iter_select(self.right_table))  # (select would count them as rows returned)
+        left_rows = list(self.children[0].run(engine, params))
+        if engine.profile is not None:
+            engine.profile.note(strategy='hash join', left_rows=len(left_rows), right_rows=len(right_rows))
+        return iter(hash_join(left_rows, right_rows, self.left_key, self.right_col, self.right_table))
+
+    def strategy(self, engine, params=()):
+        return 'hash join'
+
+    def describe(self):
+        return f"HashJoin {self.left_key} = {self.right_table}.{self.right_col}"
+
+
+class Filter(Operator):
+    def __init__(self, child, predicate, text):
+        super().__init__(child)
+        self.predicate = predicate
+        self.text = text
+
+    def rows(self, engine, params=()):
+        predicate = self.predicate
+        return (row for row in self.children[0].run(engine, params) if predicate(row, params))
+
+    def describe(self):
+        return f"Filter {self.text}"
+
+
+class HashAggregate(Operator):
+    """Groups rows by key columns in a hash table and folds each aggregate per group."""
+
+    def __init__(self, child, group_keys, aggregates):
+        super().__init__(child)
+        self.group_keys = group_keys    # [row key, ...]
+        self.aggregates = aggregates    # [(label, func_name, row key or None), ...]
+
+    def rows(self, engine, params=()):
+        return aggregate.hash_aggregate(self.children[0].run(engine, params), self.group_keys, self.aggregates)
+
+    def describe(self):
+        aggs = ', '.join(label for label, _, _ in self.aggregates)
+        return f"HashAggregate by [{', '.join(self.group_keys)}] computing [{aggs}]"
+
+
+class TableAggregate(Operator):
+    """
+    Aggregates one table through DatabaseEngine.aggregate, with the WHERE
+    pushed down: columnar tables reduce their column arrays directly and
+    row tables fold only the columns involved.
+    """
+
+    def __init__(self, table, where, group_keys, aggregates):
+        super().__init__()
+        self.table = table
+        self.where = where or {}        # {col: [(op, value or sql.Param), ...]}
+        self.group_keys = group_keys
+        self.aggregates = aggregates    # [(label, func_name, column or None), ...]
+
+    def rows(self, engine, params=()):
+        where = _bind_where(self.where, params)
+        if where is None:
+            # Comparing with NULL never matches: aggregate an empty input
+            return aggregate.result_rows({}, self.group_keys, self.aggregates)
+        return engine.aggregate(self.table, self.aggregates, self.group_keys, where)
+
+    def strategy(self, engine, params=()):
+        where = _bind_where(self.where, params)
+        if where is None:
+            return 'no rows (compared with NULL)'
+        return engine.explain_access(self.table, where, aggregating=True)
+
+    def describe(self):
+        aggs = ', '.join(label for label, _, _ in self.aggregates)
+        parts = [f"TableAggregate {self.table} by [{', '.join(self.group_keys)}] computing [{aggs}]"]
+        if self.where:
+            parts.append(f"where={self.where}")
+        return ' '.join(parts)
+
+
+class Sort(Operator):
+    def __init__(self, child, keys, limit=None):
+        super().__init__(child)
+        self.keys = keys    # [(row key, descending), ...]
+        self.limit = limit  # Top-k bound, lets a single-key sort use a heap
+
+    def rows(self, engine, params=()):
+        rows = self.children[0].run(engine, params)
+        if len(self.keys) == 1 and self.limit is not None:
+            key, descending = self.keys[0]
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            return iter(pick(self.limit, rows, key=lambda r: _sort_value(r.get(key))))
+        rows = list(rows)
+        for key, descending in reversed(self.keys):  # Stable multi-key sort
+            rows.sort(key=lambda r: _sort_value(r.get(key)), reverse=descending)
+        return iter(rows)
+
+    def describe(self):
+        keys = ', '.join(f"{k}{' DESC' if d else ''}" for k, d in self.keys)
+        return f"Sort [{keys}]" + (f" top {self.limit}" if self.limit is not None else "")
+
+
+def _sort_value(value):
+    # NULLs sort last and never get compared with real values
+    return (value is None, value if value is not None else 0)
+
+
+class Limit(Operator):
+    def __init__(self, child, limit, offset=0):
+        super().__init__(child)
+        self.limit = limit
+        self.offset = offset or 0
+
+    def rows(self, engine, params=()):
+        stop = None if self.limit is None else self.offset + self.limit
+        return itertools.islice(self.children[0].run(engine, params), self.offset, stop)
+
+    def describe(self):
+        return f"Limit {self.limit}" + (f" offset {self.offset}" if self.offset else "")
+
+
+class Project(Operator):
+    def __init__(self, child, items):
+        super().__init__(child)
+        self.items = items  # [(output name, row key), ...]
+
+    def rows(self, engine, params=()):
+        items = self.items
+        return ({name: row.get(key) for name, key in items} for row in self.children[0].run(engine, params))
+
+    def describe(self):
+        return f"Project [{', '.join(name for name, _ in self.items)}]"
+
+
+# --- NAME RESOLUTION ---
+
+class Scope:
+    """
+    Maps column references of a FROM/JOIN clause to keys of the rows the
+    plan produces. Joined rows keep left names and prefix colliding right
+    names with '{table}_', exactly as core.join.merge_rows does. Also
+    records the cast of every '?' placeholder met while planning.
+    """
+
+    def __init__(self, engine, tables, params=None):
+        self.engine = engine
+        self.aliases = {}   # alias or table name -> table name
+        self.keys = {}      # (table, column) -> row key
+        self.types = {}     # row key -> declared type
+        self.casts = {}     # row key -> TableSchema.converter
+        self.order = []     # Tables in FROM/JOIN order
+        self.params = params if params is not None else {}
+        used = set()
+        for table, alias in tables:
+            schema = engine.schemas.get(table)
+            if schema is None:
+                raise ValueError(f"Table '{table}' not found.")
+            self.aliases[table] = table
+            if alias:
+                self.aliases[alias] = table
+            self.order.append(table)
+            for col, col_type in schema.columns.items():
+                key = col if col not in used else f"{table}_{col}"
+                used.add(key)
+                self.keys[(table, col)] = key
+                self.types[key] = col_type
+                self.casts[key] = schema.converter(col)
+
+    def resolve(self, column):
+        if column.table is not None:
+            table = self.aliases.get(column.table)
+            if table is None:
+                raise ValueError(f"Unknown table or alias '{column.table}'.")
+            key = self.keys.get((table, column.name))
+            if key is None:
+                raise ValueError(f"Column '{column.name}' not found in {table}.")
+            return key
+        for table in self.order:
+            key = self.keys.get((table, column.name))
+            if key is not None:
+                return key
+        if column.name in self.types:  # Already-prefixed join output name
+            return column.name
+        raise ValueError(f"Unknown column '{column.name}'.")
+
+    def table_of(self, column):
+        """Returns the base table a column reference belongs to."""
+        key = self.resolve(column)
+        return next(t for (t, _), k in self.keys.items() if k == key)
+
+    def all_keys(self):
+        return list(self.keys.values())
+
+    def bind_param(self, param, column=None):
+        """Types a placeholder by the column it is compared with (untyped if none)."""
+        cast = self.casts[self.resolve(column)] if column is not None else _identity
+        self.params[param.index] = _nullable(cast)
+
+
+def compile_expr(expr, scope):
+    """
+    Compiles a WHERE expression into a predicate(row, params) over row dicts.
+    Comparisons involving NULL or incomparable types are false.
+    """
+    if isinstance(expr, sql.Column):
+        key = scope.resolve(expr)
+        return lambda row, params: row.get(key)
+    if isinstance(expr, sql.Literal):
+        value = expr.value
+        return lambda row, params: value
+    if isinstance(expr, sql.Param):
+        if expr.index not in scope.params:
+            scope.bind_param(expr)
+        index = expr.index
+        return lambda row, params: params[index]
+    if isinstance(expr, sql.Compare):
+        left, right = _coerce_pair(expr.left, expr.right, scope)
+        cmp = _COMPARE[expr.op]
+        def compare(row, params):
+            a, b = left(row, params), right(row, params)
+            if a is None or b is None:
+                return False
+            try:
+                return cmp(a, b)
+            except TypeError:
+                return False
+        return compare
+    if isinstance(expr, sql.BoolOp):
+        parts = [compile_expr(item, scope) for item in expr.items]
+        if expr.op == 'AND':
+            return lambda row, params: all(p(row, params) for p in parts)
+        return lambda row, params: any(p(row, params) for p in parts)
+    if isinstance(expr, sql.Not):
+        inner = compile_expr(expr.expr, scope)
+        return lambda row, params: not inner(row, params)
+    if isinstance(expr, sql.InList):
+        value = compile_expr(expr.expr, scope)
+        column = expr.expr if isinstance(expr.expr, sql.Column) else None
+        col_type = scope.types.get(scope.resolve(column)) if column is not None else None
+        negate = expr.negate
+        slots = [v for v in expr.values if isinstance(v, sql.Param)]
+        for param in slots:
+            scope.bind_param(param, column)
+        constants = {_coerce_literal(v, col_type) for v in expr.values if not isinstance(v, sql.Param)}
+        if not slots:
+            return lambda row, params: (value(row, params) in constants) != negate
+        def member(row, params):
+            v = value(row, params)
+            return (v in constants or any(v == params[p.index] for p in slots)) != negate
+        return member
+    if isinstance(expr, sql.IsNull):
+        value = compile_expr(expr.expr, scope)
+        negate = expr.negate
+        return lambda row, params: (value(row, params) is None) != negate
+    if isinstance(expr, sql.Func):
+        raise ValueError("Aggregate functions are not allowed in WHERE.")
+    raise ValueError(f"Unsupported expression: {expr!r}")
+
+
+def _coerce_literal(value, col_type):
+    """Casts a literal to a column's declared type when that is lossless."""
+    try:
+        if col_type == 'int' and not isinstance(value, float):
+            return int(value)
+        if col_type == 'float':
+            return float(value)
+        if col_type == 'str' and value is not None:
+            return str(value)
+    except (ValueError, TypeError):
+        pass
+    return value
+
+
+def _coerce_pair(left, right, scope):
+    """Compiles both sides of a comparison, typing a literal or '?' by the other side's column."""
+    def side(expr, other):
+        if isinstance(other, sql.Column):
+            if isinstance(expr, sql.Literal):
+                value = _coerce_literal(expr.value, scope.types.get(scope.resolve(other)))
+                return lambda row, params: value
+            if isinstance(expr, sql.Param):
+                scope.bind_param(expr, other)
+        return compile_expr(expr, scope)
+    return side(left, right), side(right, left)
+
+
+def _conjuncts(expr):
+    if isinstance(expr, sql.BoolOp) and expr.op == 'AND':
+        return [c for item in expr.items for c in _conjuncts(item)]
+    return [expr]
+
+
+def _split_where(expr, scope):
+    """
+    Splits a single-table WHERE into conditions DatabaseEngine.select can use
+    ({col: [(op, value or sql.Param), ...]}) and a residual expression for a Filter.
+    """
+    where, residual = {}, []
+    for conj in (_conjuncts(expr) if expr is not None else []):
+        if isinstance(conj, sql.Compare):
+            col, lit, op = conj.left, conj.right, conj.op
+            if isinstance(col, (sql.Literal, sql.Param)) and isinstance(lit, sql.Column):
+                col, lit, op = lit, col, _FLIPPED[op]
+            if isinstance(col, sql.Column) and isinstance(lit, sql.Param):
+                scope.bind_param(lit, col)
+                where.setdefault(scope.resolve(col), []).append((op, lit))
+                continue
+            if isinstance(col, sql.Column) and isinstance(lit, sql.Literal) and lit.value is not None:
+                key = scope.resolve(col)
+                value = _coerce_literal(lit.value, scope.types[key])
+                if not isinstance(value, float) or scope.types[key] == 'float':
+                    where.setdefault(key, []).append((op, value))
+                    continue
+        residual.append(conj)
+    if not residual:
+        return where, None
+    return where, residual[0] if len(residual) == 1 else sql.BoolOp(op='AND', items=residual)
+
+
+def _render(expr):
+    """Compact SQL-ish text of an expression, for plan descriptions."""
+    if isinstance(expr, sql.Column):
+        return f"{expr.table}.{expr.name}" if expr.table else expr.name
+    if isinstance(expr, sql.Literal):
+        return 'NULL' if expr.value is None else repr(expr.value)
+    if isinstance(expr, sql.Param):
+        return '?'
+    if isinstance(expr, sql.Compare):
+        return f"{_render(expr.left)} {expr.op} {_render(expr.right)}"
+    if isinstance(expr, sql.BoolOp):
+        return '(' + f" {expr.op} ".join(_render(i) for i in expr.items) + ')'
+    if isinstance(expr, sql.Not):
+        return f"NOT {_render(expr.expr)}"
+    if isinstance(expr, sql.InList):
+        return f"{_render(expr.expr)} {'NOT ' if expr.negate else ''}IN {tuple(expr.values)}"
+    if isinstance(expr, sql.IsNull):
+        return f"{_render(expr.expr)} IS {'NOT ' if expr.negate else ''}NULL"
+    if isinstance(expr, sql.Func):
+        return _agg_label(expr)
+    return repr(expr)
+
+
+def _agg_label(func):
+    return f"{func.name}({func.arg.name if func.arg is not None else '*'})"
+
+
+# --- SELECT PLANNING ---
+
+def plan_select(engine, stmt, params=None):
+    """
+    Builds the operator tree for a SELECT. Returns (root operator, output columns).
+    Casts for '?' placeholders are recorded into params ({index: cast}).
+    """
+    scope = Scope(engine, [(stmt.table, stmt.alias)] + [(j.table, j.alias) for j in stmt.joins], params)
+    for item in stmt.items:
+        if not isinstance(item.expr, (sql.Column, sql.Func)):
+            raise ValueError(f"SELECT supports column references and aggregates only, not {_render(item.expr)}.")
+    aggregating = bool(stmt.group_by) or any(isinstance(i.expr, sql.Func) for i in stmt.items)
+
+    # 1. Source: one table (WHERE and projection pushed into the scan) or joins
+    if not stmt.joins:
+        where, residual = _split_where(stmt.where, scope)
+        node = Scan(stmt.table, where, columns=_needed_columns(stmt, scope))
+        if residual is not None:
+            node.predicate, node.predicate_text = compile_expr(residual, scope), _render(residual)
+    else:
+        node = _plan_joins(stmt, scope)
+        if stmt.where is not None:
+            node = Filter(node, compile_expr(stmt.where, scope), _render(stmt.where))
+
+    # 2. Aggregation
+    if aggregating:
+        return _plan_aggregate(stmt, scope, node)
+
+    # 3. ORDER BY / LIMIT: pushed into the scan (which walks an ordered index if it can)
+    aliases = {i.alias: i.expr for i in stmt.items if i.alias}
+    sort_keys = []
+    for item in stmt.order_by:
+        expr = item.expr
+        if isinstance(expr, sql.Column) and expr.table is None and expr.name in aliases:
+            expr = aliases[expr.name]
+        if not isinstance(expr, sql.Column):
+            raise ValueError("ORDER BY supports column references only.")
+        sort_keys.append((scope.resolve(expr), item.descending))
+
+    bound = None if stmt.limit is None else stmt.limit + (stmt.offset or 0)
+    if isinstance(node, Scan) and len(sort_keys) <= 1:
+        if sort_keys:
+            node.order_by, node.descending = sort_keys[0]
+        node.limit = bound
+    elif sort_keys:
+        node = Sort(node, sort_keys, bound)
+    if stmt.limit is not None or stmt.offset:
+        node = Limit(node, stmt.limit, stmt.offset)
+
+    # 4. Projection
+    if not stmt.items:
+        return node, scope.all_keys()
+    items = []
+    for item in stmt.items:
+        key = scope.resolve(item.expr)
+        name = item.alias or item.expr.name
+        if any(name == n for n, _ in items):
+            name = key  # e.g. o.id, c.id -> id, customers_id
+        items.append((name, key))
+    return Project(node, items), [name for name, _ in items]
+
+
+def _column_refs(expr):
+    """Yields every Column referenced by an expression."""
+    if isinstance(expr, sql.Column):
+        yield expr
+    elif isinstance(expr, (sql.Compare,)):
+        yield from _column_refs(expr.left)
+        yield from _column_refs(expr.right)
+    elif isinstance(expr, sql.BoolOp):
+        for item in expr.items:
+            yield from _column_refs(item)
+    elif isinstance(expr, (sql.Not, sql.InList, sql.IsNull)):
+        yield from _column_refs(expr.expr)
+    elif isinstance(expr, sql.Func) and expr.arg is not None:
+        yield from _column_refs(expr.arg)
+
+
+def _needed_columns(stmt, scope):
+    """Columns a single-table SELECT reads after filtering (None for SELECT *)."""
+    if not stmt.items:
+        return None
+    aliases = {i.alias for i in stmt.items if i.alias}
+    exprs = [i.expr for i in stmt.items] + list(stmt.group_by)
+    exprs += [o.expr for o in stmt.order_by
+              if not (isinstance(o.expr, sql.Column) and o.expr.table is None and o.expr.name in aliases)]
+    needed = []
+    for expr in exprs:
+        for column in _column_refs(expr):
+            key = scope.resolve(column)
+            if key not in needed:
+                needed.append(key)
+    return needed
+
+
+def _plan_joins(stmt, scope):
+    """Left-deep join tree: the first join goes through the engine, later ones hash-join."""
+    node = None
+    joined = {stmt.table}
+    for join in stmt.joins:
+        left, right = join.left, join.right
+        if scope.table_of(left) == join.table:
+            left, right = right, left
+        if scope.table_of(right) != join.table or scope.table_of(left) not in joined:
+            raise ValueError(f"JOIN condition must relate {join.table} to a previous table.")
+        if node is None:
+            node = EquiJoin(stmt.table, join.table, left.name, right.name)
+        else:
+            node = HashJoin(node, join.table, scope.resolve(left), right.name)
+        joined.add(join.table)
+    return node
+
+
+def _plan_aggregate(stmt, scope, node):
+    group_keys = [scope.resolve(c) for c in stmt.group_by]
+    aggregates = []
+
+    def agg_key(func):
+        label = _agg_label(func)
+        if not any(label == l for l, _, _ in aggregates):
+            arg_key = scope.resolve(func.arg) if func.arg is not None else None
+            aggregates.append((label, func.name, arg_key))
+        return label
+
+    items = []
+    for item in stmt.items:
+        if isinstance(item.expr, sql.Func):
+            key = agg_key(item.expr)
+        else:
+            key = scope.resolve(item.expr)
+            if key not in group_keys:
+                raise ValueError(f"Column '{item.expr.name}' must appear in GROUP BY or inside an aggregate.")
+        items.append((item.alias or (key if isinstance(item.expr, sql.Func) else item.expr.name), key))
+
+    sort_keys = []
+    names = {name: key for name, key in items}
+    for item in stmt.order_by:
+        expr = item.expr
+        if isinstance(expr, sql.Func):
+            key = agg_key(expr)
+        elif not isinstance(expr, sql.Column):
+            raise ValueError("ORDER BY supports column references and aggregates only.")
+        elif expr.table is None and expr.name in names:
+            key = names[expr.name]
+        else:
+            key = scope.resolve(expr)
+            if key not in group_keys:
+                raise ValueError(f"ORDER BY column '{expr.name}' is not grouped.")
+        sort_keys.append((key, item.descending))
+
+    if isinstance(node, Scan) and node.predicate is None:
+        # Every condition was pushed down: let the engine aggregate the table
+        node = TableAggregate(node.table, node.where, group_keys, aggregates)
+    else:
+        node = HashAggregate(node, group_keys, aggregates)
+    bound = None if stmt.limit is None else stmt.limit + (stmt.offset or 0)
+    if sort_keys:
+        node = Sort(node, sort_keys, bound)
+    if stmt.limit is not None or stmt.offset:
+        node = Limit(node, stmt.limit, stmt.offset)
+    if not items:
+        items = [(k, k) for k in group_keys]
+    return Project(node, items), [name for name, _ in items]
+
+
+# --- STATEMENT COMPILERS ---
+# Each compiler checks and plans a statement once, records placeholder casts
+# into params and returns run(engine, bound_params) -> Result.
+
+def _require_db(engine):
+    if not engine.active_db:
+        raise ValueError("No active database. Use 'USE <db>'.")
+
+
+def _schema(engine, table):
+    schema = engine.schemas.get(table)
+    if schema is None:
+        raise ValueError(f"Table '{table}' not found.")
+    return schema
+
+
+def _bind(value, params):
+    return params[value.index] if isinstance(value, sql.Param) else value
+
+
+def _compile_select(engine, stmt, params):
+    _require_db(engine)
+    plan, columns = plan_select(engine, stmt, params)
+    def run(engine, bound):
+        rows = list(plan.rows(engine, bound))
+        return Result(f"Fetched {len(rows)} records.", rows=rows, columns=columns)
+    return run
+
+
+def _compile_explain(engine, stmt, params):
+    _require_db(engine)
+    plan, _ = plan_select(engine, stmt.query, params)
+    def run(engine, bound):
+        if not stmt.analyze:
+            lines = plan.explain(engine, bound)
+            return Result("Query plan", rows=[{"QUERY PLAN": line} for line in lines], columns=["QUERY PLAN"])
+        profile = QueryProfile()
+        start = time.perf_counter()
+        with engine.profiling(profile):
+            count = sum(1 for _ in plan.run(engine, bound))
+        elapsed = time.perf_counter() - start
+        lines = plan.explain(profile=profile) + [f"Execution time: {elapsed * 1000:.3f} ms"]
+        return Result(f"Query plan (executed, {count} row(s))",
+                      rows=[{"QUERY PLAN": line} for line in lines], columns=["QUERY PLAN"])
+    return run
+
+
+def _matching_where(engine, table, where, params):
+    """
+    The rows of one table satisfying a WHERE (used by UPDATE and DELETE), as
+    engine conditions plus a compiled predicate(row, params) for the residual.
+    """
+    scope = Scope(engine, [(table, None)], params)
+    where, residual = _split_where(where, scope)
+    return where, compile_expr(residual, scope) if residual is not None else None
+
+
+def _bind_predicate(predicate, params):
+    """The row -> bool test the engine takes for a compiled predicate(row, params)."""
+    if predicate is None:
+        return None
+    return lambda row: predicate(row, params)
+
+
+def _compile_insert(engine, stmt, params):
+    _require_db(engine)
+    table = stmt.table
+    if stmt.row is not None:
+        # validate() coerces in place, so each run gets its own copy of the literal
+        return lambda engine, bound: Result(engine.insert(table, dict(stmt.row)))
+
+    schema = _schema(engine, table)
+    columns = stmt.columns or list(schema.columns)
+    templates = []
+    for values in stmt.values:
+        if len(values) != len(columns):
+            raise ValueError(f"Expected {len(columns)} values, got {len(values)}.")
+        template = []
+        for col, value in zip(columns, values):
+            cast = schema.converter(col)
+            if isinstance(value, sql.Param):
+                params[value.index] = cast
+            else:
+                value = cast(value)
+            template.append(value)
+        templates.append(template)
+    # Every value is cast at prepare/bind time, so a complete row skips validate()
+    typed = set(schema.columns) <= set(columns)
+
+    def run(engine, bound):
+        for template in templates:
+            row = {col: _bind(value, bound) for col, value in zip(columns, template)}
+            engine.insert(table, row, validate=not typed)
+        count = len(templates)
+        return Result("Row inserted." if count == 1 else f"{count} rows inserted.")
+    return run
+
+
+def _compile_update(engine, stmt, params):
+    _require_db(engine)
+    table = stmt.table
+    schema = _schema(engine, table)
+    for col, value in stmt.assignments.items():
+        if isinstance(value, sql.Param):
+            params[value.index] = schema.converter(col)
+    where, predicate = _matching_where(engine, table, stmt.where, params)
+
+    # The engine checks every new row before writing any, and writes them in one commit
+    def run(engine, bound):
+        criteria = _bind_where(where, bound)
+        if criteria is None:
+            return Result("Updated 0 row(s).")
+        fields = {col: _bind(value, bound) for col, value in stmt.assignments.items()}
+        return Result(engine.update_where(table, criteria, fields, _bind_predicate(predicate, bound)))
+    return run
+
+
+def _compile_delete(engine, stmt, params):
+    _require_db(engine)
+    table = stmt.table
+    # Simple comparisons go to the engine's index-aware delete, the rest is tested per row
+    where, predicate = _matching_where(engine, table, stmt.where, params)
+
+    def run(engine, bound):
+        criteria = _bind_where(where, bound)
+        if criteria is None:
+            return Result("Deleted 0 row(s).")
+        return Result(engine.delete(table, criteria, _bind_predicate(predicate, bound)))
+    return run
+
+
+def _statement(executor):
+    """Compiler for statements without placeholders: run the executor each time."""
+    return lambda engine, stmt, params: (lambda engine, bound: executor(engine, stmt))
+
+
+def _exec_copy(engine, stmt):
+    _require_db(engine)
+    _schema(engine, stmt.table)
+    return Result(engine.copy_from(stmt.table, stmt.path, stmt.file_format))
+
+
+def _exec_create_table(engine, stmt):
+    _require_db(engine)
+    return Result(engine.create_table(stmt.table, stmt.columns, stmt.primary_key,
+                                      stmt.unique_keys, stmt.foreign_keys))
+
+
+def _exec_drop_table(engine, stmt):
+    _require_db(engine)
+    return Result(engine.drop_table(stmt.table))
+
+
+def _exec_create_index(engine, stmt):
+    _require_db(engine)
+    return Result(engine.create_index(stmt.table, stmt.column, stmt.name,
+                                      unique=stmt.unique, ordered=stmt.ordered))
+
+
+def _exec_drop_index(engine, stmt):
+    _require_db(engine)
+    return Result(engine.drop_index(stmt.name))
+
+
+def _exec_add_column(engine, stmt):
+    _require_db(engine)
+    return Result(engine.add_column(stmt.table, stmt.column, stmt.col_type, stmt.default))
+
+
+def _exec_drop_column(engine, stmt):
+    _require_db(engine)
+    return Result(engine.remove_column(stmt.table, stmt.column))
+
+
+def _exec_set_layout(engine, stmt):
+    _require_db(engine)
+    return Result(engine.set_layout(stmt.table, stmt.layout))
+
+
+def _exec_create_database(engine, stmt):
+    engine.set_active_db(stmt.name)
+    return Result(f"Database '{stmt.name}' initialized.")
+
+
+def _exec_drop_database(engine, stmt):
+    return Result(engine.delete_database(stmt.name))
+
+
+def _exec_use(engine, stmt):
+    if stmt.name not in engine.list_databases():
+        raise ValueError(f"Database '{stmt.name}' not found.")
+    engine.set_active_db(stmt.name)
+    return Result(f"Context switched to: {stmt.name}")
+
+
+def _exec_show_databases(engine, stmt):
+    return Result("Available Databases", items=engine.list_databases())
+
+
+def _exec_transaction_control(engine, stmt):
+    raise ValueError("Transactions need a session: use BEGIN in the REPL, /shell or core.catalog.Session "
+                     "(or DatabaseEngine.begin() from Python).")
+
+
+def _exec_show_tables(engine, stmt):
+    _require_db(engine)
+    return Result(f"Tables in '{engine.active_db}'", items=list(engine.schemas.keys()))
+
+
+_COMPILERS = {
+    sql.Select: _compile_select,
+    sql.Explain: _compile_explain,
+    sql.Insert: _compile_insert,
+    sql.Update: _compile_update,
+    sql.Delete: _compile_delete,
+    sql.Copy: _statement(_exec_copy),
+    sql.CreateTable: _statement(_exec_create_table),
+    sql.DropTable: _statement(_exec_drop_table),
+    sql.CreateIndex: _statement(_exec_create_index),
+    sql.DropIndex: _statement(_exec_drop_index),
+    sql.AddColumn: _statement(_exec_add_column),
+    sql.DropColumn: _statement(_exec_drop_column),
+    sql.SetLayout: _statement(_exec_set_layout),
+    sql.CreateDatabase: _statement(_exec_create_database),
+    sql.DropDatabase: _statement(_exec_drop_database),
+    sql.UseDatabase: _statement(_exec_use),
+    sql.ShowDatabases: _statement(_exec_show_databases),
+    sql.ShowTables: _statement(_exec_show_tables),
+    sql.Begin: _statement(_exec_transaction_control),
+    sql.Commit: _statement(_exec_transaction_control),
+    sql.Rollback: _statement(_exec_transaction_control),
+}
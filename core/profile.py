@@ -0,0 +1,133 @@
+"""
+Per-query statistics for EXPLAIN ANALYZE.
+
+While a QueryProfile is installed on an engine (DatabaseEngine.profiling),
+each plan operator pulls its input through QueryProfile.iterate (see
+planner.Operator.run), which counts the rows and times every pull. The
+engine notes what it did for the operator being pulled: the access path or
+join strategy it chose, index probes, join inputs and predicate time.
+Storage reads come from storage.io_counters(). Queries run without a
+profile skip all of this.
+"""
+import time
+
+from core import storage
+
+
+class OperatorStats:
+    """What one plan operator did; time and storage reads include its inputs'."""
+
+    def __init__(self):
+        self.rows = 0
+        self.time = 0.0      # Seconds spent producing rows
+        self.io = (0, 0, 0)  # storage.io_counters() growth: records, bytes, pooled rows
+        self.details = {}    # Engine notes: 'strategy' label and counters (index_probes, ...)
+
+
+class QueryProfile:
+    def __init__(self):
+        self.operators = {}  # {id(operator): OperatorStats}
+        self.current = None  # Stats of the operator being pulled: engine notes go there
+
+    def stats(self, operator):
+        stats = self.operators.get(id(operator))
+        if stats is None:
+            stats = self.operators[id(operator)] = OperatorStats()
+        return stats
+
+    def note(self, **details):
+        """Adds counters to, and sets labels of, the details of the operator being pulled."""
+        if self.current is None:
+            return
+        notes = self.current.details
+        for key, value in details.items():
+            if type(value) in (int, float):
+                notes[key] = notes.get(key, 0) + value
+            else:
+                notes[key] = value
+
+    def timed(self, predicate):
+        """Wraps a row predicate to charge its calls and time to the operator being pulled."""
+        if self.current is None or predicate is None:
+            return predicate
+        notes, clock = self.current.details, time.perf_counter
+        notes.setdefault('filter_time', 0.0)
+        notes.setdefault('filter_rows', 0)
+        notes.setdefault('filter_passed', 0)
+
+        def test(row):
+            start = clock()
+            passed = predicate(row)
+            notes['filter_time'] += clock() - start
+            notes['filter_rows'] += 1
+            if passed:
+                notes['filter_passed'] += 1
+            return passed
+        return test
+
+    def iterate(self, operator, rows):
+        """Runs rows() (which returns the operator's iterator) and every pull from it on operator's account."""
+        stats = self.stats(operator)
+        iterator = self._charge(stats, lambda: iter(rows()))
+        return self._pull(stats, iterator)
+
+    def _charge(self, stats, call):
+        previous, self.current = self.current, stats
+        before = storage.io_counters()
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            stats.time += time.perf_counter() - start
+            stats.io = tuple(total + after - earlier
+                             for total, after, earlier in zip(stats.io, storage.io_counters(), before))
+            self.current = previous
+
+    def _pull(self, stats, iterator):
+        pull = iterator.__next__
+        while True:
+            try:
+                row = self._charge(stats, pull)
+            except StopIteration:
+                return
+            stats.rows += 1
+            yield row
+
+    def report(self, operator):
+        """('(rows=..., time=...)', [detail line, ...]) for an operator's line of the plan."""
+        stats = self.stats(operator)
+        inputs = [self.stats(child) for child in operator.children]
+        own_time = stats.time - sum(child.time for child in inputs)
+        records, nbytes, pooled = (total - sum(child.io[i] for child in inputs) for i, total in enumerate(stats.io))
+        notes = stats.details
+        lines = []
+        if 'left_rows' in notes:
+            lines.append(f"join input: {notes['left_rows']} left x {notes['right_rows']} right row(s)")
+        if 'left_keys' in notes:
+            lines.append(f"merge: {notes['left_keys']} x {notes['right_keys']} index key(s)")
+        index = []
+        if 'index_probes' in notes:
+            hits = notes.get('index_hits', 0)
+            index.append(f"{notes['index_probes']} probe(s), {hits} hit(s), {notes['index_probes'] - hits} miss(es)")
+        if 'index_rows' in notes:
+            index.append(f"{notes['index_rows']} row id(s)")
+        if index:
+            lines.append("index: " + ', '.join(index))
+        if records or nbytes or pooled:
+            lines.append(f"storage: {records} record(s), {_size(nbytes)} read; {pooled} row(s) from the buffer pool")
+        if 'filter_rows' in notes:
+            lines.append(f"filter: {notes['filter_passed']} of {notes['filter_rows']} row(s) passed, "
+                         f"{_ms(notes['filter_time'])}; read+decode {_ms(max(own_time - notes['filter_time'], 0.0))}")
+        return f"(rows={stats.rows}, time={_ms(stats.time)})", lines
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.3f} ms"
+
+
+def _size(nbytes):
+    if nbytes < 1024:
+        return f"{nbytes} B"
+    if nbytes < 1024 * 1024:
+        return f"{nbytes / 1024:.1f} KiB"
+    return f"{nbytes / (1024 * 1024):.1f} MiB"
@@ -0,0 +1,77 @@
+"""
+Compact in-memory rows: schema-ordered value tuples.
+
+A RowLayout maps a table's columns (in TableSchema.columns order) to tuple
+positions. The buffer pool keeps rows packed this way instead of as dicts
+that repeat every column name (with per-record copies of the name strings
+when decoded from JSON), which roughly halves a cached table. Rows turn
+back into dicts only when they are handed to a caller. A row whose columns
+differ from the layout, e.g. one stored under an older schema, stays a dict.
+"""
+
+
+def _dict_builder(slots):
+    """
+    Compiles [(key, position or None)] into values -> {key: values[position]}
+    as a single dict display, about twice as fast as dict(zip(...)). Keys are
+    embedded with repr(), so any column name is safe.
+    """
+    items = ', '.join(f"{key!r}: {'None' if pos is None else f'values[{pos}]'}" for key, pos in slots)
+    return eval(f"lambda values: {{{items}}}")
+
+
+class RowLayout:
+    __slots__ = ('columns', 'positions', '_build')
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.positions = {col: pos for pos, col in enumerate(self.columns)}
+        self._build = _dict_builder(list(self.positions.items()))
+
+    def pack(self, row):
+        """A value tuple for the row, or a copy of it if its columns differ from the layout."""
+        if row.keys() != self.positions.keys():
+            return dict(row)
+        return tuple(map(row.__getitem__, self.columns))
+
+    def unpack(self, packed):
+        """A fresh dict for a packed row."""
+        if type(packed) is tuple:
+            return self._build(packed)
+        return dict(packed)
+
+    def builder(self, columns=None):
+        """
+        Returns value tuple -> {col: value} for the given columns (None for
+        unknown ones), or for every column. Only for packed (tuple) rows.
+        """
+        if columns is None:
+            return self._build
+        return _dict_builder([(col, self.positions.get(col)) for col in columns])
+
+    def view(self):
+        """A reusable RowView over this layout's packed rows."""
+        return RowView(self.positions)
+
+
+class RowView:
+    """
+    Read-only row access (get / [] / in) over one packed row at a time, so
+    scan predicates can test cached rows without building a dict for each.
+    Point it at a row by setting values; a predicate must not keep it.
+    """
+    __slots__ = ('positions', 'values')
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.values = None
+
+    def get(self, col, default=None):
+        pos = self.positions.get(col)
+        return default if pos is None else self.values[pos]
+
+    def __getitem__(self, col):
+        return self.values[self.positions[col]]
+
+    def __contains__(self, col):
+        return col in self.positions
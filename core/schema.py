@@ -1,25 +1,34 @@
+_CASTS = {'int': int, 'float': float, 'str': str}
+LAYOUTS = ('row', 'columnar')
+
+
 class TableSchema:
-    def __init__(self, name, columns, primary_key=None, unique_keys=None, foreign_keys=None):
+    def __init__(self, name, columns, primary_key=None, unique_keys=None, foreign_keys=None, indexes=None,
+                 layout='row', defaults=None, version=0, rows_version=None, dropped=None):
         """
         :param name: String name of the table
         :param columns: Dict of {column_name: type_string} e.g. {'id': 'int'}
         :param primary_key: String name of the PK column
         :param unique_keys: List of column names that must be unique
+        :param foreign_keys: Dict of {local_col: "parent_table.parent_col"}
+        :param indexes: Dict of secondary indexes {index_name: {"column": col, "unique": bool, "ordered": bool}}
+        :param layout: 'row' (segments only) or 'columnar' (also kept as column arrays for analytic scans)
+        :param defaults: Dict of {column_name: value} for columns added by ADD COLUMN (None = NULL)
+        :param version: Schema version, bumped by every ADD/DROP COLUMN
+        :param rows_version: Version every stored row is known to match; older rows are upgraded on read
+        :param dropped: Columns dropped since rows_version, still present in older stored rows
         """
         self.name = name
         self.columns = columns
         self.primary_key = primary_key
         self.unique_keys = unique_keys or []
-        self.foreign_keys = foreign_keys or{}  # To be populated later
-
-        def to_dict(self):
-            return {
-                "name": self.name,
-                "columns": self.columns,
-                "primary_key": self.primary_key,
-                "unique_keys": self.unique_keys,
-                "foreign_keys": self.foreign_keys
-            }
+        self.foreign_keys = foreign_keys or {}
+        self.indexes = indexes or {}
+        self.layout = layout
+        self.defaults = defaults or {}
+        self.version = version
+        self.rows_version = version if rows_version is None else rows_version
+        self.dropped = dropped or []
 
     def validate(self, data):
         """Validates and coerces types for a single row (dict)."""
@@ -28,26 +37,103 @@ class TableSchema:
 
         for col_name, col_type in self.columns.items():
             if col_name not in data:
-                raise ValueError(f"Missing column '{col_name}' for table '{self.name}'.")
-            
+                if col_name not in self.defaults:
+                    raise ValueError(f"Missing column '{col_name}' for table '{self.name}'.")
+                data[col_name] = self.defaults[col_name]
+
             value = data[col_name]
+            cast = _CASTS.get(col_type)
+            if value is None:
+                self._check_null(col_name)
+                continue  # NULL is stored as is, whatever the type
+            if cast is None:
+                continue
             try:
-                if col_type == 'int':
-                    data[col_name] = int(value)
-                elif col_type == 'float':
-                    data[col_name] = float(value)
-                elif col_type == 'str':
-                    data[col_name] = str(value)
+                data[col_name] = cast(value)
             except (ValueError, TypeError):
                 raise TypeError(f"Column '{col_name}' expected {col_type}, got {type(value).__name__}")
 
         return data
 
+    def needs_upgrade(self):
+        """True while rows written under an older version may still be stored."""
+        return self.rows_version < self.version
+
+    def is_current(self, row):
+        """True if a stored row already has exactly this version's columns."""
+        return row.keys() == self.columns.keys()
+
+    def upgrade(self, row):
+        """
+        Returns a stored row as this version sees it: added columns take their
+        default and dropped ones are hidden. Rows are never changed in place.
+        """
+        return {col: row[col] if col in row else self.defaults.get(col) for col in self.columns}
+
+    def converter(self, col_name):
+        """
+        Returns a function that casts one value to col_name's declared type
+        exactly as validate() would, so prepared statements can resolve the
+        cast once instead of per row.
+        """
+        col_type = self.columns.get(col_name)
+        cast = _CASTS.get(col_type) or (lambda value: value)
+        def convert(value):
+            if value is None:
+                self._check_null(col_name)
+                return None
+            try:
+                return cast(value)
+            except (ValueError, TypeError):
+                raise TypeError(f"Column '{col_name}' expected {col_type}, got {type(value).__name__}")
+        return convert
+
+    def _check_null(self, col_name):
+        """The primary key is the only column that may not be NULL."""
+        if col_name == self.primary_key:
+            raise ValueError(f"Primary key column '{col_name}' of table '{self.name}' cannot be NULL.")
+
+    def coerce(self, col_name, value):
+        """Casts a single lookup value to the declared type of col_name."""
+        col_type = self.columns.get(col_name)
+        if col_type == 'int':
+            return int(value)
+        if col_type == 'float':
+            return float(value)
+        return value
+
+    def indexed_columns(self):
+        """
+        Returns {column: {"unique": bool, "ordered": bool}} for every indexed column.
+        The engine keeps one index per column, so specs on the same column are
+        merged: it is unique if any spec (PK, unique_keys) is, and ordered if any
+        spec asks for range support.
+        """
+        columns = {}
+        def merge(col, unique, ordered):
+            spec = columns.setdefault(col, {"unique": False, "ordered": False})
+            spec["unique"] = spec["unique"] or unique
+            spec["ordered"] = spec["ordered"] or ordered
+        for spec in self.indexes.values():
+            merge(spec['column'], spec['unique'], spec.get('ordered', False))
+        for col in self.unique_keys:
+            merge(col, True, False)
+        if self.primary_key:
+            merge(self.primary_key, True, False)
+        return columns
+
     def to_dict(self):
         """Helper to save schema definition to metadata.json"""
         return {
             "name": self.name,
             "columns": self.columns,
             "primary_key": self.primary_key,
-            "unique_keys": self.unique_keys
-        }
\ No newline at end of file
+            "unique_keys": self.unique_keys,
+            "foreign_keys": self.foreign_keys,
+            "indexes": self.indexes,
+            "layout": self.layout,
+            "defaults": self.defaults,
+            "version": self.version,
+            "rows_version": self.rows_version,
+            "dropped": self.dropped
+        }
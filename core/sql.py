@@ -0,0 +1,575 @@
+"""
+SQL front end shared by the REPL and the web shell: a tokenizer and a
+recursive-descent parser that turns one statement into an AST.
+Planning and execution live in core/planner.py.
+"""
+import ast
+import re
+
+
+class SQLSyntaxError(ValueError):
+    pass
+
+
+# --- TOKENIZER ---
+
+_TOKEN_RE = re.compile(r"""
+      (?P<ws>\s+)
+    | (?P<number>\d+\.\d*|\.\d+|\d+)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<qident>"(?:[^"]|"")*")
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op><=|>=|!=|<>|[=<>,().*;:?{}\[\]+\-/])
+""", re.VERBOSE)
+
+# Words that can never be bare column names, so lists and expressions know where to stop
+RESERVED = {
+    'SELECT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'JOIN', 'INNER', 'ON', 'GROUP',
+    'ORDER', 'BY', 'LIMIT', 'OFFSET', 'AS', 'BETWEEN', 'IN', 'IS', 'ASC', 'DESC',
+}
+
+
+class Token:
+    def __init__(self, kind, value, pos):
+        self.kind = kind    # 'number' | 'string' | 'ident' | 'op' | 'eof'
+        self.value = value
+        self.pos = pos      # Offset in the statement text
+
+    @property
+    def word(self):
+        """Upper-cased identifier text (for keyword matching), else None."""
+        return self.value.upper() if self.kind == 'ident' else None
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r})"
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match:
+            raise SQLSyntaxError(f"Unexpected character {text[pos]!r} at position {pos}.")
+        kind = match.lastgroup
+        raw = match.group()
+        if kind == 'number':
+            tokens.append(Token('number', float(raw) if '.' in raw else int(raw), pos))
+        elif kind == 'string':
+            tokens.append(Token('string', raw[1:-1].replace("''", "'"), pos))
+        elif kind == 'qident':
+            tokens.append(Token('ident', raw[1:-1].replace('""', '"'), pos))
+        elif kind == 'ident':
+            tokens.append(Token('ident', raw, pos))
+        elif kind == 'op':
+            tokens.append(Token('op', '!=' if raw == '<>' else raw, pos))
+        pos = match.end()
+    tokens.append(Token('eof', None, len(text)))
+    return tokens
+
+
+# --- AST ---
+
+class Node:
+    """AST node: a bag of named fields, compared structurally."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        fields = ', '.join(f"{k}={v!r}" for k, v in self.__dict__.items())
+        return f"{type(self).__name__}({fields})"
+
+# Expressions
+class Column(Node): pass        # table (or None), name
+class Literal(Node): pass       # value
+class Compare(Node): pass       # op, left, right
+class BoolOp(Node): pass        # op ('AND' | 'OR'), items
+class Not(Node): pass           # expr
+class InList(Node): pass        # expr, values, negate
+class IsNull(Node): pass        # expr, negate
+class Func(Node): pass          # name (upper), arg (expr or None for '*')
+class Param(Node): pass         # index of a '?' placeholder, bound at execution time
+
+# Statements
+class Select(Node): pass        # items, table, alias, joins, where, group_by, order_by, limit, offset
+class Explain(Node): pass       # query (Select), analyze (run it and report what each operator did)
+class SelectItem(Node): pass    # expr, alias
+class JoinClause(Node): pass    # table, alias, left (Column), right (Column)
+class OrderItem(Node): pass     # expr, descending
+class Insert(Node): pass        # table, columns, values (list of rows), row (dict literal or None)
+class Update(Node): pass        # table, assignments {col: value}, where
+class Delete(Node): pass        # table, where
+class Copy(Node): pass          # table, path, file_format (or None to infer from the extension)
+class CreateTable(Node): pass   # table, columns, primary_key, unique_keys, foreign_keys
+class CreateIndex(Node): pass   # name, table, column, unique, ordered
+class DropIndex(Node): pass     # name
+class DropTable(Node): pass     # table
+class CreateDatabase(Node): pass  # name
+class DropDatabase(Node): pass  # name
+class UseDatabase(Node): pass   # name
+class ShowDatabases(Node): pass
+class ShowTables(Node): pass
+class AddColumn(Node): pass     # table, column, col_type, default
+class DropColumn(Node): pass    # table, column
+class SetLayout(Node): pass     # table, layout ('row' | 'columnar')
+class Begin(Node): pass
+class Commit(Node): pass
+class Rollback(Node): pass
+
+AGGREGATES = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+COLUMN_TYPES = ('int', 'float', 'str')
+
+
+# --- PARSER ---
+
+class Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.i = 0
+        self.param_count = 0
+
+    # Token helpers
+
+    @property
+    def tok(self):
+        return self.tokens[self.i]
+
+    def advance(self):
+        tok = self.tokens[self.i]
+        self.i += 1
+        return tok
+
+    def error(self, expected):
+        tok = self.tok
+        found = 'end of input' if tok.kind == 'eof' else repr(tok.value)
+        return SQLSyntaxError(f"Expected {expected} but found {found} at position {tok.pos}.")
+
+    def at_kw(self, *words):
+        return self.tok.word in words
+
+    def accept_kw(self, *words):
+        if self.tok.word in words:
+            return self.advance().word
+        return None
+
+    def expect_kw(self, *words):
+        word = self.accept_kw(*words)
+        if word is None:
+            raise self.error(' or '.join(words))
+        return word
+
+    def accept_op(self, *ops):
+        if self.tok.kind == 'op' and self.tok.value in ops:
+            return self.advance().value
+        return None
+
+    def expect_op(self, op):
+        if not self.accept_op(op):
+            raise self.error(f"'{op}'")
+
+    def ident(self, what='identifier'):
+        if self.tok.kind != 'ident' or self.tok.word in RESERVED:
+            raise self.error(what)
+        return self.advance().value
+
+    # Entry point
+
+    def parse(self):
+        stmt = self.statement()
+        self.accept_op(';')
+        if self.tok.kind != 'eof':
+            raise self.error('end of statement')
+        stmt.param_count = self.param_count
+        return stmt
+
+    def statement(self):
+        word = self.tok.word
+        handler = {
+            'SELECT': self.select, 'INSERT': self.insert, 'UPDATE': self.update,
+            'DELETE': self.delete, 'CREATE': self.create, 'DROP': self.drop,
+            'SHOW': self.show, 'USE': self.use, 'ADD': self.add_column, 'ALTER': self.alter,
+            'COPY': self.copy, 'BEGIN': self.transaction, 'START': self.transaction,
+            'COMMIT': self.transaction, 'ROLLBACK': self.transaction, 'EXPLAIN': self.explain,
+        }.get(word)
+        if handler is None:
+            raise self.error('a statement')
+        return handler()
+
+    # EXPLAIN
+
+    def explain(self):
+        # EXPLAIN [ANALYZE] SELECT ...
+        self.expect_kw('EXPLAIN')
+        analyze = bool(self.accept_kw('ANALYZE'))
+        if not self.at_kw('SELECT'):
+            raise self.error('a SELECT statement')
+        return Explain(query=self.select(), analyze=analyze)
+
+    # SELECT
+
+    def select(self):
+        self.expect_kw('SELECT')
+        items = []
+        if self.accept_op('*'):
+            pass
+        elif not self.at_kw('FROM'):  # 'SELECT FROM t' is shorthand for 'SELECT * FROM t'
+            items.append(self.select_item())
+            while self.accept_op(','):
+                items.append(self.select_item())
+        self.expect_kw('FROM')
+        table, alias = self.table_ref()
+
+        joins = []
+        while self.at_kw('JOIN', 'INNER'):
+            self.accept_kw('INNER')
+            self.expect_kw('JOIN')
+            join_table, join_alias = self.table_ref()
+            self.expect_kw('ON')
+            left = self.column_ref()
+            self.expect_op('=')
+            right = self.column_ref()
+            joins.append(JoinClause(table=join_table, alias=join_alias, left=left, right=right))
+
+        where = self.expr() if self.accept_kw('WHERE') else None
+
+        group_by = []
+        if self.accept_kw('GROUP'):
+            self.expect_kw('BY')
+            group_by.append(self.column_ref())
+            while self.accept_op(','):
+                group_by.append(self.column_ref())
+
+        order_by = []
+        if self.accept_kw('ORDER'):
+            self.expect_kw('BY')
+            order_by.append(self.order_item())
+            while self.accept_op(','):
+                order_by.append(self.order_item())
+
+        limit = offset = None
+        if self.accept_kw('LIMIT'):
+            limit = self.count_value('LIMIT')
+            if self.accept_kw('OFFSET'):
+                offset = self.count_value('OFFSET')
+
+        return Select(items=items, table=table, alias=alias, joins=joins, where=where,
+                      group_by=group_by, order_by=order_by, limit=limit, offset=offset)
+
+    def select_item(self):
+        expr = self.operand()
+        alias = None
+        if self.accept_kw('AS'):
+            alias = self.ident('alias')
+        elif self.tok.kind == 'ident' and self.tok.word not in RESERVED:
+            alias = self.advance().value
+        return SelectItem(expr=expr, alias=alias)
+
+    def table_ref(self):
+        table = self.ident('table name')
+        alias = None
+        if self.accept_kw('AS'):
+            alias = self.ident('alias')
+        elif self.tok.kind == 'ident' and self.tok.word not in RESERVED:
+            alias = self.advance().value
+        return table, alias
+
+    def order_item(self):
+        expr = self.operand()
+        descending = self.accept_kw('ASC', 'DESC') == 'DESC'
+        return OrderItem(expr=expr, descending=descending)
+
+    def count_value(self, clause):
+        tok = self.tok
+        if tok.kind == 'number' and isinstance(tok.value, int):
+            return self.advance().value
+        raise self.error(f"an integer after {clause}")
+
+    def column_ref(self):
+        name = self.ident('column name')
+        if self.accept_op('.'):
+            return Column(table=name, name=self.ident('column name'))
+        return Column(table=None, name=name)
+
+    # Expressions
+
+    def expr(self):
+        items = [self.and_expr()]
+        while self.accept_kw('OR'):
+            items.append(self.and_expr())
+        return items[0] if len(items) == 1 else BoolOp(op='OR', items=items)
+
+    def and_expr(self):
+        items = [self.not_expr()]
+        while self.accept_kw('AND'):
+            items.append(self.not_expr())
+        return items[0] if len(items) == 1 else BoolOp(op='AND', items=items)
+
+    def not_expr(self):
+        if self.accept_kw('NOT'):
+            return Not(expr=self.not_expr())
+        return self.predicate()
+
+    def predicate(self):
+        left = self.operand()
+        op = self.accept_op('=', '!=', '<', '<=', '>', '>=')
+        if op:
+            return Compare(op=op, left=left, right=self.operand())
+        if self.accept_kw('BETWEEN'):
+            low = self.operand()
+            self.expect_kw('AND')
+            high = self.operand()
+            return BoolOp(op='AND', items=[Compare(op='>=', left=left, right=low),
+                                           Compare(op='<=', left=left, right=high)])
+        negate = bool(self.accept_kw('NOT'))
+        if self.accept_kw('IN'):
+            self.expect_op('(')
+            values = [self.literal()]
+            while self.accept_op(','):
+                values.append(self.literal())
+            self.expect_op(')')
+            return InList(expr=left, values=values, negate=negate)
+        if negate:
+            raise self.error('IN')
+        if self.accept_kw('IS'):
+            negate = bool(self.accept_kw('NOT'))
+            self.expect_kw('NULL')
+            return IsNull(expr=left, negate=negate)
+        return left
+
+    def operand(self):
+        tok = self.tok
+        if self.accept_op('('):
+            inner = self.expr()
+            self.expect_op(')')
+            return inner
+        if tok.kind in ('number', 'string') or (tok.kind == 'op' and tok.value in ('-', '?')) or \
+                tok.word in ('NULL', 'TRUE', 'FALSE'):
+            value = self.literal()
+            return value if isinstance(value, Param) else Literal(value=value)
+        if tok.kind == 'ident' and tok.word in AGGREGATES and self.tokens[self.i + 1].value == '(':
+            name = self.advance().word
+            self.expect_op('(')
+            arg = None if self.accept_op('*') else self.column_ref()
+            self.expect_op(')')
+            return Func(name=name, arg=arg)
+        return self.column_ref()
+
+    def literal(self):
+        """A constant value, or a Param node for a '?' placeholder."""
+        tok = self.tok
+        if self.accept_op('?'):
+            self.param_count += 1
+            return Param(index=self.param_count - 1)
+        if self.accept_op('-'):
+            if self.tok.kind != 'number':
+                raise self.error('a number')
+            return -self.advance().value
+        if tok.kind in ('number', 'string'):
+            return self.advance().value
+        word = self.accept_kw('NULL', 'TRUE', 'FALSE')
+        if word:
+            return {'NULL': None, 'TRUE': True, 'FALSE': False}[word]
+        raise self.error('a literal value')
+
+    # DML
+
+    def insert(self):
+        self.expect_kw('INSERT')
+        self.expect_kw('INTO')
+        table = self.ident('table name')
+
+        if self.tok.kind == 'op' and self.tok.value == '{':
+            # Legacy form: INSERT INTO t {'id': 1, 'name': 'Rex'}
+            raw = self.text[self.tok.pos:].strip().rstrip(';')
+            try:
+                row = ast.literal_eval(raw)
+            except (ValueError, SyntaxError):
+                raise SQLSyntaxError(f"Malformed row literal: {raw}")
+            if not isinstance(row, dict):
+                raise SQLSyntaxError("Row literal must be a dictionary.")
+            self.i = len(self.tokens) - 1
+            return Insert(table=table, columns=None, values=None, row=row)
+
+        columns = None
+        if self.accept_op('('):
+            columns = [self.ident('column name')]
+            while self.accept_op(','):
+                columns.append(self.ident('column name'))
+            self.expect_op(')')
+        self.expect_kw('VALUES')
+        values = [self.value_tuple()]
+        while self.accept_op(','):
+            values.append(self.value_tuple())
+        return Insert(table=table, columns=columns, values=values, row=None)
+
+    def value_tuple(self):
+        self.expect_op('(')
+        values = [self.literal()]
+        while self.accept_op(','):
+            values.append(self.literal())
+        self.expect_op(')')
+        return values
+
+    def update(self):
+        self.expect_kw('UPDATE')
+        table = self.ident('table name')
+        self.expect_kw('SET')
+        assignments = {}
+        while True:
+            col = self.ident('column name')
+            self.expect_op('=')
+            assignments[col] = self.literal()
+            if not self.accept_op(','):
+                break
+        where = self.expr() if self.accept_kw('WHERE') else None
+        return Update(table=table, assignments=assignments, where=where)
+
+    def delete(self):
+        self.expect_kw('DELETE')
+        self.expect_kw('FROM')
+        table = self.ident('table name')
+        where = self.expr() if self.accept_kw('WHERE') else None
+        return Delete(table=table, where=where)
+
+    # DDL and session commands
+
+    def create(self):
+        self.expect_kw('CREATE')
+        if self.accept_kw('DATABASE'):
+            return CreateDatabase(name=self.ident('database name'))
+        if self.accept_kw('TABLE'):
+            return self.create_table()
+        unique = bool(self.accept_kw('UNIQUE'))
+        self.expect_kw('INDEX')
+        name = self.ident('index name')
+        self.expect_kw('ON')
+        table = self.ident('table name')
+        ordered = False
+        if self.accept_kw('USING'):
+            ordered = self.expect_kw('BTREE', 'HASH') == 'BTREE'
+        self.expect_op('(')
+        column = self.ident('column name')
+        self.expect_op(')')
+        return CreateIndex(name=name, table=table, column=column, unique=unique, ordered=ordered)
+
+    def create_table(self):
+        table = self.ident('table name')
+        columns, primary_key, unique_keys, foreign_keys = {}, None, [], {}
+        self.expect_op('(')
+        while True:
+            col = self.ident('column name')
+            self.accept_op(':')  # Both 'id:int' and 'id int' are accepted
+            columns[col] = self.column_type()
+            while True:
+                if self.accept_kw('PRIMARY'):
+                    self.expect_kw('KEY')
+                    primary_key = col
+                elif self.accept_kw('UNIQUE'):
+                    unique_keys.append(col)
+                elif self.accept_kw('REFERENCES'):
+                    parent = self.ident('table name')
+                    self.expect_op('(')
+                    foreign_keys[col] = f"{parent}.{self.ident('column name')}"
+                    self.expect_op(')')
+                else:
+                    break
+            if not self.accept_op(','):
+                break
+        self.expect_op(')')
+        return CreateTable(table=table, columns=columns, primary_key=primary_key,
+                           unique_keys=unique_keys, foreign_keys=foreign_keys)
+
+    def column_type(self):
+        tok = self.tok
+        if tok.kind == 'ident' and tok.value.lower() in COLUMN_TYPES:
+            return self.advance().value.lower()
+        raise self.error(f"a column type ({', '.join(COLUMN_TYPES)})")
+
+    def drop(self):
+        self.expect_kw('DROP')
+        word = self.expect_kw('DATABASE', 'TABLE', 'INDEX', 'COLUMN')
+        if word == 'DATABASE':
+            return DropDatabase(name=self.ident('database name'))
+        if word == 'TABLE':
+            return DropTable(table=self.ident('table name'))
+        if word == 'INDEX':
+            return DropIndex(name=self.ident('index name'))
+        # Legacy form: DROP COLUMN <table> <column>
+        table = self.ident('table name')
+        return DropColumn(table=table, column=self.ident('column name'))
+
+    def add_column(self):
+        # Legacy form: ADD COLUMN <table> <column> [type] [DEFAULT value]
+        self.expect_kw('ADD')
+        self.expect_kw('COLUMN')
+        table = self.ident('table name')
+        return self.column_addition(table)
+
+    def column_addition(self, table):
+        # <column> [type] [DEFAULT value]
+        column = self.ident('column name')
+        col_type = self.column_type() if self.tok.kind == 'ident' and not self.at_kw('DEFAULT') else 'str'
+        default = None
+        if self.accept_kw('DEFAULT'):
+            default = self.literal()
+            if isinstance(default, Param):
+                raise SQLSyntaxError("A column DEFAULT must be a constant, not a '?' parameter.")
+        return AddColumn(table=table, column=column, col_type=col_type, default=default)
+
+    def alter(self):
+        # ALTER TABLE <table> ADD [COLUMN] <column> [type] [DEFAULT value] | DROP [COLUMN] <column>
+        #                     | SET LAYOUT ROW|COLUMNAR
+        self.expect_kw('ALTER')
+        self.expect_kw('TABLE')
+        table = self.ident('table name')
+        action = self.expect_kw('ADD', 'DROP', 'SET')
+        if action == 'SET':
+            self.expect_kw('LAYOUT')
+            return SetLayout(table=table, layout=self.expect_kw('ROW', 'COLUMNAR').lower())
+        if action == 'ADD':
+            self.accept_kw('COLUMN')
+            return self.column_addition(table)
+        self.accept_kw('COLUMN')
+        return DropColumn(table=table, column=self.ident('column name'))
+
+    def show(self):
+        self.expect_kw('SHOW')
+        if self.expect_kw('DATABASES', 'TABLES') == 'DATABASES':
+            return ShowDatabases()
+        return ShowTables()
+
+    def use(self):
+        self.expect_kw('USE')
+        return UseDatabase(name=self.ident('database name'))
+
+    def transaction(self):
+        # BEGIN [TRANSACTION | WORK] | START TRANSACTION | COMMIT [...] | ROLLBACK [...]
+        word = self.expect_kw('BEGIN', 'START', 'COMMIT', 'ROLLBACK')
+        if word == 'START':
+            self.expect_kw('TRANSACTION')
+        else:
+            self.accept_kw('TRANSACTION', 'WORK')
+        return {'BEGIN': Begin, 'START': Begin, 'COMMIT': Commit, 'ROLLBACK': Rollback}[word]()
+
+    def copy(self):
+        # COPY <table> FROM '<file>' [FORMAT CSV|NDJSON]
+        self.expect_kw('COPY')
+        table = self.ident('table name')
+        self.expect_kw('FROM')
+        if self.tok.kind != 'string':
+            raise self.error('a quoted file path')
+        path = self.advance().value
+        file_format = None
+        if self.accept_kw('FORMAT'):
+            file_format = self.expect_kw('CSV', 'NDJSON').lower()
+        return Copy(table=table, path=path, file_format=file_format)
+
+
+def parse(text):
+    """Parses a single SQL statement into its AST."""
+    return Parser(text).parse()
@@ -1,45 +1,1144 @@
 import json
+import mmap
 import os
+import shutil
+import struct
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from core import metrics
+from core.bufferpool import BufferPool
+from core.codec import ROW_CODECS, BinaryRowCodec, JsonRowCodec
+from core.rows import RowLayout
 
 # Root data directory
 BASE_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
 
+# Table layout: data/{db_name}/{table_name}/ holds numbered segment files
+# ("000001.seg", "000002.seg", ...). A segment is SEGMENT_MAGIC followed by
+# an append-only log of records, each an _ENTRY header (kind, body length,
+# rid) and a body:
+#   kind 0 (tombstone)    -> the row id is deleted; no body
+#   a row codec's kind    -> put: inserts the row encoded by that codec
+#                            (core/codec.py), or supersedes an older version
+#   _BLOCK                -> zlib-compressed run of records; rid is their count
+#   _PAD                  -> filler up to the end of a page
+# Replaying the segments in order yields the live rows, so a single-row
+# write only ever appends O(row) bytes to the newest segment.
+# Segments are split into PAGE_SIZE pages. A record (or block) never crosses
+# a page boundary unless it is larger than a page, in which case it starts
+# on one. The rest of a page is padding: a _PAD record or, when fewer than
+# _ENTRY.size bytes are left, zeros. So a point read touches one page.
+# Segments are read through shared memory maps (see _map_segment) and
+# records are decoded in place, without read calls or copies of the file.
+# Segment appends are not fsynced individually: durability comes from the
+# database WAL (core/wal.py), and sync_database() flushes them at checkpoints.
+SEGMENT_EXT = '.seg'
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+SEGMENT_MAGIC = b'PESASEG\x02'
+_UNPAGED_MAGIC = b'PESASEG\x01'  # The format before pages, converted on open
+PAGE_SIZE = 8192
+MAPPED_SEGMENTS = 256  # Memory maps kept open (each holds a file descriptor)
+COMPACT_MIN_DEAD = 1024  # Dead records tolerated before a compaction is considered
+
+# Codec new records are written with (a name in core.codec.ROW_CODECS)
+ROW_CODEC = 'binary'
+# Writes of at least BLOCK_MIN_ROWS records (bulk loads, compactions) are
+# stored as compressed blocks of up to BLOCK_ROWS records each
+BLOCK_COMPRESSION = True
+BLOCK_ROWS = 64  # At most 1 << SLOT_BITS
+BLOCK_MIN_ROWS = 16
+BLOCK_LEVEL = 1
+
+_ENTRY = struct.Struct('<BIQ')
+_TOMBSTONE = 0
+_PAD = 254
+_BLOCK = 255
+# A locator position is offset << SLOT_BITS | slot: the record's byte offset
+# in its segment (so its page is offset // PAGE_SIZE), or its block's offset
+# and its slot in the block's index
+SLOT_BITS = 8
+_SLOT_MASK = (1 << SLOT_BITS) - 1
+_SLOT_OFFSET = struct.Struct('<I')
+
+# Snapshots kept beside the segments so opening a table does not rescan it:
+# locator.json (rid -> segment position), indexes.json (engine index maps) and,
+# for columnar tables, columns.bin (the serialized core.columnar.ColumnStore).
+LOCATOR_FILE = 'locator.json'
+INDEX_FILE = 'indexes.json'
+COLUMNS_FILE = 'columns.bin'
+SNAPSHOT_CRC_BYTES = 4096
+
+# In-process state of every opened table log, keyed by (db_name, table_name)
+_open_tables = {}
+_open_lock = threading.Lock()  # Guards _open_tables; never held while taking a table log's lock
+# RowLayout the buffer pool packs each table's rows with, and the column
+# types binary records are encoded by (see set_row_layout)
+_layouts = {}
+_column_types = {}
+
+# Read-only memory maps of segment files, least recently used first
+_maps = OrderedDict()
+_maps_lock = threading.Lock()
+
+# Decoded rows of recently scanned tables, shared by every engine in the process
+BUFFER_POOL_BYTES = 64 * 1024 * 1024
+buffer_pool = BufferPool(BUFFER_POOL_BYTES)
+
+
+class _ReadCounters(threading.local):
+    """Storage reads made by one thread (see io_counters)."""
+
+    def __init__(self):
+        # [segment records read, segment bytes read (a block's compressed
+        # size, once), rows served from the buffer pool instead]. Scans bump
+        # the list they captured at the start, not thread-local attributes.
+        self.counts = [0, 0, 0]
+        key = id(self.counts)
+        with _read_counts_lock:
+            _read_counts[key] = self.counts
+        metrics.on_thread_exit(_retire_reads, key)
+
+def _retire_reads(key):
+    """Folds the counts of a thread that has ended into _retired_reads."""
+    with _read_counts_lock:
+        for i, value in enumerate(_read_counts.pop(key)):
+            _retired_reads[i] += value
+
+_read_counts = {}  # {id: counts} of every running thread, summed up by metrics scrapes
+_retired_reads = [0, 0, 0]  # Counts of the threads that have ended
+_read_counts_lock = threading.Lock()
+_reads = _ReadCounters()
+
+def io_counters():
+    """(records read, segment bytes read, rows served from the buffer pool) by the calling thread so far."""
+    return tuple(_reads.counts)
+
+def _collect_metrics():
+    """Storage reads of all threads and buffer pool stats, for core.metrics scrapes."""
+    with _read_counts_lock:
+        records, nbytes, pooled = (sum(column) for column in zip(_retired_reads, *_read_counts.values()))
+    stats = buffer_pool.stats()
+    lookups = stats["hits"] + stats["misses"]
+    return [
+        (metrics.ROWS_SCANNED, ('segment',), records),
+        (metrics.ROWS_SCANNED, ('buffer_pool',), pooled),
+        (metrics.BYTES_READ, (), nbytes),
+        (metrics.BUFFER_POOL_LOOKUPS, ('hit',), stats["hits"]),
+        (metrics.BUFFER_POOL_LOOKUPS, ('miss',), stats["misses"]),
+        (metrics.BUFFER_POOL_HIT_RATIO, (), stats["hits"] / lookups if lookups else 0.0),
+        (metrics.BUFFER_POOL_EVICTIONS, (), stats["evictions"]),
+        (metrics.BUFFER_POOL_BYTES, ('used',), stats["used_bytes"]),
+        (metrics.BUFFER_POOL_BYTES, ('budget',), stats["budget_bytes"]),
+    ]
+
+metrics.register_collector(_collect_metrics)
+
+def configure_buffer_pool(budget_bytes):
+    """Sets the buffer pool's memory budget, evicting cached tables that no longer fit."""
+    buffer_pool.resize(budget_bytes)
+
+
+def list_databases():
+    """Names of the database directories under BASE_DATA_DIR."""
+    if not os.path.exists(BASE_DATA_DIR):
+        return []
+    return [d for d in os.listdir(BASE_DATA_DIR)
+            if os.path.isdir(os.path.join(BASE_DATA_DIR, d))]
+
 def ensure_db_dir(db_name):
     """Creates the specific database directory and its metadata file."""
     db_path = os.path.join(BASE_DATA_DIR, db_name)
     if not os.path.exists(db_path):
         os.makedirs(db_path)
-    
+
     metadata_path = os.path.join(db_path, 'metadata.json')
     if not os.path.exists(metadata_path):
         with open(metadata_path, 'w') as f:
             json.dump({}, f)
     return db_path
 
+def _atomic_write_json(path, payload, indent=4):
+    """Writes JSON to a temp file and renames it over path, so readers never see a torn file."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, indent=indent)
+        f.flush()
+        metrics.fsync(f.fileno(), 'metadata')
+    os.replace(tmp_path, path)
+
+def load_metadata(db_name):
+    """Reads data/{db_name}/metadata.json (empty dict if missing or corrupt)."""
+    metadata_file = os.path.join(BASE_DATA_DIR, db_name, 'metadata.json')
+    try:
+        with open(metadata_file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_metadata(db_name, metadata):
+    """Atomically replaces data/{db_name}/metadata.json."""
+    db_path = ensure_db_dir(db_name)
+    _atomic_write_json(os.path.join(db_path, 'metadata.json'), metadata)
+
 def save_schema(db_name, schema_dict):
     """Saves a table definition to the specific database's metadata.json."""
-    db_path = ensure_db_dir(db_name)
-    metadata_file = os.path.join(db_path, 'metadata.json')
-    
-    with open(metadata_file, 'r') as f:
-        metadata = json.load(f)
-    
+    metadata = load_metadata(db_name)
     metadata[schema_dict['name']] = schema_dict
-    
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata, f, indent=4)
+    save_metadata(db_name, metadata)
+
+# --- SEGMENTED TABLE LOG ---
+
+def _table_dir(db_name, table_name):
+    return os.path.join(BASE_DATA_DIR, db_name, table_name)
+
+def _segment_path(table_dir, seg_no):
+    return os.path.join(table_dir, f"{seg_no:06d}{SEGMENT_EXT}")
+
+def _units(chunks):
+    """
+    Yields (bytes, slot count) for the records of one write: plain records
+    with count None, and runs of at least BLOCK_MIN_ROWS compressed into
+    blocks where that saves space.
+    """
+    if not BLOCK_COMPRESSION or len(chunks) < BLOCK_MIN_ROWS:
+        for chunk in chunks:
+            yield chunk, None
+        return
+    for start in range(0, len(chunks), BLOCK_ROWS):
+        run = chunks[start:start + BLOCK_ROWS]
+        raw = b''.join(run)
+        packed = zlib.compress(_block_index(run) + raw, BLOCK_LEVEL) if len(run) >= BLOCK_MIN_ROWS else raw
+        if len(packed) + _ENTRY.size < len(raw):
+            yield _ENTRY.pack(_BLOCK, len(packed), len(run)) + packed, len(run)
+        else:
+            for chunk in run:
+                yield chunk, None
+
+def _frame(chunks, offset):
+    """
+    Lays encoded records out from segment offset onwards, padding to the next
+    page where one would cross a page boundary. Returns the bytes, each
+    record's locator position and the offset after them.
+    """
+    parts, positions = [], []
+    for unit, count in _units(chunks):
+        room = PAGE_SIZE - offset % PAGE_SIZE
+        if len(unit) > room and room < PAGE_SIZE:
+            parts.append(bytes(room) if room < _ENTRY.size else
+                         _ENTRY.pack(_PAD, room - _ENTRY.size, 0) + bytes(room - _ENTRY.size))
+            offset += room
+        if count is None:
+            positions.append(offset << SLOT_BITS)
+        else:
+            positions.extend(offset << SLOT_BITS | slot for slot in range(count))
+        parts.append(unit)
+        offset += len(unit)
+    return b''.join(parts), positions, offset
+
+def _block_index(run):
+    """A block starts with the offset of each of its records, so any one is found in O(1)."""
+    offsets, offset = [], 4 * len(run)
+    for chunk in run:
+        offsets.append(offset)
+        offset += len(chunk)
+    return struct.pack('<%dI' % len(run), *offsets)
+
+def _block_record(raw, slot):
+    """(rid, kind, start, end) of the record at slot of a decompressed block."""
+    start = _SLOT_OFFSET.unpack_from(raw, 4 * slot)[0]
+    kind, length, rid = _ENTRY.unpack_from(raw, start)
+    start += _ENTRY.size
+    return rid, kind, start, start + length
+
+def _segment_entries(buf, offset, paged=True):
+    """
+    Yields (position, end offset, rid, kind, buffer, start, end) for the
+    records of a mapped segment from offset on, the body being
+    buffer[start:end] (a decompressed block for records in one). Stops at a
+    torn record at the tail. paged=False reads the format before pages.
+    """
+    size, file_size = _ENTRY.size, len(buf)
+    while True:
+        if paged and PAGE_SIZE - offset % PAGE_SIZE < size:
+            offset += PAGE_SIZE - offset % PAGE_SIZE  # Zero padding
+        if offset + size > file_size:
+            return
+        kind, length, rid = _ENTRY.unpack_from(buf, offset)
+        end = offset + size + length
+        if end > file_size:
+            return
+        if kind == _BLOCK:
+            try:
+                raw = zlib.decompress(memoryview(buf)[offset + size:end])
+            except zlib.error:
+                return
+            for slot in range(rid):
+                rid, kind, start, stop = _block_record(raw, slot)
+                yield offset << SLOT_BITS | slot, end, rid, kind, raw, start, stop
+        elif kind != _PAD:
+            yield offset << SLOT_BITS, end, rid, kind, buf, offset + size, end
+        offset = end
+
+def _map_segment(path, need=0):
+    """
+    A read-only memory map of a segment file covering at least its first
+    need bytes. Maps are shared and cached; one is replaced by a fresh map
+    once the file has grown past it.
+    """
+    with _maps_lock:
+        buf = _maps.get(path)
+        if buf is not None and len(buf) >= need:
+            _maps.move_to_end(path)
+            return buf
+        with open(path, 'rb') as f:
+            buf = _maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _maps.move_to_end(path)
+        while len(_maps) > MAPPED_SEGMENTS:
+            _maps.popitem(last=False)  # Readers still holding it keep it open
+        return buf
+
+def _unmap(path_prefix):
+    """Forgets the maps of segments under a path, before they are removed or truncated."""
+    with _maps_lock:
+        for path in [p for p in _maps if p.startswith(path_prefix)]:
+            del _maps[path]
+
+def _read_at(path, offset):
+    """(kind, buffer, start, end) of the record at offset of a segment; a block's is decompressed."""
+    buf = _map_segment(path, offset + _ENTRY.size)
+    kind, length, _ = _ENTRY.unpack_from(buf, offset)
+    start = offset + _ENTRY.size
+    if start + length > len(buf):
+        buf = _map_segment(path, start + length)
+    _reads.counts[1] += _ENTRY.size + length
+    if kind == _BLOCK:
+        raw = zlib.decompress(memoryview(buf)[start:start + length])
+        return kind, raw, 0, len(raw)
+    return kind, buf, start, start + length
+
+def _segment_format(path):
+    """'json' for a segment of JSON lines ([rid, row] per line), 'unpaged' for the first binary format, else None."""
+    with open(path, 'rb') as f:
+        head = f.read(len(SEGMENT_MAGIC))
+    if head[:1] == b'[':
+        return 'json'
+    return 'unpaged' if head == _UNPAGED_MAGIC else None
+
+
+class _TableLog:
+    """Row locator and write cursor for one table's segment files."""
+
+    def __init__(self, table_dir, key=None, columns=None):
+        self.table_dir = table_dir
+        self.key = key       # (db_name, table_name) in the buffer pool; None keeps the log uncached
+        self.segments = []   # Sorted segment numbers
+        self.locator = {}    # {rid: (seg_no, byte_offset)} for live rows
+        self.next_rid = 0
+        self.dead = 0        # Superseded or deleted records still on disk
+        self.tail_size = 0   # Byte size of the newest segment
+        self.unsynced = set()  # Segments appended to since the last fsync
+        self.lock = threading.RLock()
+        # (epoch, counter) identifies the table contents: the counter moves on
+        # every write and a full rebuild starts a new epoch. Persisted index
+        # snapshots are only trusted when their version matches exactly.
+        self.epoch = None
+        self.version = 0
+        self.dirty = False   # Locator changed since the last snapshot
+        # Snapshot readers share the locator; writers copy it first (_own_locator)
+        self._shared = False
+        self.pins = 0        # Open snapshots that may still read the segment files
+        self.retired = []    # Segments replaced by a rewrite, removed once unpinned
+        # row -> row for records stored under an older table schema (see
+        # TableSchema.upgrade); None while every record is current
+        self.upgrade = None
+        self.layout = _layouts.get(key)  # RowLayout for rows kept in the buffer pool (None: plain dicts)
+        # Every codec reads its own records; new ones are written by ROW_CODEC,
+        # falling back to JSON for rows it cannot encode
+        self.codecs = {codec.kind: codec(table_dir) for codec in ROW_CODECS.values()}
+        self.writer = self.codecs[ROW_CODECS[ROW_CODEC].kind]
+        self.fallback = self.codecs[JsonRowCodec.kind]
+        columns = _column_types.get(key) if columns is None else columns
+        if columns is not None:
+            self.use_layout(self.layout, columns)
+        self._block = (None, None, None)  # (seg_no, offset, bytes) of the block a point read last decompressed
+        _unmap(os.path.join(table_dir, ''))  # Maps of files an earlier log may have replaced
+        if os.path.isdir(table_dir):
+            self.segments = self._list_segments()
+        if any(_segment_format(_segment_path(table_dir, seg_no)) for seg_no in self.segments):
+            self._convert_legacy()
+        elif not self._load_snapshot():
+            self._replay(0, 0)
+            self.epoch = uuid.uuid4().hex
+            self.dirty = bool(self.segments)
+
+    def use_layout(self, layout, columns):
+        """Packs pooled rows by layout and encodes new records by columns ({column: type})."""
+        self.layout = layout
+        for codec in self.codecs.values():
+            codec.use(layout, columns)
+
+    def _list_segments(self):
+        return sorted(
+            int(f[:-len(SEGMENT_EXT)]) for f in os.listdir(self.table_dir)
+            if f.endswith(SEGMENT_EXT)
+        )
+
+    def _tail_checksum(self, seg_no, size):
+        """CRC of the bytes just before a log position, to detect a reused position."""
+        path = _segment_path(self.table_dir, seg_no)
+        start = max(0, size - SNAPSHOT_CRC_BYTES)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return zlib.crc32(f.read(size - start))
+
+    def _load_snapshot(self):
+        """Restores the locator from locator.json, then replays only the records after it."""
+        try:
+            with open(os.path.join(self.table_dir, LOCATOR_FILE), 'r') as f:
+                snap = json.load(f)
+            seg_no, size = snap['position']
+            if self.segments[:len(snap['segments'])] != snap['segments'] or \
+                    os.path.getsize(_segment_path(self.table_dir, seg_no)) < size or \
+                    self._tail_checksum(seg_no, size) != snap['crc']:
+                return False
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return False
+
+        self.locator = dict(zip(snap['rids'], zip(snap['segs'], snap['positions'])))
+        self.next_rid = snap['next_rid']
+        self.dead = snap['dead']
+        self.epoch = snap['epoch']
+        self.version = snap['version']
+        caught_up = self._replay(seg_no, size)
+        if caught_up:
+            # Records written after the snapshot (e.g. redone from the WAL)
+            self.version += caught_up
+            self.dirty = True
+        return True
+
+    def _replay(self, from_seg, from_offset):
+        """Applies record headers from (from_seg, from_offset) onwards to the locator."""
+        replayed = 0
+        for seg_no in self.segments:
+            if seg_no < from_seg:
+                continue
+            path = _segment_path(self.table_dir, seg_no)
+            offset = from_offset if seg_no == from_seg else 0
+            file_size = os.path.getsize(path)
+            buf = _map_segment(path, file_size) if file_size else b''
+            if offset == 0 and buf[:len(SEGMENT_MAGIC)] == SEGMENT_MAGIC:
+                offset = len(SEGMENT_MAGIC)
+            if offset:
+                for pos, end, rid, kind, *_ in _segment_entries(buf, offset):
+                    if rid in self.locator:
+                        self.dead += 1  # Older version superseded or tombstoned
+                    if kind == _TOMBSTONE:
+                        self.locator.pop(rid, None)
+                        self.dead += 1
+                    else:
+                        self.locator[rid] = (seg_no, pos)
+                    self.next_rid = max(self.next_rid, rid + 1)
+                    offset = end
+                    replayed += 1
+            buf = None
+            if file_size != offset or not offset:
+                # Discard a torn trailing record (or segment header) so later appends stay aligned
+                _unmap(path)
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+                    if not offset:
+                        f.write(SEGMENT_MAGIC)
+                        offset = len(SEGMENT_MAGIC)
+            self.tail_size = offset
+        return replayed
+
+    def _convert_legacy(self):
+        """Rewrites segments of an older format, and any written after them, into the current one."""
+        rows = {}
+        for seg_no in self.segments:
+            path = _segment_path(self.table_dir, seg_no)
+            segment_format = _segment_format(path)
+            if segment_format == 'json':
+                with open(path, 'rb') as f:
+                    records = [json.loads(line) for line in f if line.endswith(b'\n')]
+            elif os.path.getsize(path) > len(SEGMENT_MAGIC):
+                entries = _segment_entries(_map_segment(path), len(SEGMENT_MAGIC), paged=segment_format is None)
+                records = [(rid, None if kind == _TOMBSTONE else self.codecs[kind].decode(buf, start, end))
+                           for _, _, rid, kind, buf, start, end in entries]
+            else:
+                records = []
+            for rid, row in records:
+                self.next_rid = max(self.next_rid, rid + 1)
+                if row is None:
+                    rows.pop(rid, None)
+                else:
+                    rows[rid] = row
+        self.epoch = uuid.uuid4().hex
+        self.rewrite(list(rows.items()))
+
+    def save_snapshot(self):
+        """Persists the locator (call only once the segments are fsynced)."""
+        with self.lock:
+            if not self.dirty or not self.segments:
+                return
+            rids = list(self.locator)
+            locs = list(self.locator.values())
+            _atomic_write_json(os.path.join(self.table_dir, LOCATOR_FILE), {
+                "segments": self.segments,
+                "position": [self.segments[-1], self.tail_size],
+                "crc": self._tail_checksum(self.segments[-1], self.tail_size),
+                "epoch": self.epoch,
+                "version": self.version,
+                "next_rid": self.next_rid,
+                "dead": self.dead,
+                "rids": rids,
+                "segs": [loc[0] for loc in locs],
+                "positions": [loc[1] for loc in locs],
+            }, indent=None)
+            self.dirty = False
+
+    def _append(self, chunks):
+        """
+        Appends encoded records to the newest segment, rolling over when full.
+        Returns the segment number and each record's locator position.
+        """
+        header = b''
+        if not self.segments or self.tail_size >= SEGMENT_MAX_BYTES:
+            os.makedirs(self.table_dir, exist_ok=True)
+            self.segments.append(self.segments[-1] + 1 if self.segments else 1)
+            header, self.tail_size = SEGMENT_MAGIC, 0
+        seg_no = self.segments[-1]
+        payload, positions, end = _frame(chunks, self.tail_size + len(header))
+        with open(_segment_path(self.table_dir, seg_no), 'ab') as f:
+            f.write(header + payload)
+        metrics.BYTES_WRITTEN.inc(('segment',), len(header) + len(payload))
+        self.unsynced.add(seg_no)
+        self.tail_size = end
+        return seg_no, positions
+
+    def _encode(self, rid, row):
+        """One record: a put of row, or a tombstone for None."""
+        if row is None:
+            return _ENTRY.pack(_TOMBSTONE, 0, rid)
+        codec = self.writer
+        body = codec.encode(row)
+        if body is None:
+            codec = self.fallback
+            body = codec.encode(row)
+        return _ENTRY.pack(codec.kind, len(body), rid) + body
+
+    def _read(self, loc):
+        """Decodes the record at a locator entry (seg_no, position)."""
+        seg_no, pos = loc
+        offset = pos >> SLOT_BITS
+        _reads.counts[0] += 1
+        block_seg, block_offset, raw = self._block
+        if block_seg != seg_no or block_offset != offset:
+            kind, buf, start, end = _read_at(_segment_path(self.table_dir, seg_no), offset)
+            if kind != _BLOCK:
+                return self.codecs[kind].decode(buf, start, end)
+            raw = buf
+            self._block = (seg_no, offset, raw)
+        _, kind, start, end = _block_record(raw, pos & _SLOT_MASK)
+        return self.codecs[kind].decode(raw, start, end)
+
+    def allocate_rid(self):
+        with self.lock:
+            rid = self.next_rid
+            self.next_rid += 1
+            return rid
+
+    def _cache_version(self):
+        return (self.epoch, self.version)
+
+    def put(self, rows_by_rid):
+        """Writes row versions for the given ids in one append."""
+        rows_by_rid = list(rows_by_rid)
+        chunks = [(rid, self._encode(rid, row)) for rid, row in rows_by_rid]
+        seg_no, positions = self._append([chunk for _, chunk in chunks])
+        old_version = self._cache_version()
+        self.version += len(chunks)
+        self.dirty = True
+        if self.key is not None:
+            buffer_pool.apply(self.key, old_version, self._cache_version(),
+                              puts=[(rid, _pack(self.layout, row), len(chunk))
+                                    for (rid, row), (_, chunk) in zip(rows_by_rid, chunks)])
+        self._own_locator()
+        for (rid, _), pos in zip(chunks, positions):
+            if rid in self.locator:
+                self.dead += 1
+            self.locator[rid] = (seg_no, pos)
+            self.next_rid = max(self.next_rid, rid + 1)
+
+    def delete(self, rids):
+        """Appends tombstones for the given live row ids."""
+        rids = [rid for rid in rids if rid in self.locator]
+        if not rids:
+            return 0
+        self._append([self._encode(rid, None) for rid in rids])
+        old_version = self._cache_version()
+        self.version += len(rids)
+        self.dirty = True
+        if self.key is not None:
+            buffer_pool.apply(self.key, old_version, self._cache_version(), deletes=rids)
+        self._own_locator()
+        for rid in rids:
+            del self.locator[rid]
+        self.dead += 2 * len(rids)  # The old version and its tombstone
+        return len(rids)
+
+    def read(self, rid, raw=False):
+        """Decodes a single live row by seeking straight to its record (raw=True: as stored, not upgraded)."""
+        with self.lock:
+            loc = self.locator.get(rid)
+            if loc is None:
+                return None
+            cached = buffer_pool.get(self.key, self._cache_version(), lend=False) if self.key is not None else None
+            if cached is not None and rid in cached:
+                row = _unpack(self.layout, cached[rid])
+                _reads.counts[2] += 1
+            else:
+                row = self._read(loc)
+            return row if raw or self.upgrade is None else self.upgrade(row)
+
+    def snapshot(self):
+        """Captures the table's current rows as a TableSnapshot."""
+        with self.lock:
+            version = self._cache_version()
+            cached = buffer_pool.get(self.key, version) if self.key is not None else None
+            if cached is not None:
+                return TableSnapshot(self, version, None, cached, self.upgrade, self.layout)
+            self._shared = True
+            self.pins += 1
+            return TableSnapshot(self, version, self.locator, None, self.upgrade, self.layout)
+
+    def _own_locator(self):
+        """Copy-on-write: gives the log a private locator before it changes a shared one."""
+        if self._shared:
+            self.locator = dict(self.locator)
+            self._shared = False
+
+    def _unpin(self):
+        with self.lock:
+            self.pins -= 1
+            if not self.pins:
+                for seg_no in self.retired:
+                    _unmap(_segment_path(self.table_dir, seg_no))
+                    try:
+                        os.remove(_segment_path(self.table_dir, seg_no))
+                    except FileNotFoundError:
+                        pass
+                self.retired = []
+
+    def scan(self, after_rid=None, columns=None, predicate=None, equals=None):
+        """Scans a snapshot taken when iteration starts (see TableSnapshot.scan)."""
+        snap = self.snapshot()
+        try:
+            yield from snap.scan(after_rid, columns, predicate, equals)
+        finally:
+            snap.close()
+
+    def _estimated_bytes(self):
+        """Upper bound of what caching the table would charge (segments include dead records)."""
+        on_disk = sum(os.path.getsize(_segment_path(self.table_dir, seg_no)) for seg_no in self.segments)
+        return on_disk + len(self.locator) * buffer_pool.charge(0)
+
+    def rewrite(self, rows_by_rid, same_rows=False):
+        """
+        Writes the given rows into a fresh segment and retires the old ones.
+        same_rows=True (compaction) keeps the table's buffer pool entry.
+        """
+        old_version = self._cache_version()
+        old_segments = self.segments
+        new_seg = (old_segments[-1] + 1) if old_segments else 1
+        os.makedirs(self.table_dir, exist_ok=True)
+        locator, offset = {}, len(SEGMENT_MAGIC)
+        path = _segment_path(self.table_dir, new_seg)
+        _unmap(path)
+        def write(run):
+            payload, positions, end = _frame([self._encode(rid, row) for rid, row in run], offset)
+            f.write(payload)
+            metrics.BYTES_WRITTEN.inc(('segment',), len(payload))
+            for (rid, _), pos in zip(run, positions):
+                locator[rid] = (new_seg, pos)
+                self.next_rid = max(self.next_rid, rid + 1)
+            return end
+        with open(path, 'wb') as f:
+            f.write(SEGMENT_MAGIC)
+            run = []
+            for item in rows_by_rid:
+                run.append(item)
+                if len(run) == BLOCK_ROWS:
+                    offset, run = write(run), []
+            offset = write(run)
+            f.flush()
+            metrics.fsync(f.fileno(), 'segment')
+        # Old segments are only removed once the replacement is complete;
+        # replaying old + new segments still yields the same live rows.
+        # Open snapshots may still read them: removal then waits for _unpin.
+        if self.pins:
+            self.retired.extend(old_segments)
+        else:
+            for seg_no in old_segments:
+                _unmap(_segment_path(self.table_dir, seg_no))
+                os.remove(_segment_path(self.table_dir, seg_no))
+        self.unsynced.clear()
+        self.version += 1
+        self.dirty = True
+        if self.key is not None:
+            if same_rows:
+                buffer_pool.apply(self.key, old_version, self._cache_version())
+            else:
+                buffer_pool.invalidate(self.key)
+        self.segments = [new_seg]
+        self.locator = locator
+        self._shared = False
+        self.tail_size = offset
+        self.dead = 0
+
+    def sync(self):
+        """Fsyncs every segment written since the last sync."""
+        with self.lock:
+            for seg_no in self.unsynced:
+                path = _segment_path(self.table_dir, seg_no)
+                if os.path.exists(path):
+                    with open(path, 'ab') as f:
+                        metrics.fsync(f.fileno(), 'segment')
+            self.unsynced.clear()
+
+    def maybe_compact(self):
+        """Reclaims dead records once they outnumber the live rows."""
+        if self.dead >= COMPACT_MIN_DEAD and self.dead > len(self.locator):
+            self.rewrite(list(self.scan()), same_rows=True)
+
+    def records(self):
+        """
+        Yields every record of the segments in log order, superseded versions
+        and tombstones included, as (seg_no, position, rid, codec name, row or None).
+        """
+        with self.lock:
+            segments = list(self.segments)
+            self.pins += 1  # Keeps a concurrent rewrite from removing them
+        try:
+            for seg_no in segments:
+                buf = _map_segment(_segment_path(self.table_dir, seg_no))
+                for pos, _, rid, kind, buf, start, end in _segment_entries(buf, len(SEGMENT_MAGIC)):
+                    if kind == _TOMBSTONE:
+                        yield seg_no, pos, rid, None, None
+                    else:
+                        yield seg_no, pos, rid, self.codecs[kind].name, self.codecs[kind].decode(buf, start, end)
+        finally:
+            self._unpin()
+
+
+def _pack(layout, row):
+    """A buffer pool copy of a row: packed by the table's layout, if it has one."""
+    return dict(row) if layout is None else layout.pack(row)
+
+def _unpack(layout, packed):
+    return dict(packed) if layout is None else layout.unpack(packed)
+
+
+
+class TableSnapshot:
+    """
+    A table's live rows as of one moment, readable without any lock while
+    writers carry on (snapshot isolation). Taking one is O(1): it shares the
+    log's locator, or the buffer pool's row dict, and both are copied by the
+    next writer instead of being changed in place. Segments are append-only,
+    so every record the shared locator points at stays where it is, and a
+    rewrite keeps the old segment files until the last snapshot is closed.
+    """
+
+    def __init__(self, log, version, locator, cached, upgrade=None, layout=None):
+        self.log = log
+        self.version = version
+        self.locator = locator  # {rid: (seg_no, offset)}, or None when served from the pool
+        self.cached = cached    # {rid: row} from the buffer pool, or None
+        self.upgrade = upgrade  # Applied to every row read (rows of an older schema), or None
+        self.layout = layout    # RowLayout of the pool's packed rows, or None
+        self._pinned = locator is not None
+
+    def close(self):
+        """Releases the snapshot's hold on the segment files (idempotent)."""
+        if self._pinned:
+            self._pinned = False
+            self.log._unpin()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, rid):
+        """Decodes the row stored under rid as of the snapshot, or None."""
+        if self.cached is not None:
+            row = self.cached.get(rid)
+            row = None if row is None else _unpack(self.layout, row)
+            _reads.counts[2] += 1
+        else:
+            loc = self.locator.get(rid)
+            row = None if loc is None else self.log._read(loc)
+        return row if row is None or self.upgrade is None else self.upgrade(row)
+
+    def scan(self, after_rid=None, columns=None, predicate=None, equals=None):
+        """
+        Yields (rid, row) for live rows in insertion order or, given after_rid,
+        for the rows with a larger rid in rid order (keyset pagination).
+        Rows are read lazily, so a caller that stops early decodes nothing more.
+
+        Rows failing predicate(row) are dropped and the rest are cut down to
+        'columns' before they are yielded. equals ({col: value}) are equalities
+        the predicate implies: records whose raw bytes cannot contain them are
+        skipped without being decoded at all.
+
+        Tables held in the buffer pool are served from memory. A complete scan
+        that decodes every record caches the table if it fits the pool and
+        nothing was written meanwhile. The pool keeps records as stored
+        (packed by the table's RowLayout); rows of an older schema are
+        upgraded as they are read. The predicate only reads rows through
+        get(), so cached rows and binary records are tested as value tuples
+        and only the rows that pass are turned into dicts.
+        """
+        log, cached, upgrade, layout = self.log, self.cached, self.upgrade, self.layout
+        reads = _reads.counts
+        if cached is not None:
+            if after_rid is None:
+                entries = cached.items()  # Lent by the pool: never changes under us
+            else:
+                entries = sorted(item for item in cached.items() if item[0] > after_rid)
+            if layout is None or upgrade is not None:
+                for rid, row in entries:
+                    reads[2] += 1
+                    row = _unpack(layout, row)
+                    if upgrade is not None:
+                        row = upgrade(row)
+                    if predicate is not None and not predicate(row):
+                        continue
+                    yield rid, (row if columns is None else {col: row.get(col) for col in columns})
+                return
+            view, build = layout.view(), layout.builder(columns)
+            for rid, row in entries:
+                reads[2] += 1
+                if type(row) is tuple:
+                    view.values = row
+                    if predicate is None or predicate(view):
+                        yield rid, build(row)
+                elif predicate is None or predicate(row):
+                    yield rid, (dict(row) if columns is None else {col: row.get(col) for col in columns})
+            return
+
+        # Upgraded rows may hold values their records lack (column defaults)
+        prefilters = {}
+        if equals and upgrade is None:
+            prefilters = {kind: codec.prefilter(equals) for kind, codec in log.codecs.items()}
+            prefilters = {kind: test for kind, test in prefilters.items() if test is not None}
+        if after_rid is None:
+            entries = self.locator.items()  # Never changes: writers copy it first
+        else:
+            # Keys only; the locator is almost rid-sorted already, so this is ~linear
+            entries = sorted(item for item in self.locator.items() if item[0] > after_rid)
+        fill = None
+        if log.key is not None and after_rid is None and not prefilters:
+            with log.lock:
+                if log._cache_version() == self.version and log.layout is layout \
+                        and buffer_pool.fits(log._estimated_bytes()):
+                    fill, sizes, filled = {}, {}, 0  # Decoding everything anyway: collect the rows for the pool
+        codecs = log.codecs
+        binary = codecs.get(BinaryRowCodec.kind)
+        access = {}  # {RowLayout: (RowView, builder)} of the binary formats met so far
+        maps = {}  # {seg_no: memory map}, looked up once per segment
+        entry_size, unpack_entry = _ENTRY.size, _ENTRY.unpack_from
+        block_seg = block_offset = block = None  # The block last decompressed
+        try:
+            # Records are decoded straight from the mapped segment (or block)
+            for rid, (seg_no, pos) in entries:
+                reads[0] += 1
+                offset = pos >> SLOT_BITS
+                if offset == block_offset and seg_no == block_seg:
+                    _, kind, start, end = _block_record(block, pos & _SLOT_MASK)
+                    buf = block
+                else:
+                    buf = maps.get(seg_no)
+                    if buf is None or offset + entry_size > len(buf):
+                        buf = maps[seg_no] = _map_segment(_segment_path(log.table_dir, seg_no), offset + entry_size)
+                    kind, length, _ = unpack_entry(buf, offset)
+                    start = offset + entry_size
+                    end = start + length
+                    if end > len(buf):
+                        buf = maps[seg_no] = _map_segment(_segment_path(log.table_dir, seg_no), end)
+                    reads[1] += end - offset
+                    if kind == _BLOCK:
+                        block = zlib.decompress(memoryview(buf)[start:end])
+                        block_seg, block_offset, buf = seg_no, offset, block
+                        _, kind, start, end = _block_record(block, pos & _SLOT_MASK)
+                if prefilters and kind in prefilters and not prefilters[kind](buf, start, end):
+                    continue
+                if codecs[kind] is binary:
+                    # Binary records decode to a value tuple, which the pool keeps as it is
+                    fmt, values = binary.decode_values(buf, start)
+                    row, packed = None, values if fmt.layout is layout else None
+                else:
+                    row, packed = codecs[kind].decode(buf, start, end), None
+                if fill is not None:
+                    if packed is None:
+                        packed = _pack(layout, fmt.layout.builder()(values) if row is None else row)
+                    fill[rid] = packed
+                    sizes[rid] = size = buffer_pool.charge(entry_size + end - start, type(packed) is tuple)
+                    filled += size
+                    if not buffer_pool.fits(filled):
+                        fill = None  # Compressed segments understate the table's size
+                if row is None and upgrade is None:
+                    # The predicate reads the value tuple through a view: only matching rows become dicts
+                    view, build = access.get(fmt.layout) or \
+                        access.setdefault(fmt.layout, (fmt.layout.view(), fmt.layout.builder(columns)))
+                    if predicate is not None:
+                        view.values = values
+                        if not predicate(view):
+                            continue
+                    yield rid, build(values)
+                    continue
+                if row is None:
+                    row = fmt.layout.builder()(values)
+                if upgrade is not None:
+                    row = upgrade(row)
+                if predicate is not None and not predicate(row):
+                    continue
+                if columns is not None:
+                    yield rid, {col: row.get(col) for col in columns}
+                else:
+                    yield rid, row  # The pool keeps its own copy
+        finally:
+            maps.clear()
+        if fill is not None:
+            with log.lock:
+                if log._cache_version() == self.version and log.layout is layout:
+                    buffer_pool.put(log.key, self.version, fill, sizes)
+
+
+def _open_table(db_name, table_name):
+    key = (db_name, table_name)
+    with _open_lock:
+        log = _open_tables.get(key)
+        if log is None:
+            log = _open_tables[key] = _TableLog(_table_dir(db_name, table_name), key)
+    return log
+
+def close_database(db_name):
+    """Forgets the cached table logs of a database (e.g. after it is dropped)."""
+    with _open_lock:
+        for key in [k for k in _open_tables if k[0] == db_name]:
+            del _open_tables[key]
+    buffer_pool.invalidate_database(db_name)
+    _unmap(os.path.join(BASE_DATA_DIR, db_name, ''))
+
+def migrate_legacy_table(db_name, table_name):
+    """Converts a pre-segment data/{db}/{table}.json file into the segment layout."""
+    legacy_file = os.path.join(BASE_DATA_DIR, db_name, f"{table_name}.json")
+    if not os.path.exists(legacy_file):
+        return False
+    table_dir = _table_dir(db_name, table_name)
+    if not os.path.isdir(table_dir):
+        with open(legacy_file, 'r') as f:
+            rows = json.load(f)
+        # Build the log beside the table then swap it in, so a crash
+        # mid-migration leaves the legacy file as the source of truth.
+        staging_dir = table_dir + '.migrating'
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        _TableLog(staging_dir, columns=_column_types.get((db_name, table_name))).rewrite(list(enumerate(rows)))
+        os.rename(staging_dir, table_dir)
+    os.remove(legacy_file)
+    with _open_lock:
+        _open_tables.pop((db_name, table_name), None)
+    return True
+
+def allocate_rid(db_name, table_name):
+    """Reserves the next row id of a table."""
+    return _open_table(db_name, table_name).allocate_rid()
+
+def apply_ops(db_name, ops):
+    """
+    Applies logged row operations [table, rid, row] to the segments.
+    A row of None is a delete. Ops are blind writes keyed by rid, so
+    re-applying a WAL suffix during recovery is idempotent.
+    """
+    by_table = {}
+    for table_name, rid, row in ops:
+        by_table.setdefault(table_name, []).append((rid, row))
+    for table_name, entries in by_table.items():
+        log = _open_table(db_name, table_name)
+        with log.lock:
+            # Consecutive puts share one append; tombstones break the run
+            run = []
+            for rid, row in entries:
+                if row is None:
+                    if run:
+                        log.put(run)
+                        run = []
+                    log.delete([rid])
+                else:
+                    run.append((rid, row))
+            if run:
+                log.put(run)
+            log.maybe_compact()
+
+def sync_database(db_name):
+    """Fsyncs pending segment appends of every open table, then snapshots their locators."""
+    with _open_lock:
+        logs = [log for (db, _), log in _open_tables.items() if db == db_name]
+    for log in logs:
+        log.sync()
+        log.save_snapshot()
+
+def table_version(db_name, table_name):
+    """Returns the [epoch, counter] pair identifying a table's current contents."""
+    log = _open_table(db_name, table_name)
+    return [log.epoch, log.version]
+
+def save_index_snapshot(db_name, table_name, version, indexes):
+    """Persists serialized index maps, tagged with the table version and a checksum."""
+    table_dir = _table_dir(db_name, table_name)
+    if not os.path.isdir(table_dir):
+        return
+    body = json.dumps(indexes, separators=(',', ':'))
+    _atomic_write_json(os.path.join(table_dir, INDEX_FILE), {
+        "version": version,
+        "checksum": zlib.crc32(body.encode('utf-8')),
+        "indexes": body,
+    }, indent=None)
+
+def load_index_snapshot(db_name, table_name):
+    """Returns persisted index maps if they match the table's current version, else None."""
+    path = os.path.join(_table_dir(db_name, table_name), INDEX_FILE)
+    try:
+        with open(path, 'r') as f:
+            snap = json.load(f)
+        if snap['version'] != table_version(db_name, table_name) or \
+                zlib.crc32(snap['indexes'].encode('utf-8')) != snap['checksum']:
+            return None
+        return json.loads(snap['indexes'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_column_snapshot(db_name, table_name, version, blob):
+    """Persists a serialized column store behind a JSON line holding the table version and a checksum."""
+    table_dir = _table_dir(db_name, table_name)
+    if not os.path.isdir(table_dir):
+        return
+    path = os.path.join(table_dir, COLUMNS_FILE)
+    header = json.dumps({"version": version, "checksum": zlib.crc32(blob)}).encode('utf-8')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(header + b'\n' + blob)
+        f.flush()
+        metrics.fsync(f.fileno(), 'metadata')
+    os.replace(path + '.tmp', path)
+
+def load_column_snapshot(db_name, table_name):
+    """Returns the persisted column store bytes if they match the table's current version, else None."""
+    path = os.path.join(_table_dir(db_name, table_name), COLUMNS_FILE)
+    try:
+        with open(path, 'rb') as f:
+            snap = json.loads(f.readline())
+            blob = f.read()
+        if snap['version'] != table_version(db_name, table_name) or zlib.crc32(blob) != snap['checksum']:
+            return None
+        return blob
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def read_row(db_name, table_name, rid, raw=False):
+    """Returns the live row stored under rid, or None (raw=True: as stored, before any schema upgrade)."""
+    return _open_table(db_name, table_name).read(rid, raw)
+
+def table_rids(db_name, table_name):
+    """Row ids of a table's live rows."""
+    log = _open_table(db_name, table_name)
+    with log.lock:
+        return list(log.locator)
+
+def set_row_layout(db_name, table_name, columns):
+    """
+    Sets the columns and types (TableSchema.columns) new records of a table
+    are encoded by, and the column order the buffer pool packs its rows by.
+    Rows cached under the previous layout are dropped.
+    """
+    key = (db_name, table_name)
+    columns = dict(columns)
+    if _column_types.get(key) == columns and list(_column_types[key]) == list(columns):
+        return
+    layout = RowLayout(columns)
+    _layouts[key], _column_types[key] = layout, columns
+    with _open_lock:
+        log = _open_tables.get(key)
+    if log is not None:
+        with log.lock:
+            log.use_layout(layout, columns)
+            buffer_pool.invalidate(key)
+
+def set_row_upgrade(db_name, table_name, upgrade):
+    """Installs (or, with None, removes) the function that brings rows of an older schema up to date on read."""
+    if upgrade is None:
+        with _open_lock:
+            if (db_name, table_name) not in _open_tables:
+                return  # Not loaded: nothing to clear
+    log = _open_table(db_name, table_name)
+    with log.lock:
+        log.upgrade = upgrade
+
+def snapshot_table(db_name, table_name):
+    """Returns a TableSnapshot of a table's current rows; close() it when done."""
+    return _open_table(db_name, table_name).snapshot()
+
+def scan_table(db_name, table_name, after_rid=None, columns=None, predicate=None, equals=None):
+    """
+    Yields (rid, row) pairs for every live row of a table (with rid > after_rid,
+    in rid order, if given). See _TableLog.scan for projection and filtering.
+    """
+    return _open_table(db_name, table_name).scan(after_rid, columns, predicate, equals)
+
+def table_records(db_name, table_name):
+    """Yields a table's raw segment records (see _TableLog.records), for debugging the on-disk format."""
+    return _open_table(db_name, table_name).records()
+
+def count_rows(db_name, table_name):
+    return len(_open_table(db_name, table_name).locator)
+
+def compact_table(db_name, table_name):
+    """Rewrites a table's live rows into a single fresh segment."""
+    log = _open_table(db_name, table_name)
+    with log.lock:
+        log.rewrite(list(log.scan()), same_rows=True)
+
+def drop_table_data(db_name, table_name):
+    """Removes a table's segment directory (and any legacy JSON file)."""
+    with _open_lock:
+        _open_tables.pop((db_name, table_name), None)
+    buffer_pool.invalidate((db_name, table_name))
+    _unmap(os.path.join(_table_dir(db_name, table_name), ''))
+    shutil.rmtree(_table_dir(db_name, table_name), ignore_errors=True)
+    legacy_file = os.path.join(BASE_DATA_DIR, db_name, f"{table_name}.json")
+    if os.path.exists(legacy_file):
+        os.remove(legacy_file)
+
+def rewrite_table(db_name, table_name, rows_by_rid):
+    """Replaces a table's segments with the given (rid, row) pairs."""
+    log = _open_table(db_name, table_name)
+    with log.lock:
+        log.rewrite(rows_by_rid)
 
 def save_table_data(db_name, table_name, rows):
-    """Saves rows to data/{db_name}/{table_name}.json."""
-    db_path = ensure_db_dir(db_name)
-    file_path = os.path.join(db_path, f"{table_name}.json")
-    with open(file_path, 'w') as f:
-        json.dump(rows, f, indent=4)
+    """Replaces the full contents of a table with the given rows."""
+    ensure_db_dir(db_name)
+    log = _open_table(db_name, table_name)
+    with log.lock:
+        log.rewrite(list(enumerate(rows, start=log.next_rid)))
 
 def load_table_data(db_name, table_name):
-    """Loads rows from data/{db_name}/{table_name}.json."""
-    file_path = os.path.join(BASE_DATA_DIR, db_name, f"{table_name}.json")
-    if not os.path.exists(file_path):
-        return []
-    with open(file_path, 'r') as f:
-        return json.load(f)
\ No newline at end of file
+    """Loads every live row of data/{db_name}/{table_name}/ as a list."""
+    return [row for _, row in scan_table(db_name, table_name)]
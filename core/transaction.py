@@ -0,0 +1,163 @@
+"""
+Explicit transactions (BEGIN / COMMIT / ROLLBACK).
+
+A Transaction buffers its row writes instead of logging them. Its own
+reads and constraint checks (PK/unique, foreign keys) see the committed
+rows overlaid with its pending ones; nobody else sees the pending rows.
+COMMIT re-checks write conflicts and constraints under the table latches,
+then logs every buffered write as one WAL record (one fsync) and applies
+it. ROLLBACK just drops the buffer.
+
+Conflicts are first-committer-wins: COMMIT fails, and the transaction is
+rolled back, if a row it changed was changed by another writer after it
+was read. Reads inside a transaction are not isolated from other commits.
+"""
+
+
+class Transaction:
+    """
+    The pending writes of one transaction. It also stands in for the engine
+    when the planner runs a statement inside the transaction, so its row
+    methods mirror DatabaseEngine's and pass themselves as txn.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.db_name = engine.active_db
+        self.started_version = engine.schema_version
+        self.writes = {}     # {table_name: {rid: row, or None for a delete}}
+        self.originals = {}  # {(table_name, rid): committed row when first written, None for an insert}
+        self._values = {}    # {(table_name, col): {value: {rid, ...}}} over pending rows, built on demand
+        self.active = True
+
+    # --- PENDING WRITES ---
+
+    def write(self, table_name, rid, row, original):
+        """Buffers row (None deletes) for rid; original is the committed row, kept from the first write."""
+        pending = self.writes.setdefault(table_name, {})
+        self.originals.setdefault((table_name, rid), original)
+        old = pending.get(rid)
+        pending[rid] = row
+        for (table, col), values in self._values.items():
+            if table != table_name:
+                continue
+            if old is not None:
+                values.get(old.get(col), set()).discard(rid)
+            if row is not None:
+                values.setdefault(row.get(col), set()).add(rid)
+
+    def pending(self, table_name):
+        """{rid: row or None} written to a table by this transaction."""
+        return self.writes.get(table_name, {})
+
+    def pending_rids(self, table_name, col, value):
+        """Row ids of this transaction's pending rows of a table whose col equals value."""
+        pending = self.writes.get(table_name)
+        if not pending:
+            return []
+        values = self._values.get((table_name, col))
+        if values is None:
+            values = self._values[(table_name, col)] = {}
+            for rid, row in pending.items():
+                if row is not None:
+                    values.setdefault(row.get(col), set()).add(rid)
+        return list(values.get(value, ()))
+
+    def _check_active(self):
+        if not self.active:
+            raise ValueError("The transaction has already ended.")
+        if self.engine.active_db != self.db_name:
+            raise ValueError("The database changed during the transaction; ROLLBACK and start again.")
+
+    # --- ENGINE FACADE ---
+
+    @property
+    def active_db(self):
+        return self.engine.active_db
+
+    @property
+    def schemas(self):
+        return self.engine.schemas
+
+    @property
+    def schema_version(self):
+        return self.engine.schema_version
+
+    @property
+    def profile(self):
+        return self.engine.profile
+
+    def profiling(self, profile):
+        return self.engine.profiling(profile)
+
+    def prepare(self, sql_text):
+        return self.engine.prepare(sql_text)
+
+    def execute(self, sql_text, params=()):
+        """Runs one SQL statement inside the transaction."""
+        return self.engine.prepare(sql_text).execute(self, params)
+
+    def insert(self, table_name, row_data, validate=True):
+        self._check_active()
+        return self.engine.insert(table_name, row_data, validate, txn=self)
+
+    def insert_many(self, table_name, rows, batch_size=None):
+        self._check_active()
+        return self.engine.insert_many(table_name, rows, txn=self)
+
+    def copy_from(self, table_name, path, file_format=None):
+        self._check_active()
+        return self.engine.copy_from(table_name, path, file_format, txn=self)
+
+    def update(self, table_name, pk_value, updated_fields):
+        self._check_active()
+        return self.engine.update(table_name, pk_value, updated_fields, txn=self)
+
+    def update_where(self, table_name, where, updated_fields, predicate=None):
+        self._check_active()
+        return self.engine.update_where(table_name, where, updated_fields, predicate, txn=self)
+
+    def delete(self, table_name, where, predicate=None):
+        self._check_active()
+        return self.engine.delete(table_name, where, predicate, txn=self)
+
+    def select(self, table_name, *args, **kwargs):
+        return list(self.iter_select(table_name, *args, **kwargs))
+
+    def iter_select(self, table_name, *args, **kwargs):
+        self._check_active()
+        return self.engine.iter_select(table_name, *args, txn=self, **kwargs)
+
+    def aggregate(self, table_name, aggregates, group_by=(), where=None):
+        self._check_active()
+        return self.engine.aggregate(table_name, aggregates, group_by, where, txn=self)
+
+    def join(self, table_a_name, table_b_name, join_col_a, join_col_b):
+        self._check_active()
+        return self.engine.join(table_a_name, table_b_name, join_col_a, join_col_b, txn=self)
+
+    def explain_access(self, table_name, where=None, order_by=None, descending=False, aggregating=False):
+        if self.pending(table_name):
+            return 'scan with pending rows'
+        return self.engine.explain_access(table_name, where, order_by, descending, aggregating)
+
+    def explain_join(self, table_a_name, table_b_name, join_col_a, join_col_b):
+        if self.pending(table_a_name) or self.pending(table_b_name):
+            return 'hash join over pending rows'
+        return self.engine.explain_join(table_a_name, table_b_name, join_col_a, join_col_b)
+
+    # --- END ---
+
+    def commit(self):
+        """Applies the pending writes as one durable commit; the transaction ends either way."""
+        self._check_active()
+        try:
+            return self.engine.commit_transaction(self)
+        finally:
+            self.rollback()
+
+    def rollback(self):
+        """Discards the pending writes."""
+        self.active = False
+        self.writes, self.originals, self._values = {}, {}, {}
+        return "Transaction rolled back."
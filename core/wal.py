@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+from core import metrics
+
+WAL_FILE = 'wal.log'
+WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024  # Log size that triggers a checkpoint
+
+
+class WriteAheadLog:
+    """
+    Per-database redo log at data/{db_name}/wal.log.
+
+    Every commit is a single JSON line {"lsn": n, "ops": [[table, rid, row], ...]}
+    where row is None for a delete. A commit only counts once its full line is
+    on disk, so a torn tail from a crash is ignored on replay and cut off.
+
+    Commits are grouped: threads that arrive while another thread is flushing
+    queue their lines, and the next leader writes the whole queue with one
+    fsync, waking every committer it covered.
+    """
+
+    def __init__(self, db_path, sync=True):
+        self.path = os.path.join(db_path, WAL_FILE)
+        self.sync = sync
+        self._cond = threading.Condition()
+        self._pending = []      # Encoded commit lines waiting for a flush
+        self._next_lsn = 1
+        self._flushed_lsn = 0
+        self._flushing = False
+        self._failed = None     # (last_lsn, exception) of a failed flush
+        self._unapplied = 0     # Durable commits not yet applied to the tables
+        self._broken = None     # Set when a failed batch could not be cut off the log
+        self._file = open(self.path, 'ab')
+        self.size = self._file.tell()
+
+    def replay(self):
+        """
+        Yields the op lists of every complete commit in log order, then cuts
+        the log back to the end of the last one so that new commits are not
+        appended behind a torn tail (which would hide them from the next replay).
+        """
+        end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Torn write from a crash: the commit never finished
+                try:
+                    commit = json.loads(line)
+                except ValueError:
+                    break
+                end += len(line)
+                self._next_lsn = max(self._next_lsn, commit['lsn'] + 1)
+                yield commit['ops']
+        self._flushed_lsn = self._next_lsn - 1
+        if end < self.size:
+            self._file.truncate(end)
+            if self.sync:
+                metrics.fsync(self._file.fileno(), 'wal')
+            self.size = end
+
+    def commit(self, ops):
+        """Durably logs one commit, sharing the fsync with concurrent committers."""
+        with self._cond:
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            line = json.dumps({"lsn": lsn, "ops": ops}, separators=(',', ':')) + '\n'
+            self._pending.append(line.encode('utf-8'))
+            self._unapplied += 1
+
+            while self._flushed_lsn < lsn:
+                if self._failed and lsn <= self._failed[0]:
+                    self._unapplied -= 1
+                    raise IOError(f"WAL write failed: {self._failed[1]}")
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+
+                # Become the group leader for everything queued so far
+                batch, self._pending = self._pending, []
+                last_lsn = self._next_lsn - 1
+                self._flushing = True
+                self._cond.release()
+                try:
+                    self._write(b''.join(batch))
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._cond.notify_all()
+                if error is not None:
+                    self._failed = (last_lsn, error)
+                    continue
+                self._flushed_lsn = last_lsn
+        return lsn
+
+    def _write(self, payload):
+        if self._broken is not None:
+            raise self._broken
+        try:
+            self._file.write(payload)
+            self._file.flush()
+            if self.sync:
+                metrics.fsync(self._file.fileno(), 'wal')
+        except Exception:
+            self._rollback()
+            raise
+        metrics.BYTES_WRITTEN.inc(('wal',), len(payload))
+        self.size += len(payload)
+
+    def _rollback(self):
+        """Cuts a failed batch off the log, so later commits do not follow a half-written one."""
+        try:
+            try:
+                self._file.close()  # Also drops whatever the failed flush left buffered
+            except OSError:
+                pass
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.size)
+            self._file = open(self.path, 'ab')
+        except OSError as e:
+            # The log may now end in a partial commit: refuse further commits
+            self._broken = e
+
+    def applied(self):
+        """Marks one committed op list as applied to the table segments."""
+        with self._cond:
+            self._unapplied -= 1
+            self._cond.notify_all()
+
+    def needs_checkpoint(self):
+        return self.size >= WAL_CHECKPOINT_BYTES
+
+    def checkpoint(self, flush_tables):
+        """Flushes table data via flush_tables() and then empties the log."""
+        with self._cond:
+            while self._unapplied or self._flushing or self._pending:
+                self._cond.wait()
+            flush_tables()
+            self._file.truncate(0)
+            self._file.seek(0)
+            if self.sync:
+                metrics.fsync(self._file.fileno(), 'wal')
+            self.size = 0
+            self._failed = None
+
+    def close(self):
+        with self._cond:
+            self._file.close()
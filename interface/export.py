@@ -0,0 +1,58 @@
+"""
+Dumps tables as JSON, for debugging the binary segment format.
+
+    python interface/export.py <db> [<table> ...] [--records]
+
+Writes NDJSON to stdout: by default one line per live row, exactly as
+SELECT returns it (the output loads back with COPY ... FORMAT NDJSON).
+--records instead dumps every record of the segments in log order, with
+superseded versions and tombstones, as
+{"table", "segment", "position", "rid", "codec", "row"}.
+"""
+import argparse
+import json
+import os
+import sys
+
+# 1. THE PATH FIX: Allows importing from the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import storage
+from core.engine import DatabaseEngine
+
+
+def export(db_name, tables=(), records=False, out=sys.stdout):
+    if db_name not in storage.list_databases():
+        raise ValueError(f"Database '{db_name}' not found.")
+    # 2. Opening the database redoes any WAL commits not yet in the segments
+    engine = DatabaseEngine()
+    engine.set_active_db(db_name)
+    try:
+        for table_name in tables or list(engine.schemas):
+            if table_name not in engine.schemas:
+                raise ValueError(f"Table '{table_name}' does not exist.")
+            if records:
+                for seg_no, pos, rid, codec, row in storage.table_records(db_name, table_name):
+                    out.write(json.dumps({"table": table_name, "segment": seg_no, "position": pos,
+                                          "rid": rid, "codec": codec, "row": row}) + '\n')
+            else:
+                for row in engine.iter_select(table_name):
+                    out.write(json.dumps(row) + '\n')
+    finally:
+        engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dump PesaDB tables as NDJSON.")
+    parser.add_argument('db')
+    parser.add_argument('tables', nargs='*', help="Tables to dump (default: all)")
+    parser.add_argument('--records', action='store_true', help="Dump raw segment records instead of live rows")
+    args = parser.parse_args()
+    try:
+        export(args.db, args.tables, args.records)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,33 @@
-import re
+from core import sql
 
 def parse_command(command_str):
     """
     Translates string input into a dictionary the engine understands.
     Example: "INSERT INTO users VALUES (3, 'Rex')"
+
+    Kept for callers of the old dict format; parsing itself is done by core.sql.
+    Returns None for statements that have no dict form or do not parse.
     """
-    cmd = command_str.strip()
-    
+    try:
+        stmt = sql.parse(command_str)
+    except sql.SQLSyntaxError:
+        return None
+
     # 1. CREATE TABLE (id:int, name:str)
-    if cmd.startswith("CREATE TABLE"):
-        match = re.match(r"CREATE TABLE (\w+) \((.*)\)", cmd, re.IGNORECASE)
-        if match:
-            table_name = match.group(1)
-            cols_raw = match.group(2).split(",")
-            columns = {}
-            for c in cols_raw:
-                c_name, c_type = c.strip().split(":")
-                columns[c_name] = c_type
-            return {"action": "create", "table": table_name, "columns": columns}
+    if isinstance(stmt, sql.CreateTable):
+        return {"action": "create", "table": stmt.table, "columns": stmt.columns}
 
     # 2. INSERT INTO VALUES (3, 'Rex')
-    elif cmd.startswith("INSERT INTO"):
-        match = re.match(r"INSERT INTO (\w+) VALUES \((.*)\)", cmd, re.IGNORECASE)
-        if match:
-            table_name = match.group(1)
-            values = [v.strip().strip("'") for v in match.group(2).split(",")]
-            return {"action": "insert", "table": table_name, "values": values}
+    if isinstance(stmt, sql.Insert) and stmt.values:
+        return {"action": "insert", "table": stmt.table, "values": list(stmt.values[0])}
 
-    # 3. SELECT * or FROM
-    elif cmd.startswith("SELECT"):
-        match = re.match(r"SELECT (?:\* )?FROM (\w+)(?: WHERE (\w+) = (.*))?", cmd, re.IGNORECASE)
-        if match:
-            table_name = match.group(1)
-            where_col = match.group(2)
-            where_val = match.group(3).strip("'") if match.group(3) else None
-            return {"action": "select", "table": table_name, "where": {where_col: where_val} if where_col else None}
-        
+    # 3. SELECT * FROM t [WHERE col = value]
+    if isinstance(stmt, sql.Select) and not stmt.joins:
+        where = stmt.where
+        if where is None:
+            return {"action": "select", "table": stmt.table, "where": None}
+        if isinstance(where, sql.Compare) and where.op == '=' and isinstance(where.left, sql.Column) \
+                and isinstance(where.right, sql.Literal):
+            return {"action": "select", "table": stmt.table, "where": {where.left.name: where.right.value}}
 
-    return None
\ No newline at end of file
+    return None
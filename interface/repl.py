@@ -1,14 +1,14 @@
 import os
 import sys
-import re
-import ast
 import atexit
 
 # 1. THE PATH FIX: Allows importing from the parent directory
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
-    from core.engine import DatabaseEngine
+    from core import metrics
+    from core.catalog import Catalog, Session
+    from core.sql import SQLSyntaxError
 except ImportError:
     print("Error: Could not find 'core' module. Ensure you are in the project root.")
     sys.exit(1)
@@ -34,7 +34,7 @@ BOLD = "\033[1m"
 
 class PesaDBRepl:
     def __init__(self):
-        self.engine = DatabaseEngine()
+        self.session = Session(Catalog())
         self.running = True
 
     def print_success(self, text):
@@ -54,13 +54,13 @@ class PesaDBRepl:
                 print(f" • {item}")
         print("")
 
-    def table_display(self, rows):
+    def table_display(self, rows, headers=None):
         """Standard RDBMS ASCII table formatter"""
         if not rows:
             print(f"{CLR_GRAY}(empty set){CLR_RESET}")
             return
 
-        headers = list(rows[0].keys())
+        headers = headers or list(rows[0].keys())
         widths = {h: len(h) for h in headers}
         for row in rows:
             for h in headers:
@@ -72,7 +72,7 @@ class PesaDBRepl:
         print("| " + " | ".join(f"{h.upper():<{widths[h]}}" for h in headers) + " |")
         print(sep)
         for row in rows:
-            print("| " + " | ".join(f"{str(row.get(h, '')):<widths[h]}" for h in headers) + " |")
+            print("| " + " | ".join(f"{str(row.get(h, '')):<{widths[h]}}" for h in headers) + " |")
         print(sep)
 
     def show_help(self):
@@ -84,12 +84,27 @@ class PesaDBRepl:
             ("SHOW TABLES", "List tables in active database"),
             ("USE <db>", "Switch database context"),
             ("CREATE DATABASE <db>", "Initialize new database"),
+            ("CREATE TABLE <t> (id int PRIMARY KEY, ...)", "Define a table"),
             ("SELECT FROM <table>", "Query all records"),
+            ("SELECT <cols> FROM <t> [JOIN ..] [WHERE ..]", "Filter, join, GROUP BY, ORDER BY, LIMIT"),
+            ("SELECT c, SUM(x) FROM <t> GROUP BY c", "COUNT/SUM/AVG/MIN/MAX per group"),
+            ("EXPLAIN [ANALYZE] SELECT ..", "Show the plan (ANALYZE: run it and profile each step)"),
             ("INSERT INTO <table> {d}", "Insert record (e.g. {'id':1})"),
-            ("ADD COLUMN <table> <col>", "Append new attribute to table"),
-            ("DROP COLUMN <table> <col>", "Permanently purge attribute"),
+            ("INSERT INTO <t> VALUES (...)", "Insert one or more records"),
+            ("UPDATE <t> SET c = v WHERE ..", "Modify matching records"),
+            ("DELETE FROM <t> WHERE ..", "Remove matching records"),
+            ("COPY <t> FROM '<file>'", "Bulk-load a CSV or NDJSON file"),
+            ("ADD COLUMN <t> <col> [type] [DEFAULT v]", "Append attribute (instant, rows keep the default)"),
+            ("DROP COLUMN <table> <col>", "Hide attribute now, purge it in the background"),
+            ("ALTER TABLE <t> SET LAYOUT COLUMNAR", "Column arrays for analytics (or ROW)"),
+            ("CREATE [UNIQUE] INDEX <i> ON <t> (<c>)", "Build a secondary hash index"),
+            ("CREATE INDEX <i> ON <t> USING BTREE (<c>)", "Build an ordered (range) index"),
+            ("DROP INDEX <i>", "Remove a secondary index"),
             ("DROP DATABASE <db>", "Delete database cluster"),
             ("DROP TABLE <table>", "Delete table and data"),
+            ("BEGIN", "Start a transaction (buffered row changes)"),
+            ("COMMIT / ROLLBACK", "Apply the transaction at once / discard it"),
+            ("\\stats", "Engine metrics: operations, latency, I/O, cache, locks"),
             ("HELP", "Show this manual"),
             ("CLEAR", "Clear terminal history"),
             ("EXIT", "Close CLI session")
@@ -98,6 +113,50 @@ class PesaDBRepl:
             print(f" {CLR_CYAN}{c:<25}{CLR_RESET} : {d}")
         print("")
 
+    def show_stats(self):
+        """Prints the engine metrics of this process (the web API serves them on /metrics)"""
+        samples = metrics.snapshot()
+        series = lambda metric: samples.get(metric, {})
+        count = lambda metric, *labels: series(metric).get(labels, 0)
+        ms = lambda seconds: f"{seconds * 1000:.3f}"
+
+        print(f"\n{BOLD}Operations per table{CLR_RESET}")
+        self.table_display([{"database": db, "table": table, "operation": op, "count": n}
+                            for (db, table, op), n in sorted(series(metrics.TABLE_OPERATIONS).items())],
+                           ["database", "table", "operation", "count"])
+
+        print(f"\n{BOLD}Statement latency (ms){CLR_RESET}")
+        latency, errors = series(metrics.STATEMENT_SECONDS), series(metrics.STATEMENT_ERRORS)
+        rows = []
+        for labels in sorted(set(latency) | set(errors)):
+            hist = latency.get(labels, ([], 0, 0.0))
+            done = hist[1]
+            rows.append({"statement": labels[0], "count": done, "errors": errors.get(labels, 0),
+                         "avg": ms(hist[2] / done) if done else "-",
+                         "p50": ms(metrics.quantile(hist, 0.5)) if done else "-",
+                         "p99": ms(metrics.quantile(hist, 0.99)) if done else "-"})
+        self.table_display(rows, ["statement", "count", "errors", "avg", "p50", "p99"])
+
+        waits = lambda metric: ", ".join(f"{labels[0]} {hist[1]} ({ms(hist[2])} ms)"
+                                         for labels, hist in sorted(series(metric).items())) or "none"
+        lookups = count(metrics.BUFFER_POOL_LOOKUPS, 'hit') + count(metrics.BUFFER_POOL_LOOKUPS, 'miss')
+        self.list_display("Engine totals", [
+            f"Rows scanned: {count(metrics.ROWS_SCANNED, 'segment')} from segments, "
+            f"{count(metrics.ROWS_SCANNED, 'buffer_pool')} from the buffer pool, "
+            f"{count(metrics.ROWS_SCANNED, 'columnar')} columnar",
+            f"Rows returned: {count(metrics.ROWS_RETURNED)}",
+            f"Index lookups: {count(metrics.INDEX_LOOKUPS, 'hit')} hit(s), {count(metrics.INDEX_LOOKUPS, 'miss')} miss(es); "
+            f"{count(metrics.INDEX_SCANS, 'range')} range scan(s), {count(metrics.INDEX_SCANS, 'ordered_walk')} ordered walk(s)",
+            f"Bytes read: {count(metrics.BYTES_READ)}; written: {count(metrics.BYTES_WRITTEN, 'segment')} to segments, "
+            f"{count(metrics.BYTES_WRITTEN, 'wal')} to the WAL",
+            f"fsyncs (total time): {waits(metrics.FSYNC_SECONDS)}",
+            f"Buffer pool: {count(metrics.BUFFER_POOL_HIT_RATIO):.1%} hit ratio over {lookups} lookup(s), "
+            f"{count(metrics.BUFFER_POOL_BYTES, 'used')} of {count(metrics.BUFFER_POOL_BYTES, 'budget')} bytes used, "
+            f"{count(metrics.BUFFER_POOL_EVICTIONS)} eviction(s)",
+            f"Plan cache: {count(metrics.PLAN_CACHE, 'hit')} hit(s), {count(metrics.PLAN_CACHE, 'miss')} miss(es)",
+            f"Lock waits (total time): {waits(metrics.LOCK_WAIT_SECONDS)}",
+        ])
+
     def execute(self, cmd):
         cmd = cmd.strip()
         if not cmd: 
@@ -112,121 +171,31 @@ class PesaDBRepl:
             self.show_help()
             return
 
-        if cmd_upper == "CLEAR":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            return
-
-        # --- INTROSPECTION ---
-        if cmd_upper == "SHOW DATABASES":
-            self.list_display("Available Databases", self.engine.list_databases())
-            return
-
-        if cmd_upper == "SHOW TABLES":
-            if not self.engine.active_db:
-                self.print_error("No active DB. Use 'USE <db>'")
-                return
-            self.list_display(f"Tables in '{self.engine.active_db}'", list(self.engine.schemas.keys()))
-            return
-
-        # --- DB CONTEXT ---
-        match = re.match(r"USE\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            db_name = match.group(1)
-            if db_name not in self.engine.list_databases():
-                self.print_error(f"Database '{db_name}' not found.")
-                return
-            self.engine.set_active_db(db_name)
-            self.print_success(f"Context switched to: {db_name}")
-            return
-
-        match = re.match(r"CREATE\s+DATABASE\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            db_name = match.group(1)
-            self.engine.set_active_db(db_name)
-            self.print_success(f"Database '{db_name}' initialized.")
-            return
-
-        # --- SCHEMA EVOLUTION ---
-        # ADD COLUMN <table_name> <column_name>
-        match = re.match(r"ADD\s+COLUMN\s+(\w+)\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            if not self.engine.active_db:
-                self.print_error("No active DB.")
-                return
-            table_name, col_name = match.groups()
-            try:
-                if table_name not in self.engine.schemas:
-                    raise ValueError(f"Table '{table_name}' not found.")
-                self.engine.schemas[table_name].columns[col_name] = "str"
-                self.engine.save_metadata()
-                self.print_success(f"Attribute '{col_name}' added to {table_name}.")
-            except Exception as e:
-                self.print_error(str(e))
+        if cmd_upper == "\\STATS":
+            self.show_stats()
             return
 
-        # DROP COLUMN <table_name> <column_name>
-        match = re.match(r"DROP\s+COLUMN\s+(\w+)\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            if not self.engine.active_db:
-                self.print_error("No active DB.")
-                return
-            table_name, col_name = match.groups()
-            try:
-                msg = self.engine.remove_column(table_name, col_name)
-                self.print_success(msg)
-            except Exception as e:
-                self.print_error(str(e))
-            return
-
-        # --- DATA OPERATIONS ---
-        match = re.match(r"SELECT\s+FROM\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            if not self.engine.active_db:
-                self.print_error("No active DB context.")
-                return
-            table_name = match.group(1)
-            try:
-                rows = self.engine.select(table_name)
-                self.print_success(f"Found {len(rows)} records.")
-                self.table_display(rows)
-            except Exception as e:
-                self.print_error(str(e))
-            return
-
-        match = re.match(r"INSERT\s+INTO\s+(\w+)\s+(.+)", cmd, re.IGNORECASE)
-        if match:
-            table_name = match.group(1)
-            try:
-                data = ast.literal_eval(match.group(2))
-                msg = self.engine.insert(table_name, data)
-                self.print_success(msg)
-            except Exception as e:
-                self.print_error(f"Malformed data or constraint violation: {e}")
+        if cmd_upper == "CLEAR":
+            os.system('cls' if os.name == 'nt' else 'clear')
             return
 
-        # --- DROP OPERATIONS ---
-        match = re.match(r"DROP\s+TABLE\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            if not self.engine.active_db:
-                self.print_error("No active DB.")
-                return
-            try:
-                msg = self.engine.drop_table(match.group(1))
-                self.print_success(msg)
-            except Exception as e:
-                self.print_error(str(e))
+        # Everything else is SQL: parsed, planned (and cached) by the engine
+        try:
+            result = self.session.execute(cmd)
+        except SQLSyntaxError as e:
+            self.print_error(f"{e} Type 'HELP' for instructions.")
             return
-
-        match = re.match(r"DROP\s+DATABASE\s+(\w+)", cmd, re.IGNORECASE)
-        if match:
-            try:
-                msg = self.engine.delete_database(match.group(1))
-                self.print_success(msg)
-            except Exception as e:
-                self.print_error(str(e))
+        except Exception as e:
+            self.print_error(str(e))
             return
 
-        self.print_error(f"Unknown command: '{cmd}'. Type 'HELP' for instructions.")
+        if result.items is not None:
+            self.list_display(result.message, result.items)
+        elif result.rows is not None:
+            self.print_success(result.message)
+            self.table_display(result.rows, result.columns)
+        else:
+            self.print_success(result.message)
 
     def start(self):
         os.system('cls' if os.name == 'nt' else 'clear')
@@ -235,13 +204,17 @@ class PesaDBRepl:
 
         while self.running:
             try:
-                context = self.engine.active_db if self.engine.active_db else "system"
+                context = self.session.db_name or "system"
+                if self.session.transaction is not None:
+                    context += "*"  # Inside a transaction
                 prompt = f"{CLR_EMERALD}➜  {CLR_CYAN}{context}{CLR_RESET} "
                 user_input = input(prompt)
                 self.execute(user_input)
             except (KeyboardInterrupt, EOFError):
                 print("\nBye!")
                 break
+        self.session.close()
+        self.session.catalog.close()
 
 if __name__ == "__main__":
     repl = PesaDBRepl()
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# 1. THE PATH FIX: Allows importing from the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import storage
+from core.engine import DatabaseEngine
+
+DB_NAME = 'test'
+
+
+def crash(engine):
+    """
+    Drops an engine the way a killed process would: no checkpoint, and the
+    in-memory state of its table logs is lost. Only files survive.
+    """
+    if engine.wal is not None:
+        engine.wal.close()
+        engine.wal = None
+    storage.close_database(engine.active_db)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """An empty data directory for the test; nothing touches data/."""
+    monkeypatch.setattr(storage, 'BASE_DATA_DIR', str(tmp_path))
+    yield tmp_path
+    storage.close_database(DB_NAME)
+
+
+@pytest.fixture
+def open_engine(data_dir):
+    """Opens (or, after crash(), reopens) the test database in a new engine."""
+    engines = []
+    def open_engine():
+        engine = DatabaseEngine(durable=False)
+        engine.set_active_db(DB_NAME)
+        engines.append(engine)
+        return engine
+    yield open_engine
+    for engine in engines:
+        if engine.wal is not None:
+            engine.wal.close()
+
+
+@pytest.fixture
+def engine(open_engine):
+    return open_engine()
@@ -0,0 +1,72 @@
+import threading
+
+from conftest import crash
+
+WRITERS = 4
+ROWS_PER_WRITER = 200
+
+
+def _finish_compaction(engine):
+    for thread in list(engine._migrations.values()):
+        thread.join()
+
+
+def _rows(engine):
+    return sorted(engine.select('people'), key=lambda row: row['id'])
+
+
+def test_add_and_drop_column_round_trip(engine, open_engine):
+    engine.create_table('people', {'id': 'int', 'name': 'str'}, primary_key='id')
+    engine.insert('people', {'id': 1, 'name': 'ann'})
+
+    engine.add_column('people', 'age', 'int', default=30)
+    engine.insert('people', {'id': 2, 'name': 'bob', 'age': 41})
+    assert _rows(engine) == [{'id': 1, 'name': 'ann', 'age': 30}, {'id': 2, 'name': 'bob', 'age': 41}]
+
+    engine.remove_column('people', 'age')
+    assert _rows(engine) == [{'id': 1, 'name': 'ann'}, {'id': 2, 'name': 'bob'}]
+
+    # A column added again under the old name never sees the dropped values
+    engine.add_column('people', 'age', 'int')
+    expected = [{'id': 1, 'name': 'ann', 'age': None}, {'id': 2, 'name': 'bob', 'age': None}]
+    assert _rows(engine) == expected
+
+    _finish_compaction(engine)
+    assert _rows(engine) == expected
+    engine.checkpoint()
+    crash(engine)
+    reopened = open_engine()
+    _finish_compaction(reopened)
+    assert _rows(reopened) == expected
+
+
+def test_concurrent_writers_during_column_ddl(engine):
+    engine.create_table('people', {'id': 'int', 'name': 'str'}, primary_key='id')
+    errors = []
+
+    def write(writer):
+        try:
+            for i in range(ROWS_PER_WRITER):
+                row_id = writer * ROWS_PER_WRITER + i
+                engine.insert('people', {'id': row_id, 'name': f'person {row_id}'})
+                if i % 10 == 0:
+                    engine.update('people', row_id, {'name': f'renamed {row_id}'})
+        except Exception as e:  # Reported below: a thread's exception would be lost
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for round_no in range(5):
+        engine.add_column('people', 'score', 'int', default=round_no)
+        engine.remove_column('people', 'score')
+    for thread in threads:
+        thread.join()
+    _finish_compaction(engine)
+
+    assert errors == []
+    rows = _rows(engine)
+    assert [row['id'] for row in rows] == list(range(WRITERS * ROWS_PER_WRITER))
+    assert all(set(row) == {'id', 'name'} for row in rows)
+    assert all(row['name'].startswith('renamed' if row['id'] % ROWS_PER_WRITER % 10 == 0 else 'person')
+               for row in rows)
@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.fixture
+def numbers(engine):
+    engine.create_table('numbers', {'id': 'int', 'n': 'int', 'm': 'int'}, primary_key='id')
+    for i in range(1, 9):
+        engine.insert('numbers', {'id': i, 'n': i, 'm': i})
+    engine.create_index('numbers', 'm', ordered=True)
+    return engine
+
+
+def _ids(engine, where):
+    return sorted(row['id'] for row in engine.select('numbers', where))
+
+
+@pytest.mark.parametrize('col', ['id', 'n', 'm'])
+@pytest.mark.parametrize('cond, expected', [
+    (('<', 5.5), [1, 2, 3, 4, 5]),
+    (('<=', 5.5), [1, 2, 3, 4, 5]),
+    (('>', 5.5), [6, 7, 8]),
+    (('>=', 5.5), [6, 7, 8]),
+    (('!=', 5.5), [1, 2, 3, 4, 5, 6, 7, 8]),
+    (('between', 2.5, 4.5), [3, 4]),
+    (5.5, []),
+    (5.0, [5]),
+])
+def test_fractional_bounds_on_int_columns(numbers, col, cond, expected):
+    assert _ids(numbers, {col: cond}) == expected
+
+
+def test_range_uses_the_ordered_index(numbers):
+    assert _ids(numbers, {'m': ('between', 3, 4)}) == [3, 4]
+    assert [row['id'] for row in numbers.select('numbers', order_by='m', descending=True, limit=2)] == [8, 7]
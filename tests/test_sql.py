@@ -0,0 +1,40 @@
+import pytest
+
+from core import planner
+
+
+def _rows(engine, table):
+    return sorted(engine.select(table), key=lambda row: row['id'])
+
+
+@pytest.fixture
+def users(engine):
+    planner.execute(engine, "CREATE TABLE users (id int PRIMARY KEY, email str UNIQUE, visits int)")
+    for i in range(3):
+        planner.execute(engine, f"INSERT INTO users VALUES ({i}, 'user{i}@example.com', 0)")
+    return engine
+
+
+def test_failing_update_changes_no_row(users):
+    before = _rows(users, 'users')
+    with pytest.raises(ValueError, match='Unique'):
+        planner.execute(users, "UPDATE users SET email = 'same@example.com', visits = 1")
+    assert _rows(users, 'users') == before
+
+
+def test_update_may_take_a_value_another_updated_row_gives_up(users):
+    planner.execute(users, "UPDATE users SET email = 'old@example.com' WHERE id = 0")
+    result = planner.execute(users, "UPDATE users SET email = 'user0@example.com' WHERE id = 1 OR visits > 5")
+    assert result.message == "Updated 1 row(s)."
+    assert users.select('users', {'email': 'user0@example.com'})[0]['id'] == 1
+
+
+def test_update_and_delete_without_a_primary_key(engine):
+    planner.execute(engine, "CREATE TABLE notes (a int, b str)")
+    planner.execute(engine, "INSERT INTO notes VALUES (1, 'x')")
+    planner.execute(engine, "INSERT INTO notes VALUES (2, 'x')")
+
+    assert planner.execute(engine, "UPDATE notes SET b = 'y' WHERE a = 1").message == "Updated 1 row(s)."
+    assert sorted(engine.select('notes'), key=lambda row: row['a']) == [{'a': 1, 'b': 'y'}, {'a': 2, 'b': 'x'}]
+    assert planner.execute(engine, "DELETE FROM notes WHERE a = 1 OR b = 'y'").message == "Deleted 1 row(s)."
+    assert engine.select('notes') == [{'a': 2, 'b': 'x'}]
@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import crash
+
+
+@pytest.fixture
+def accounts(engine):
+    engine.create_table('accounts', {'id': 'int', 'balance': 'int'}, primary_key='id')
+    engine.insert('accounts', {'id': 1, 'balance': 100})
+    return engine
+
+
+def test_first_committer_wins(accounts):
+    first, second = accounts.begin(), accounts.begin()
+    first.update('accounts', 1, {'balance': 50})
+    second.update('accounts', 1, {'balance': 70})
+    second.insert('accounts', {'id': 2, 'balance': 30})
+    first.commit()
+
+    with pytest.raises(ValueError, match='conflict'):
+        second.commit()
+    # The losing transaction is rolled back whole, its insert included
+    assert accounts.select('accounts') == [{'id': 1, 'balance': 50}]
+    assert not second.active
+
+
+def test_rollback_discards_pending_writes(accounts):
+    txn = accounts.begin()
+    txn.insert('accounts', {'id': 2, 'balance': 30})
+    txn.update('accounts', 1, {'balance': 0})
+    assert len(txn.select('accounts')) == 2
+    assert accounts.select('accounts') == [{'id': 1, 'balance': 100}]
+
+    txn.rollback()
+    assert accounts.select('accounts') == [{'id': 1, 'balance': 100}]
+    with pytest.raises(ValueError):
+        txn.insert('accounts', {'id': 3, 'balance': 0})
+
+
+def test_commit_is_replayed_whole(accounts, open_engine):
+    txn = accounts.begin()
+    txn.update('accounts', 1, {'balance': 60})
+    txn.insert('accounts', {'id': 2, 'balance': 40})
+    txn.commit()
+    crash(accounts)
+
+    engine = open_engine()
+    assert sorted(engine.select('accounts'), key=lambda row: row['id']) == [
+        {'id': 1, 'balance': 60}, {'id': 2, 'balance': 40}]
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from core import storage, wal
+from conftest import DB_NAME, crash
+
+
+def _wal_path():
+    return os.path.join(storage.BASE_DATA_DIR, DB_NAME, wal.WAL_FILE)
+
+
+def _ids(engine):
+    return sorted(row['id'] for row in engine.select('items'))
+
+
+def test_replay_recovers_commits_before_a_torn_tail(open_engine, monkeypatch):
+    engine = open_engine()
+    engine.create_table('items', {'id': 'int', 'name': 'str'}, primary_key='id')
+    with monkeypatch.context() as patch:
+        # The commits reach the WAL but never the segments
+        patch.setattr(storage, 'apply_ops', lambda db_name, ops: None)
+        for i in range(3):
+            engine.insert('items', {'id': i, 'name': f'item {i}'})
+    with open(_wal_path(), 'ab') as f:
+        f.write(b'{"lsn": 99, "ops": [["items", 7, {"id": 7')
+    crash(engine)
+
+    assert _ids(open_engine()) == [0, 1, 2]
+
+
+def test_commit_after_a_torn_tail_is_replayed(open_engine, monkeypatch):
+    engine = open_engine()
+    engine.create_table('items', {'id': 'int', 'name': 'str'}, primary_key='id')
+    engine.insert('items', {'id': 0, 'name': 'item 0'})
+    engine.checkpoint()
+    with open(_wal_path(), 'ab') as f:
+        f.write(b'{"lsn": 99, "ops": [["items", 7, {"id": 7')
+    crash(engine)
+
+    # Reopening cuts the torn line, so the next commit is not appended behind it
+    engine = open_engine()
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, 'apply_ops', lambda db_name, ops: None)
+        engine.insert('items', {'id': 1, 'name': 'item 1'})
+    crash(engine)
+    assert _ids(open_engine()) == [0, 1]
+
+
+def test_crash_between_wal_append_and_segment_apply(open_engine, monkeypatch):
+    engine = open_engine()
+    engine.create_table('items', {'id': 'int', 'name': 'str'}, primary_key='id')
+    engine.insert('items', {'id': 1, 'name': 'kept'})
+
+    def crash_before_apply(db_name, ops):
+        raise OSError("killed before the segment append")
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, 'apply_ops', crash_before_apply)
+        with pytest.raises(OSError):
+            engine.insert('items', {'id': 2, 'name': 'logged'})
+    crash(engine)
+
+    engine = open_engine()
+    assert engine.select('items', {'id': 2}) == [{'id': 2, 'name': 'logged'}]
+    assert _ids(engine) == [1, 2]
+    with pytest.raises(ValueError):
+        engine.insert('items', {'id': 2, 'name': 'duplicate'})
@@ -1,12 +1,26 @@
-from fastapi import FastAPI, HTTPException
+from collections import OrderedDict
+from typing import Optional
+import itertools
+import json
+import os
+import threading
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from core.engine import DatabaseEngine
-import re
-import ast
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from core import metrics, planner, sql
+from core.catalog import Catalog, Session
+from core.sql import SQLSyntaxError
 
-# Initialize the engine globally
-db = DatabaseEngine()
+# COPY over HTTP may only read files from this directory
+COPY_DIR = os.environ.get("PESADB_COPY_DIR", "imports")
+# Every open database keeps its own engine in the catalog, shared by all
+# requests for it; shell clients get a Session each (X-Session-Id header).
+catalog = Catalog()
+sessions = OrderedDict()  # {session id: Session}, least recently used first
+sessions_lock = threading.Lock()
+MAX_SESSIONS = 1024
 app = FastAPI(title="PesaDB API")
+DEFAULT_PAGE_ROWS = 100
 
 # Enable CORS for Vite frontend
 app.add_middleware(
@@ -14,35 +28,67 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # --- Helper Validation ---
-def check_db_exists(db_name: str):
-    """Utility to verify if the logical cluster exists on disk."""
-    if db_name not in db.list_databases():
+def engine_for(db_name: str):
+    """Returns the catalog's engine for a logical cluster, or a 404 if it does not exist on disk."""
+    try:
+        return catalog.engine(db_name)
+    except ValueError:
         raise HTTPException(
             status_code=404, 
             detail=f"Database '{db_name}' does not exist. Use 'CREATE DATABASE {db_name}' first."
         )
 
+def session_for(session_id: Optional[str]):
+    """
+    Returns the shell session of a client, creating it on first use. A request
+    without a session id gets a session of its own that ends with it, so
+    clients never share a current database or a transaction.
+    """
+    if not session_id:
+        return Session(catalog, copy_root=COPY_DIR)
+    key = session_id
+    with sessions_lock:
+        session = sessions.get(key)
+        if session is None:
+            session = sessions[key] = Session(catalog, copy_root=COPY_DIR)
+            if len(sessions) > MAX_SESSIONS:
+                sessions.popitem(last=False)[1].close()  # Rolls back its open transaction
+        sessions.move_to_end(key)
+        return session
+
+@app.on_event("shutdown")
+def close_databases():
+    catalog.close()
+
+# --- Monitoring ---
+
+@app.get("/metrics")
+def get_metrics():
+    """Engine counters and latency histograms in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # --- Database Management ---
 
 @app.get("/databases")
 def list_dbs():
-    return db.list_databases()
+    return catalog.list_databases()
 
 @app.post("/databases")
 def create_db(payload: dict):
     db_name = payload.get("name")
     if not db_name:
         raise HTTPException(status_code=400, detail="Database name is required")
-    db.set_active_db(db_name)
+    catalog.create_database(db_name)
     return {"status": "success", "message": f"Database '{db_name}' initialized"}
 
 @app.delete("/databases/{db_name}")
 def delete_database(db_name: str):
     try:
-        db.delete_database(db_name) 
+        catalog.drop_database(db_name)
         return {"status": "Database dropped"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -51,29 +97,27 @@ def delete_database(db_name: str):
 
 @app.get("/{db_name}/tables")
 def get_tables(db_name: str):
-    check_db_exists(db_name)
-    db.set_active_db(db_name)
-    return list(db.schemas.keys())
+    engine = engine_for(db_name)
+    return list(engine.schemas.keys())
 
 @app.post("/{db_name}/tables")
 def create_table(db_name: str, payload: dict):
-    check_db_exists(db_name)
-    db.set_active_db(db_name)
+    engine = engine_for(db_name)
     table_name = payload.get("name")
     if not table_name:
         raise HTTPException(status_code=400, detail="Table name is required")
     columns = payload.get("columns", {"id": "str", "name": "str"})
     pk = payload.get("primary_key", "id")
     try:
-        return db.create_table(table_name, columns, primary_key=pk)
+        return engine.create_table(table_name, columns, primary_key=pk)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/{db_name}/{table_name}")
 def drop_table(db_name: str, table_name: str):
-    db.set_active_db(db_name)
+    engine = engine_for(db_name)
     try:
-        db.drop_table(table_name)
+        engine.drop_table(table_name)
         return {"status": "Table dropped"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -81,35 +125,54 @@ def drop_table(db_name: str, table_name: str):
 # --- Data Operations (CRUD) ---
 
 @app.get("/{db_name}/{table_name}/rows")
-def get_rows(db_name: str, table_name: str):
-    db.set_active_db(db_name)
-    rows = db.select(table_name)
-    schema = db.schemas.get(table_name)
-    columns = list(schema.columns.keys()) if schema else []
-    return {"rows": rows, "columns": columns}
+def get_rows(db_name: str, table_name: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    engine = engine_for(db_name)
+    if limit is None and cursor is None:
+        rows = engine.select(table_name) if table_name in engine.schemas else []
+        schema = engine.schemas.get(table_name)
+        columns = list(schema.columns.keys()) if schema else []
+        return {"rows": rows, "columns": columns}
+
+    # Paginated: stream one keyset page as NDJSON, next page cursor in a header
+    try:
+        rows, next_cursor = engine.select_page(table_name, limit or DEFAULT_PAGE_ROWS, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    lines = (json.dumps(row) + "\n" for row in rows)
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers=headers)
 
 @app.post("/{db_name}/{table_name}/rows")
 def insert_generic_row(db_name: str, table_name: str, row: dict):
+    engine = engine_for(db_name)
     try:
-        db.set_active_db(db_name)
-        result = db.insert(table_name, row)
+        result = engine.insert(table_name, row)
         return {"status": "success", "message": result}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/{db_name}/{table_name}/rows/bulk")
+def insert_bulk_rows(db_name: str, table_name: str, rows: list):
+    """Inserts a JSON array of rows in batches (constraints checked per batch, one commit each)."""
+    engine = engine_for(db_name)
+    try:
+        return {"status": "success", "message": engine.insert_many(table_name, rows)}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.put("/{db_name}/{table_name}/rows/{row_id}")
 def update_row_route(db_name: str, table_name: str, row_id: str, payload: dict):
+    engine = engine_for(db_name)
     try:
-        db.set_active_db(db_name)
-        return {"message": db.update(table_name, row_id, payload)}
+        return {"message": engine.update(table_name, row_id, payload)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/{db_name}/join")
 def perform_join(db_name: str, table_a: str, table_b: str, col_a: str, col_b: str):
-    db.set_active_db(db_name)
+    engine = engine_for(db_name)
     try:
-        results = db.join(table_a, table_b, col_a, col_b)
+        results = engine.join(table_a, table_b, col_a, col_b)
         columns = list(results[0].keys()) if results else []
         return {"rows": results, "columns": columns}
     except Exception as e:
@@ -117,38 +180,101 @@ def perform_join(db_name: str, table_a: str, table_b: str, col_a: str, col_b: st
 
 @app.post("/{db_name}/{table_name}/columns")
 def add_column_to_table(db_name: str, table_name: str, payload: dict):
-    db.set_active_db(db_name)
+    engine = engine_for(db_name)
     col_name = payload.get("name")
     if not col_name:
         raise HTTPException(status_code=400, detail="Column name required")
     
+    if table_name not in engine.schemas:
+        raise HTTPException(status_code=404, detail="Table not found")
     try:
-        if table_name not in db.schemas:
-            raise HTTPException(status_code=404, detail="Table not found")
-            
-        # 1. Update schema in memory
-        db.schemas[table_name].columns[col_name] = "str"
-        
-        # 2. Persist change to metadata.json
-        db.save_metadata()
-        
+        engine.add_column(table_name, col_name, payload.get("type", "str"), payload.get("default"))
         return {"status": "success", "message": f"Column '{col_name}' added to {table_name}"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
 @app.delete("/{db_name}/{table_name}/columns/{col_name}")
 def drop_column(db_name: str, table_name: str, col_name: str):
-    db.set_active_db(db_name)
+    engine = engine_for(db_name)
     try:
-        msg = db.remove_column(table_name, col_name)
+        msg = engine.remove_column(table_name, col_name)
         return {"status": "success", "message": msg}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# --- Prepared Statements ---
+
+def result_payload(result):
+    """JSON body for a planner Result."""
+    response = {"status": "success", "message": result.message}
+    if result.rows is not None:
+        response["rows"] = result.rows
+        response["columns"] = result.columns
+    if result.items is not None:
+        response["items"] = result.items
+    return response
+
+@app.post("/{db_name}/prepare")
+def prepare_statement(db_name: str, payload: dict):
+    """Parses and plans a statement with '?' placeholders; the plan stays cached server-side."""
+    engine_for(db_name)  # 404 for unknown databases
+    try:
+        stmt = Session(catalog, db_name, copy_root=COPY_DIR).prepare(payload.get("sql", ""))
+        return {"status": "success", "sql": stmt.text, "params": stmt.param_count}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/{db_name}/execute")
+def execute_statement(db_name: str, payload: dict):
+    """Runs a (possibly prepared) statement, binding payload['params'] to its placeholders."""
+    engine_for(db_name)  # 404 for unknown databases
+    try:
+        # A one-request session: a USE inside it cannot affect other clients
+        session = Session(catalog, db_name, copy_root=COPY_DIR)
+        return result_payload(session.execute(payload.get("sql", ""), payload.get("params", [])))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Structured Queries ---
+
+@app.post("/{db_name}/query")
+def structured_query(db_name: str, payload: dict):
+    """
+    Runs a query described as JSON instead of SQL, e.g.
+    {"table": "orders", "where": {"amount": [">", 10]}, "group_by": ["status"],
+     "aggregates": [{"func": "SUM", "column": "amount", "as": "total"}, {"func": "COUNT"}],
+     "order_by": "total", "descending": true, "limit": 10}
+    With "aggregates" or "group_by" the engine aggregates server-side and only
+    the per-group rows are returned; otherwise it is a select ("columns" projects).
+    """
+    engine = engine_for(db_name)
+    table = payload.get("table")
+    group_by = payload.get("group_by") or []
+    order_by, descending, limit = payload.get("order_by"), bool(payload.get("descending")), payload.get("limit")
+    try:
+        if table not in engine.schemas:
+            raise ValueError(f"Table '{table}' not found.")
+        if not payload.get("aggregates") and not group_by:
+            columns = payload.get("columns")
+            rows = engine.select(table, payload.get("where"), order_by, descending, limit, columns=columns)
+            return {"status": "success", "rows": rows, "columns": columns or list(engine.schemas[table].columns)}
+
+        aggregates = []
+        for spec in payload.get("aggregates") or []:
+            func, column = str(spec.get("func", "")).upper(), spec.get("column")
+            aggregates.append((spec.get("as") or f"{func}({column or '*'})", func, column))
+        rows = engine.aggregate(table, aggregates, group_by, payload.get("where"))
+        if order_by is not None:
+            rows = sorted(rows, key=lambda row: (row.get(order_by) is None, row.get(order_by)), reverse=descending)
+        rows = list(itertools.islice(rows, limit))
+        return {"status": "success", "rows": rows, "columns": group_by + [label for label, _, _ in aggregates]}
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # --- PesaDB Bash Shell Logic ---
 
 @app.post("/shell")
-def execute_raw_command(payload: dict):
+def execute_raw_command(payload: dict, x_session_id: Optional[str] = Header(None)):
     raw_cmd = payload.get("command", "").strip()
     if not raw_cmd:
         raise HTTPException(status_code=400, detail="Empty command")
@@ -164,84 +290,36 @@ def execute_raw_command(payload: dict):
             "SHOW TABLES              : List tables in active DB.\n"
             "USE <db_name>            : Switch context to a database.\n"
             "CREATE DATABASE <db_name>: Initialize a new cluster.\n"
-            "ADD COLUMN <tbl> <col>   : Append attribute to schema.\n"
-            "DROP COLUMN <tbl> <col>  : Purge attribute from disk.\n"
-            "SELECT FROM <table_name> : Retrieve all records.\n"
-            "INSERT INTO <table_name> : Commit record {id:1}.\n"
+            "ADD COLUMN <tbl> <col> [type] [DEFAULT v] : Append attribute (instant; rows rewritten in background).\n"
+            "DROP COLUMN <tbl> <col>  : Hide attribute now; purged from disk in background.\n"
+            "ALTER TABLE <t> SET LAYOUT COLUMNAR|ROW : Column arrays for analytics.\n"
+            "CREATE [UNIQUE] INDEX <i> ON <tbl> (<col>) : Build a hash index.\n"
+            "CREATE INDEX <i> ON <tbl> USING BTREE (<col>) : Build an ordered index.\n"
+            "DROP INDEX <i>           : Remove a secondary index.\n"
+            "CREATE TABLE <t> (id int PRIMARY KEY, ...) : Define a table.\n"
+            "SELECT <cols> FROM <t> [JOIN ...] [WHERE ...] [GROUP BY ...] [ORDER BY ...] [LIMIT n]\n"
+            "SELECT c, COUNT(*), SUM(x) FROM <t> GROUP BY c : Aggregate per group.\n"
+            "EXPLAIN [ANALYZE] SELECT ... : Show the query plan; ANALYZE runs it and profiles each operator.\n"
+            "INSERT INTO <t> VALUES (...) | {'id': 1} : Commit records.\n"
+            "UPDATE <t> SET c = v [WHERE ...]  : Modify matching records.\n"
+            "DELETE FROM <t> [WHERE ...]       : Remove matching records.\n"
+            f"COPY <t> FROM '<file>' [FORMAT CSV|NDJSON] : Bulk-load a file from {COPY_DIR}/.\n"
+            "BEGIN / COMMIT / ROLLBACK : Group row changes into one transaction (needs an X-Session-Id).\n"
             "CLEAR                    : Wipe terminal history."
         )}
 
-    # --- 1. INTROSPECTION ---
-    if cmd_upper == "SHOW DATABASES":
-        dbs = db.list_databases()
-        msg = "Available Databases:\n" + "\n".join([f" • {d}" for d in dbs])
-        return {"status": "success", "message": msg}
+    # --- 1. EVERYTHING ELSE GOES THROUGH THE SQL PLANNER ---
+    session = session_for(x_session_id)
+    try:
+        if not x_session_id and isinstance(planner.parse(raw_cmd), sql.Begin):
+            raise ValueError("Transactions need a session: send an X-Session-Id header with every command.")
+        result = session.execute(raw_cmd)
+    except SQLSyntaxError as e:
+        return {"status": "error", "message": f"Command not recognized: {raw_cmd} ({e})"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if cmd_upper == "SHOW TABLES":
-        if not db.active_db:
-            raise HTTPException(status_code=400, detail="No active session. Use 'USE <db>'")
-        tables = list(db.schemas.keys())
-        msg = f"Tables in '{db.active_db}':\n" + ("\n".join([f" • {t}" for t in tables]) if tables else " (empty set)")
+    if result.items is not None:
+        msg = f"{result.message}:\n" + ("\n".join([f" • {i}" for i in result.items]) if result.items else " (empty set)")
         return {"status": "success", "message": msg}
-
-    # --- 2. SCHEMA EVOLUTION (New Features) ---
-    
-    # ADD COLUMN <table_name> <column_name>
-    match = re.match(r"ADD\s+COLUMN\s+(\w+)\s+(\w+)", raw_cmd, re.IGNORECASE)
-    if match:
-        if not db.active_db: 
-            raise HTTPException(status_code=400, detail="No active DB")
-        table_name, col_name = match.groups()
-        try:
-            if table_name not in db.schemas:
-                raise HTTPException(status_code=404, detail=f"Table '{table_name}' not found")
-            db.schemas[table_name].columns[col_name] = "str"
-            db.save_metadata()
-            return {"status": "success", "message": f"Attribute '{col_name}' added to {table_name}."}
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
-
-    # DROP COLUMN <table_name> <column_name>
-    match = re.match(r"DROP\s+COLUMN\s+(\w+)\s+(\w+)", raw_cmd, re.IGNORECASE)
-    if match:
-        if not db.active_db: 
-            raise HTTPException(status_code=400, detail="No active DB")
-        table_name, col_name = match.groups()
-        try:
-            msg = db.remove_column(table_name, col_name)
-            return {"status": "success", "message": msg}
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
-
-    # --- 3. CORE ENGINE OPS ---
-    
-    # USE <db_name>
-    match = re.match(r"USE\s+(\w+)", raw_cmd, re.IGNORECASE)
-    if match:
-        db_name = match.group(1)
-        if db_name not in db.list_databases():
-            raise HTTPException(status_code=404, detail=f"Database '{db_name}' not found.")
-        db.set_active_db(db_name)
-        return {"status": "success", "message": f"Switched to database: {db_name}"}
-
-    # SELECT FROM <table_name>
-    match = re.match(r"SELECT\s+FROM\s+(\w+)", raw_cmd, re.IGNORECASE)
-    if match:
-        if not db.active_db: 
-            raise HTTPException(status_code=400, detail="No active DB")
-        table_name = match.group(1)
-        rows = db.select(table_name)
-        return {"status": "success", "message": f"Fetched {len(rows)} records from disk."}
-
-    # INSERT INTO <table_name> {data}
-    match = re.match(r"INSERT\s+INTO\s+(\w+)\s+(.+)", raw_cmd, re.IGNORECASE)
-    if match:
-        table_name = match.group(1)
-        try:
-            data = ast.literal_eval(match.group(2))
-            msg = db.insert(table_name, data)
-            return {"status": "success", "message": msg}
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Data Error: {str(e)}")
-
-    return {"status": "error", "message": f"Command not recognized: {raw_cmd}"}
\ No newline at end of file
+    return result_payload(result)
@@ -53,6 +53,8 @@ import {
 } from "@/components/ui/alert-dialog";
 
 const API_URL = "http://localhost:8000";
+// Keeps this tab's shell context (USE, BEGIN ... COMMIT) on the server
+const SHELL_SESSION_ID = crypto.randomUUID();
 
 const App = () => {
   // --- SYSTEM STATES ---
@@ -374,7 +376,11 @@ const App = () => {
     setTerminalHistory((prev) => [...prev, { type: "user", text: `➜ ${cmd}` }]);
 
     try {
-      const res = await axios.post(`${API_URL}/shell`, { command: cmd });
+      const res = await axios.post(
+        `${API_URL}/shell`,
+        { command: cmd },
+        { headers: { "X-Session-Id": SHELL_SESSION_ID } },
+      );
       if (cmdUpper.startsWith("USE ")) {
         const dbName = cmd.split(" ")[1];
         setActiveDb(dbName);